@@ -0,0 +1,161 @@
+import asyncio
+import json
+import random
+import time
+from contextlib import asynccontextmanager
+import aiohttp
+from telemetry import TELEMETRY
+
+# ---------------- CONFIG ---------------- #
+RATE_PER_SEC = 50.0        # sustained requests per second (token refill)
+BURST = 100                # bucket capacity
+MAX_RETRIES = 4            # retries after the first attempt
+BACKOFF_BASE = 0.5         # seconds; attempt n waits up to base * 2**n
+BACKOFF_CAP = 30.0         # seconds, upper bound for one wait
+REQUEST_TIMEOUT = 10       # seconds, per attempt
+MIN_CONCURRENCY = 2
+TARGET_LATENCY = 2.0       # seconds; slower responses shrink the window
+CUT_COOLDOWN = 1.0         # seconds between two halvings of the window
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ApiError(Exception):
+    """Request still failing after all retries."""
+
+# ---------------- LIMITERS ---------------- #
+class TokenBucket:
+    """Caps the request rate at rate/s with bursts of up to burst requests."""
+
+    def __init__(self, rate=RATE_PER_SEC, burst=BURST):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrency:
+    """
+    In-flight request window sized by AIMD: it grows by about one slot per
+    window of fast successes and is halved on throttling (429/5xx/timeouts)
+    or cut by 10% when latency exceeds target_latency. Failures arriving
+    together count as one signal: the window is halved at most once per
+    CUT_COOLDOWN.
+    """
+
+    def __init__(self, max_limit, min_limit=MIN_CONCURRENCY, target_latency=TARGET_LATENCY):
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = min(min_limit, self.max_limit)
+        self.target_latency = target_latency
+        self.limit = float(max(self.min_limit, self.max_limit // 4))
+        self.last_cut = 0.0
+        self.in_flight = 0
+        self.cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        async with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def on_success(self, latency):
+        if latency <= self.target_latency:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self.last_cut >= CUT_COOLDOWN:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self.last_cut = now
+
+# ---------------- CLIENT ---------------- #
+class ApiClient:
+    """
+    GETs through the token bucket and the adaptive window, retrying
+    429/5xx, timeouts and connection errors with full-jitter exponential
+    backoff (Retry-After is honoured). Other statuses, 404 included, are
+    returned to the caller.
+    """
+
+    def __init__(self, session, max_concurrency, rate=RATE_PER_SEC, burst=BURST, retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_cap=BACKOFF_CAP):
+        self.session = session
+        self.bucket = TokenBucket(rate, burst)
+        self.window = AdaptiveConcurrency(max_concurrency)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(self.backoff_cap, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def get(self, url):
+        """(status, body bytes) for url."""
+        reason = None
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            status, body, retry_after = None, None, None
+            async with self.window:
+                t0 = time.perf_counter()
+                try:
+                    async with self.session.get(url) as r:
+                        status = r.status
+                        retry_after = r.headers.get("Retry-After")
+                        body = await r.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    reason = type(e).__name__
+                latency = time.perf_counter() - t0
+            TELEMETRY.observe("api_request_seconds", latency)
+
+            if status is not None and status not in RETRY_STATUSES:
+                self.window.on_success(latency)
+                return status, body
+            if status is not None:
+                reason = str(status)
+            self.window.on_throttle()
+            if attempt == self.retries:
+                break
+            TELEMETRY.inc("api_retries_total", reason=reason)
+            await asyncio.sleep(self.backoff(attempt, retry_after))
+        raise ApiError(f"{url}: giving up after {self.retries + 1} attempts ({reason})")
+
+
+@asynccontextmanager
+async def open_client(max_concurrency, timeout=REQUEST_TIMEOUT, **kwargs):
+    """ApiClient over one keep-alive session sized for max_concurrency."""
+    connector = aiohttp.TCPConnector(limit=max_concurrency, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        yield ApiClient(session, max_concurrency, **kwargs)
+
+
+def get_json(url, timeout=30, **kwargs):
+    """Blocking GET of one JSON document with the same retry policy."""
+    async def run():
+        async with open_client(1, timeout=timeout, **kwargs) as client:
+            status, body = await client.get(url)
+        if status != 200:
+            raise ApiError(f"{url}: HTTP {status}")
+        return json.loads(body)
+    return asyncio.run(run())
@@ -0,0 +1,128 @@
+from datetime import date, timedelta
+import json
+import numpy as np
+from ingest import ingest, parse_day
+from response_cache import FETCHED, REFETCH_RECENT_DAYS
+
+# ---------------- CONFIG ---------------- #
+FULL_DAY = (1 << 24) - 1   # all 24 hour bits set
+BACKFILL_BATCH = 20000     # (scno, date) jobs dispatched to the fetcher per batch
+
+# Hour bitmap per stored day, derived from the NULL slots of the daily profile
+COVERAGE_SQL = """
+    SELECT d.scno, d.date - %s,
+           (SELECT COALESCE(SUM(1 << (u.h - 1)::int), 0)
+            FROM unnest(d.profile) WITH ORDINALITY AS u(v, h)
+            WHERE u.v IS NOT NULL)
+    FROM consumption_daily d
+    WHERE d.scno = ANY(%s) AND d.date BETWEEN %s AND %s;
+"""
+
+# ---------------- COVERAGE INDEX ---------------- #
+class Coverage:
+    """
+    Days x 24 hours present per scno over [start_date, end_date]. bits[i, d]
+    has bit h set when scnos[i] has hour h stored on start_date + d days.
+    """
+
+    __slots__ = ("scnos", "index", "start_date", "bits")
+
+    def __init__(self, scnos, start_date, end_date):
+        self.scnos = list(scnos)
+        self.index = {scno: i for i, scno in enumerate(self.scnos)}
+        self.start_date = start_date
+        n_days = max((end_date - start_date).days + 1, 0)
+        self.bits = np.zeros((len(self.scnos), n_days), dtype=np.uint32)
+
+    def gaps(self, partial=True):
+        """
+        Missing (scno, date) jobs, ordered by scno then date: days with no
+        hours at all, plus days with only some hours when partial is set.
+        """
+        holes = self.bits != FULL_DAY if partial else self.bits == 0
+        rows, days = np.nonzero(holes)
+        return [
+            (self.scnos[i], self.start_date + timedelta(days=int(d)))
+            for i, d in zip(rows.tolist(), days.tolist())
+        ]
+
+    def summary(self):
+        """(complete, partial, empty) day counts."""
+        full = int((self.bits == FULL_DAY).sum())
+        empty = int((self.bits == 0).sum())
+        return full, self.bits.size - full - empty, empty
+
+
+def load_coverage(conn, scnos, start_date, end_date):
+    """Build the Coverage index for scnos from consumption_daily in one query."""
+    cov = Coverage(scnos, start_date, end_date)
+    if not cov.scnos or cov.bits.shape[1] == 0:
+        return cov
+    cur = conn.cursor()
+    cur.execute(COVERAGE_SQL, (start_date, cov.scnos, start_date, end_date))
+    rows = cur.fetchall()
+    cur.close()
+    if rows:
+        idx = np.fromiter((cov.index[r[0]] for r in rows), dtype=np.int64, count=len(rows))
+        day = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        cov.bits[idx, day] = np.fromiter((r[2] for r in rows), dtype=np.uint32, count=len(rows))
+    return cov
+
+def body_bits(body):
+    """Hour bitmap of the rows a cached response body parses to."""
+    hours, _, _ = parse_day(json.loads(body))
+    return int(np.bitwise_or.reduce(np.left_shift(1, hours.astype(np.int64)), initial=0))
+
+# ---------------- PLAN / DISPATCH ---------------- #
+def settled(cov, jobs, cache, today=None):
+    """
+    The jobs whose partial day the ResponseCache already explains: cached as
+    fetched, older than REFETCH_RECENT_DAYS, and with a body that holds no
+    hour consumption lacks. The API answered those days with hours missing
+    and a new request would only get the same answer back.
+    """
+    recent = (today or date.today()) - timedelta(days=REFETCH_RECENT_DAYS)
+    known = cache.statuses({scno for scno, _ in jobs})
+    out = set()
+    for scno, day in jobs:
+        date_str = day.strftime("%Y-%m-%d")
+        if day >= recent or known.get((scno, date_str)) != FETCHED:
+            continue
+        body = cache.get(scno, date_str)
+        if body is None:
+            continue
+        have = int(cov.bits[cov.index[scno], (day - cov.start_date).days])
+        if not body_bits(body) & ~have:
+            out.add((scno, day))
+    return out
+
+
+def plan_backfill(conn, scnos, start_date, end_date, partial=True, cache=None, today=None):
+    """
+    Exact (scno, date) set missing from consumption over the window. With a
+    ResponseCache, partial days it has settled (see settled()) are left out,
+    so a day the API always serves incomplete is not fetched every run.
+    """
+    cov = load_coverage(conn, scnos, start_date, end_date)
+    jobs = cov.gaps(partial)
+    if cache is not None and jobs:
+        skip = settled(cov, jobs, cache, today)
+        jobs = [job for job in jobs if job not in skip]
+    return jobs
+
+
+def backfill(jobs, conn, batch_jobs=BACKFILL_BATCH, **fetch_kwargs):
+    """
+    Dispatch planned jobs to ingest in batches of batch_jobs, so a large
+    backfill keeps a bounded number of requests in flight and commits as it
+    goes. fetch_kwargs go to ingest (api, cache, ...). Planned days are
+    missing hours in consumption, so a ResponseCache does not skip them for
+    having been fetched before; plan_backfill() given the same cache keeps
+    out the partial days re-requesting cannot fill. Returns
+    {scno: rows_upserted}.
+    """
+    counts = {}
+    for i in range(0, len(jobs), batch_jobs):
+        for scno, n in ingest(jobs[i:i + batch_jobs], conn, refetch_fetched=True, **fetch_kwargs).items():
+            counts[scno] = counts.get(scno, 0) + n
+    return counts
@@ -0,0 +1,301 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from flex_engine import (
+    PEAK_HOURS, build_cube, prepare_cube, lf_from_cube, lvi_from_cube,
+    dlss_from_cube, peak_ratio_from_cube, calculate_flexibility_batch,
+)
+from flexibility_pred import rank_clients
+from ingest import parse_daily
+
+# ---------------- CONFIG ---------------- #
+DEFAULT_SIZES = ["100x60", "1000x60", "10000x60"]
+PARSE_SAMPLE_DAYS = 20000     # client-days rendered to JSON for the parse stage
+INSERT_BATCH = 5000           # rows per COPY batch, as in ingest.UPSERT_BATCH
+BENCH_SCHEMA = "flex_bench"   # scratch schema when benchmarking against Postgres
+
+METRIC_COLUMNS = ["scno", "lf", "lvi", "dlss", "flexibility_index", "flexibility_rank"]
+
+# ---------------- SYNTHETIC DATA ---------------- #
+def generate(n_clients, n_days, seed=0, start_date="2024-01-01"):
+    """
+    Deterministic long (scno, date, hour, consumption) frame for n_clients
+    x n_days x 24 hours. Each client gets a base load, morning and evening
+    peaks of its own size, a weekend dip, multiplicative noise, idle (all
+    zero) days, stray zero hours and missing days and hours.
+    """
+    rng = np.random.default_rng(seed)
+    hours = np.arange(24)
+    dates = pd.date_range(start_date, periods=n_days, freq="D")
+    weekend = np.asarray(dates.dayofweek >= 5)
+
+    base = rng.lognormal(3.0, 1.0, n_clients)
+    am = rng.uniform(0.0, 1.5, n_clients)
+    pm = rng.uniform(0.0, 2.0, n_clients)
+    shape = 1 + am[:, None] * np.exp(-((hours - 8) / 2.0) ** 2) + pm[:, None] * np.exp(-((hours - 19) / 2.5) ** 2)
+    dip = np.where(weekend[None, :], rng.uniform(0.3, 1.0, n_clients)[:, None], 1.0)
+
+    cube = base[:, None, None] * shape[:, None, :] * dip[:, :, None]
+    cube *= rng.lognormal(0.0, 0.15, cube.shape)
+    cube[rng.random((n_clients, n_days)) < 0.03] = 0.0          # idle days
+    cube[rng.random(cube.shape) < 0.01] = 0.0                   # zero hours
+
+    present = rng.random((n_clients, n_days)) >= 0.02           # missing days
+    present = present[:, :, None] & (rng.random(cube.shape) >= 0.01)  # missing hours
+
+    c, d, h = np.nonzero(present)
+    scnos = np.array([f"BENCH{i:06d}" for i in range(n_clients)])
+    return pd.DataFrame({
+        "scno": pd.Categorical.from_codes(c, scnos),
+        "date": dates.values[d],
+        "hour": h.astype(np.int8),
+        "consumption": cube[c, d, h],
+    })
+
+# ---------------- TIMING ---------------- #
+@contextmanager
+def timed(stages, name):
+    t0 = time.perf_counter()
+    yield
+    stages[name] = round(time.perf_counter() - t0, 6)
+
+
+def _parse_sample(df, max_days):
+    """API-shaped JSON bodies for up to max_days client-days of df."""
+    keys = df[["scno", "date"]].drop_duplicates().head(max_days)
+    part = df.merge(keys, on=["scno", "date"])
+    bodies = []
+    for (scno, day), g in part.groupby(["scno", "date"], observed=True, sort=False):
+        payload = [{"hour": f"{h:02d}:00", "consumption": str(v)} for h, v in zip(g["hour"], g["consumption"])]
+        bodies.append((scno, day.strftime("%Y-%m-%d"), json.dumps(payload).encode()))
+    return bodies
+
+# ---------------- STORAGE BACKENDS ---------------- #
+class SQLiteBackend:
+    """Local stand-in with the production table shapes."""
+
+    name = "sqlite"
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="flex_bench_")
+        self.db = sqlite3.connect(os.path.join(self.dir, "bench.sqlite3"))
+        self.db.executescript("""
+            CREATE TABLE consumption (scno TEXT, date TEXT, hour INTEGER, consumption REAL,
+                                      PRIMARY KEY (scno, date, hour));
+            CREATE TABLE flexibility_metrics (scno TEXT PRIMARY KEY, lf REAL, lvi REAL, dlss REAL,
+                                              flexibility_index REAL, flexibility_rank INTEGER);
+        """)
+
+    def write_consumption(self, rows):
+        for i in range(0, len(rows), INSERT_BATCH):
+            self.db.executemany("""
+                INSERT INTO consumption VALUES (?, ?, ?, ?)
+                ON CONFLICT (scno, date, hour) DO UPDATE SET consumption = excluded.consumption;
+            """, rows[i:i + INSERT_BATCH])
+            self.db.commit()
+
+    def load(self):
+        df = pd.read_sql("SELECT scno, date, hour, consumption FROM consumption;", self.db, parse_dates=["date"])
+        return df.astype({"scno": "category", "hour": "int8"})
+
+    def write_metrics(self, rows):
+        self.db.executemany(f"""
+            INSERT INTO flexibility_metrics VALUES ({', '.join('?' * len(METRIC_COLUMNS))})
+            ON CONFLICT (scno) DO UPDATE SET
+            {', '.join(f'{c} = excluded.{c}' for c in METRIC_COLUMNS[1:])};
+        """, rows)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class PostgresBackend:
+    """The real write/load path (ingest upsert, COPY load, staged upsert) in a scratch schema."""
+
+    name = "postgres"
+
+    def __init__(self, dsn):
+        import psycopg2
+        self.conn = psycopg2.connect(dsn)
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;
+            CREATE SCHEMA {BENCH_SCHEMA};
+            SET search_path TO {BENCH_SCHEMA};
+            CREATE TABLE consumption (scno VARCHAR, date DATE, hour INTEGER, consumption DOUBLE PRECISION,
+                                      PRIMARY KEY (scno, date, hour));
+            CREATE TABLE flexibility_metrics (scno VARCHAR PRIMARY KEY, lf DOUBLE PRECISION,
+                                              lvi DOUBLE PRECISION, dlss DOUBLE PRECISION,
+                                              flexibility_index DOUBLE PRECISION, flexibility_rank INTEGER,
+                                              calculated_at TIMESTAMP);
+        """)
+        self.conn.commit()
+        cur.close()
+
+    def write_consumption(self, rows):
+        from db import CONSUMPTION_COLUMNS, upsert_rows
+        for i in range(0, len(rows), INSERT_BATCH):
+            upsert_rows(self.conn, "consumption", CONSUMPTION_COLUMNS, rows[i:i + INSERT_BATCH],
+                        key=("scno", "date", "hour"), stamp=None)
+            self.conn.commit()
+
+    def load(self):
+        from db import load_consumption
+        return load_consumption(self.conn)
+
+    def write_metrics(self, rows):
+        from db import upsert_rows
+        upsert_rows(self.conn, "flexibility_metrics", METRIC_COLUMNS, rows)
+        self.conn.commit()
+
+    def close(self):
+        cur = self.conn.cursor()
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+        self.conn.commit()
+        self.conn.close()
+
+# ---------------- BENCHMARK ---------------- #
+def run_size(n_clients, n_days, backend=None, seed=0):
+    """Time every stage for one size; returns a result dict."""
+    stages = {}
+    with timed(stages, "generate"):
+        df = generate(n_clients, n_days, seed)
+
+    bodies = _parse_sample(df, PARSE_SAMPLE_DAYS)
+    with timed(stages, "parse"):
+        for scno, date_str, body in bodies:
+            parse_daily(scno, date_str, json.loads(body))
+
+    if backend is not None:
+        rows = list(zip(df["scno"].astype(str), df["date"].dt.strftime("%Y-%m-%d"),
+                        df["hour"].astype(int), df["consumption"]))
+        with timed(stages, "write_consumption"):
+            backend.write_consumption(rows)
+        del rows
+        with timed(stages, "load"):
+            df = backend.load()
+
+    with timed(stages, "cube"):
+        scnos, _, cube, present = build_cube(df)
+        x, present, day_mask, hour_mask, n_days_c = prepare_cube(cube, present)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        with timed(stages, "lf"):
+            lf = lf_from_cube(x, present, day_mask)
+        with timed(stages, "lvi"):
+            lvi = lvi_from_cube(x, day_mask, n_days_c)
+        with timed(stages, "dlss"):
+            dlss = dlss_from_cube(x, day_mask, hour_mask, n_days_c)
+        with timed(stages, "peak_ratio"):
+            peak_ratio_from_cube(x, PEAK_HOURS)
+    del cube, x, present
+
+    with timed(stages, "metrics_batch"):
+        calculate_flexibility_batch(df)
+
+    metrics = pd.DataFrame({"scno": np.asarray(scnos), "LF": lf, "LVI": lvi, "DLSS": dlss})
+    with timed(stages, "rank"):
+        ranked = rank_clients(metrics)
+
+    if backend is not None:
+        out = [
+            (r.scno, float(r.LF), float(r.LVI), float(r.DLSS), float(r.Flexibility_Index), int(r.Flexibility_Rank))
+            for r in ranked.itertuples(index=False)
+        ]
+        with timed(stages, "write_metrics"):
+            backend.write_metrics(out)
+
+    return {
+        "clients": n_clients,
+        "days": n_days,
+        "rows": int(len(df)),
+        "parse_days": len(bodies),
+        "backend": backend.name if backend is not None else None,
+        "stages": stages,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(old_path, report):
+    """Print per-stage new/old time ratios against an earlier JSON report (same size and backend)."""
+    with open(old_path) as f:
+        old = {(r["clients"], r["days"], r["backend"]): r["stages"] for r in json.load(f)["results"]}
+    for r in report["results"]:
+        prev = old.get((r["clients"], r["days"], r["backend"]))
+        if prev is None:
+            continue
+        print(f"\n📊 {r['clients']} clients x {r['days']} days vs {old_path}")
+        for stage, secs in r["stages"].items():
+            if prev.get(stage):
+                print(f"   {stage:<18} {prev[stage]:>10.4f}s -> {secs:>10.4f}s  ({secs / prev[stage]:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the metric, ranking and write paths on synthetic meters.")
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES),
+                        help="comma-separated CLIENTSxDAYS sizes (default: %(default)s)")
+    parser.add_argument("--backend", choices=["none", "sqlite", "postgres"], default="sqlite",
+                        help="storage for the write/load stages (default: sqlite stand-in)")
+    parser.add_argument("--dsn", default=os.environ.get("FLEX_BENCH_DSN", ""),
+                        help="Postgres DSN for --backend postgres (env FLEX_BENCH_DSN)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON report path (default: bench_<commit>_<time>.json)")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes.split(","):
+        n_clients, n_days = (int(v) for v in size.lower().split("x"))
+        backend = None
+        if args.backend == "sqlite":
+            backend = SQLiteBackend()
+        elif args.backend == "postgres":
+            backend = PostgresBackend(args.dsn)
+        print(f"⏱ {n_clients} clients x {n_days} days ({args.backend})...")
+        try:
+            result = run_size(n_clients, n_days, backend, args.seed)
+        finally:
+            if backend is not None:
+                backend.close()
+        results.append(result)
+        print("   " + ", ".join(f"{k} {v:.3f}s" for k, v in result["stages"].items()))
+
+    report = {
+        "commit": _git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    out = args.out or f"bench_{report['commit'] or 'nogit'}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results written to {out}")
+    if args.compare:
+        compare(args.compare, report)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 import threading
-import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from psycopg2.extras import execute_values
 import psycopg2
+from daily_store import ensure_daily_tables, load_hourly_stats, refresh_daily
+from flex_engine import HourlySeries
+from db import make_pool, with_pooled_conn, upsert_rows
+from rank_index import notify_rank_change
+from telemetry import TELEMETRY
 
 # --------------------------------------------------
 # DATABASE CONFIG
@@ -18,6 +22,8 @@ DB_CONFIG = {
 }
 
 MAX_WORKERS = 10
+REPORT_PATH = "categories_run.json"   # run telemetry; use a .prom name for Prometheus text
+STATS_FALLBACK = False   # True: aggregate the raw hourly rows instead of consumption_stats
 lock = threading.Lock()
 
 
@@ -111,6 +117,7 @@ def process_client(scno, name, fetch_start, fetch_end, conn):
                 ON CONFLICT (scno, date, hour)
                 DO UPDATE SET consumption = EXCLUDED.consumption;
             """, new_data)
+            refresh_daily(cur, {(r[0], r[1]) for r in new_data})
             conn.commit()
 
             with lock:
@@ -119,43 +126,46 @@ def process_client(scno, name, fetch_start, fetch_end, conn):
             with lock:
                 print(f"⏩ {name} ({scno}) — up-to-date.")
 
-        # Load consumption for stats
-        df = pd.read_sql(
-            "SELECT consumption FROM consumption WHERE scno=%s;",
-            conn, params=(scno,)
-        )
+    except Exception as e:
+        print(f"❌ Error {scno}: {e}")
 
-        if df.empty:
-            return None
 
-        # Compute stats
-        avg_c = float(df["consumption"].mean())
-        sd_c = float(df["consumption"].std() if len(df) > 1 else 0.0)
+# --------------------------------------------------
+# CATEGORIZE A SINGLE CLIENT
+# --------------------------------------------------
+def categorize_client(scno, name, df):
+    """Category row from the client's consumption frame or HourlySeries."""
+    if df is None or len(df) == 0:
+        return None
 
-        # ---- FIXED: CV instead of SD ----
-        cv = float((sd_c / avg_c) * 100) if avg_c != 0 else 0.0
+    # Compute stats; hours without a value are left out, as in consumption_stats
+    cons = df.present_values() if isinstance(df, HourlySeries) else df["consumption"].dropna()
+    if len(cons) == 0:
+        return None
+    avg_c = float(cons.mean())
+    sd_c = float(cons.std(ddof=1) if len(cons) > 1 else 0.0)
+    return categorize_stats(scno, name, avg_c, sd_c)
 
-        cons_level = get_consumption_level(avg_c)
-        var_level = get_variability_level(cv)
 
-        final_cat = f"{cons_level} Consumer — {var_level} Variability"
+def categorize_stats(scno, name, avg_c, sd_c):
+    """Category row from the mean and sample std of the client's hourly consumption."""
+    # ---- FIXED: CV instead of SD ----
+    cv = float((sd_c / avg_c) * 100) if avg_c != 0 else 0.0
 
-        return {
-            "scno": scno,
-            "name": name,
-            "avg_consumption": avg_c,
-            "variability": cv,        # Store CV, not SD
-            "consumption_level": cons_level,
-            "variability_level": var_level,
-            "final_category": final_cat
-        }
+    cons_level = get_consumption_level(avg_c)
+    var_level = get_variability_level(cv)
 
-    except Exception as e:
-        print(f"❌ Error {scno}: {e}")
-        return None
+    final_cat = f"{cons_level} Consumer — {var_level} Variability"
 
-    finally:
-        conn.close()
+    return {
+        "scno": scno,
+        "name": name,
+        "avg_consumption": avg_c,
+        "variability": cv,        # Store CV, not SD
+        "consumption_level": cons_level,
+        "variability_level": var_level,
+        "final_category": final_cat
+    }
 
 
 # --------------------------------------------------
@@ -177,50 +187,49 @@ def main():
 
     print(f"\n🚀 Processing {len(clients)} clients...\n")
 
-    results = []
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    pool = make_pool(DB_CONFIG, MAX_WORKERS)
+    with TELEMETRY.stage("ingest"), ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         futures = [
             executor.submit(
-                process_client, scno, name, start_date, end_date, get_conn()
+                with_pooled_conn, pool, process_client,
+                scno, name, start_date, end_date
             )
             for scno, name in clients
         ]
 
         for future in as_completed(futures):
-            r = future.result()
-            if r:
-                results.append(r)
+            future.result()
+    pool.closeall()
 
-    # Insert results
-    for r in results:
-        cur.execute("""
-            INSERT INTO client_categories
-            (scno, name, avg_consumption, variability,
-             consumption_level, variability_level, final_category, calculated_at)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,NOW())
-            ON CONFLICT (scno) DO UPDATE
-            SET avg_consumption = EXCLUDED.avg_consumption,
-                variability = EXCLUDED.variability,
-                consumption_level = EXCLUDED.consumption_level,
-                variability_level = EXCLUDED.variability_level,
-                final_category = EXCLUDED.final_category,
-                calculated_at = NOW();
-        """, (
-            r["scno"],
-            r["name"],
-            float(r["avg_consumption"]),
-            float(r["variability"]),  # CV
-            r["consumption_level"],
-            r["variability_level"],
-            r["final_category"]
-        ))
+    # Mean / std per client: one stored row each, kept current by refresh_daily
+    with TELEMETRY.stage("stats"):
+        ensure_daily_tables(conn)
+        stats = load_hourly_stats(conn, scnos=[scno for scno, _ in clients], fallback=STATS_FALLBACK)
 
-    conn.commit()
+    results = []
+    for scno, name in clients:
+        if scno in stats:
+            _, avg_c, sd_c = stats[scno]
+            results.append(categorize_stats(scno, name, avg_c, sd_c))
+
+    # Insert results
+    columns = [
+        "scno", "name", "avg_consumption", "variability",
+        "consumption_level", "variability_level", "final_category",
+    ]
+    with TELEMETRY.stage("write"):
+        upsert_rows(
+            conn, "client_categories", columns,
+            [tuple(r[c] for c in columns) for r in results],
+            update=columns[2:],
+        )
+        conn.commit()
+        notify_rank_change(conn)
     cur.close()
     conn.close()
 
     print("\n✅ Finished! Categories updated.\n")
+    print(f"📈 Run report written to {TELEMETRY.write_report(REPORT_PATH)}")
 
 
 if __name__ == "__main__":
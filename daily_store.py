@@ -0,0 +1,332 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import groupby
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+from flex_engine import FlexState, RollingFlex, ROLLING_WINDOWS, fold_many
+
+# ---------------- SCHEMA ---------------- #
+DAILY_DDL = """
+    CREATE TABLE IF NOT EXISTS consumption_daily (
+        scno VARCHAR,
+        date DATE,
+        n_hours SMALLINT,
+        day_sum DOUBLE PRECISION,
+        day_max DOUBLE PRECISION,
+        day_mean DOUBLE PRECISION,
+        day_sumsq DOUBLE PRECISION,
+        profile DOUBLE PRECISION[],
+        updated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (scno, date)
+    );
+    ALTER TABLE consumption_daily ADD COLUMN IF NOT EXISTS day_m2 DOUBLE PRECISION;
+    ALTER TABLE consumption_daily ADD COLUMN IF NOT EXISTS n_valid SMALLINT;
+
+    CREATE TABLE IF NOT EXISTS consumption_stats (
+        scno VARCHAR PRIMARY KEY,
+        n BIGINT,
+        mean DOUBLE PRECISION,
+        m2 DOUBLE PRECISION,
+        updated_at TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS flexibility_state (
+        scno VARCHAR PRIMARY KEY,
+        through_date DATE,
+        n_days INTEGER,
+        lf_sum DOUBLE PRECISION,
+        lf_n INTEGER,
+        tot_mean DOUBLE PRECISION,
+        tot_m2 DOUBLE PRECISION,
+        hour_sum DOUBLE PRECISION[],
+        unit_sum DOUBLE PRECISION[],
+        unit_n INTEGER,
+        hour_mask BOOLEAN[],
+        updated_at TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS flexibility_windows (
+        scno VARCHAR,
+        window_days INTEGER,
+        lf DOUBLE PRECISION,
+        lvi DOUBLE PRECISION,
+        dlss DOUBLE PRECISION,
+        peak_ratio DOUBLE PRECISION,
+        calculated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (scno, window_days)
+    );
+"""
+
+# 24-slot profile, NULL where the hour has no row
+PROFILE_SQL = ", ".join(
+    f"SUM(COALESCE(c.consumption, 0)) FILTER (WHERE c.hour = {h})" for h in range(24)
+)
+
+# n_hours..day_sumsq and profile count NULL hours as 0 (the flexibility
+# metrics' view of a day); n_valid and day_m2 cover only hours with a value
+# and feed consumption_stats. day_sum is the sum of those values either way.
+# A re-upserted day whose summary comes out the same keeps its updated_at, so
+# update_states() and the summary view refresh do not see it as changed.
+REFRESH_DAILY_SQL = """
+    INSERT INTO consumption_daily
+        (scno, date, n_hours, day_sum, day_max, day_mean, day_sumsq, n_valid, day_m2, profile, updated_at)
+    SELECT c.scno, c.date, COUNT(*),
+           SUM(COALESCE(c.consumption, 0)),
+           MAX(COALESCE(c.consumption, 0)),
+           AVG(COALESCE(c.consumption, 0)),
+           SUM(COALESCE(c.consumption, 0) ^ 2),
+           COUNT(*) FILTER (WHERE c.consumption IS NOT NULL),
+           COALESCE(var_pop(c.consumption) FILTER (WHERE c.consumption IS NOT NULL), 0)
+               * COUNT(*) FILTER (WHERE c.consumption IS NOT NULL),
+           ARRAY[{profile}],
+           clock_timestamp()
+    FROM consumption c
+    {join}
+    GROUP BY c.scno, c.date
+    ON CONFLICT (scno, date) DO UPDATE
+    SET n_hours = EXCLUDED.n_hours,
+        day_sum = EXCLUDED.day_sum,
+        day_max = EXCLUDED.day_max,
+        day_mean = EXCLUDED.day_mean,
+        day_sumsq = EXCLUDED.day_sumsq,
+        n_valid = EXCLUDED.n_valid,
+        day_m2 = EXCLUDED.day_m2,
+        profile = EXCLUDED.profile,
+        updated_at = EXCLUDED.updated_at
+    WHERE (consumption_daily.n_hours, consumption_daily.day_sum, consumption_daily.day_max,
+           consumption_daily.day_mean, consumption_daily.day_sumsq, consumption_daily.n_valid,
+           consumption_daily.day_m2, consumption_daily.profile)
+          IS DISTINCT FROM
+          (EXCLUDED.n_hours, EXCLUDED.day_sum, EXCLUDED.day_max, EXCLUDED.day_mean,
+           EXCLUDED.day_sumsq, EXCLUDED.n_valid, EXCLUDED.day_m2, EXCLUDED.profile);
+"""
+
+# Count / mean / M2 of the non-NULL hourly values per scno, merged from the
+# per-day partials (Chan et al.): M2 = sum(day_m2) + sum(n_valid * (day_sum / n_valid - mean)^2).
+# A client without any value gets n = 0 and a NULL mean.
+REFRESH_STATS_SQL = """
+    INSERT INTO consumption_stats (scno, n, mean, m2, updated_at)
+    SELECT d.scno, t.n, t.mean,
+           COALESCE(SUM(d.day_m2 + d.n_valid * (d.day_sum / d.n_valid - t.mean) ^ 2)
+                    FILTER (WHERE d.n_valid > 0), 0),
+           clock_timestamp()
+    FROM consumption_daily d
+    JOIN (
+        SELECT scno, SUM(n_valid) AS n, SUM(day_sum) / NULLIF(SUM(n_valid), 0) AS mean
+        FROM consumption_daily
+        {where}
+        GROUP BY scno
+    ) t ON t.scno = d.scno
+    GROUP BY d.scno, t.n, t.mean
+    ON CONFLICT (scno) DO UPDATE
+    SET n = EXCLUDED.n,
+        mean = EXCLUDED.mean,
+        m2 = EXCLUDED.m2,
+        updated_at = EXCLUDED.updated_at
+    WHERE (consumption_stats.n, consumption_stats.mean, consumption_stats.m2)
+          IS DISTINCT FROM (EXCLUDED.n, EXCLUDED.mean, EXCLUDED.m2);
+"""
+
+# Fallback straight from the hourly rows, one grouped pass over the non-NULL values
+HOURLY_STATS_SQL = """
+    SELECT scno, COUNT(*), AVG(consumption), stddev_samp(consumption)
+    FROM consumption
+    WHERE consumption IS NOT NULL {where}
+    GROUP BY scno;
+"""
+
+STATE_COLUMNS = [
+    "scno", "through_date", "n_days", "lf_sum", "lf_n", "tot_mean", "tot_m2",
+    "hour_sum", "unit_sum", "unit_n", "hour_mask", "updated_at",
+]
+
+
+def ensure_daily_tables(conn):
+    """
+    Create the summary tables and build them from consumption on first use,
+    or when the days predate day_m2 / n_valid / consumption_stats.
+    """
+    cur = conn.cursor()
+    cur.execute(DAILY_DDL)
+    cur.execute("""
+        SELECT NOT EXISTS (SELECT 1 FROM consumption_daily WHERE day_m2 IS NOT NULL)
+            OR EXISTS (SELECT 1 FROM consumption_daily WHERE day_m2 IS NULL OR n_valid IS NULL)
+            OR NOT EXISTS (SELECT 1 FROM consumption_stats);
+    """)
+    if cur.fetchone()[0]:
+        refresh_daily(cur)
+    conn.commit()
+    cur.close()
+
+# ---------------- MAINTAIN ---------------- #
+def refresh_daily(cur, keys=None):
+    """
+    Recompute consumption_daily from consumption for the given (scno, date)
+    keys, or for every day when keys is None, then re-merge consumption_stats
+    for the clients touched. Runs on the caller's cursor so it commits
+    together with the consumption upsert.
+    """
+    if keys is None:
+        cur.execute(REFRESH_DAILY_SQL.format(profile=PROFILE_SQL, join=""))
+        cur.execute(REFRESH_STATS_SQL.format(where=""))
+        return
+    keys = list(keys)
+    if not keys:
+        return
+    join = "JOIN (VALUES %s) AS k(scno, date) ON c.scno = k.scno AND c.date = k.date::date"
+    execute_values(cur, REFRESH_DAILY_SQL.format(profile=PROFILE_SQL, join=join), keys, page_size=len(keys))
+    cur.execute(REFRESH_STATS_SQL.format(where="WHERE scno = ANY(%s)"), (sorted({k[0] for k in keys}),))
+
+
+def load_hourly_stats(conn, scnos=None, fallback=False):
+    """
+    {scno: (n_hours, mean, sample std)} of every non-NULL hourly value, one
+    row per client from consumption_stats, or with fallback=True aggregated
+    from consumption in a single grouped query. Clients without any value
+    are left out.
+    """
+    cur = conn.cursor()
+    where, params = "", []
+    if scnos is not None:
+        where, params = "AND scno = ANY(%s)", [list(scnos)]
+    if fallback:
+        cur.execute(HOURLY_STATS_SQL.format(where=where), params)
+        rows = [(scno, n, mean, sd or 0.0) for scno, n, mean, sd in cur.fetchall()]
+    else:
+        cur.execute(f"SELECT scno, n, mean, m2 FROM consumption_stats WHERE n > 0 {where};", params)
+        rows = [(scno, n, mean, (max(m2, 0.0) / (n - 1)) ** 0.5 if n > 1 else 0.0) for scno, n, mean, m2 in cur.fetchall()]
+    cur.close()
+    return {scno: (int(n), float(mean), float(sd)) for scno, n, mean, sd in rows}
+
+# ---------------- STATE ---------------- #
+def _state_from_row(row):
+    st = FlexState()
+    (_, st.through_date, st.n_days, st.lf_sum, st.lf_n, st.tot_mean, st.tot_m2,
+     hour_sum, unit_sum, st.unit_n, hour_mask, _) = row
+    st.hour_sum = np.array(hour_sum, dtype=np.float64)
+    st.unit_sum = np.array(unit_sum, dtype=np.float64)
+    st.hour_mask = np.array(hour_mask, dtype=bool)
+    return st
+
+
+def _state_to_row(scno, st, as_of):
+    return (
+        scno, st.through_date, st.n_days, st.lf_sum, st.lf_n, st.tot_mean, st.tot_m2,
+        st.hour_sum.tolist(), st.unit_sum.tolist(), st.unit_n,
+        st.hour_mask.tolist(), as_of,
+    )
+
+
+def _fold_rows(states, rows, processes=1):
+    """
+    Fold (scno, date, profile) rows sorted by scno, date into states; with
+    processes > 1 clients are folded in a process pool as compact arrays.
+    Returns the scnos needing a rebuild.
+    """
+    items = []
+    for scno, group in groupby(rows, key=lambda r: r[0]):
+        group = list(group)
+        profiles = np.array([r[2] for r in group], dtype=np.float64)
+        items.append((scno, states.get(scno), [r[1] for r in group], profiles))
+
+    if processes > 1 and len(items) > processes:
+        step = -(-len(items) // processes)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(fold_many, [items[i:i + step] for i in range(0, len(items), step)]))
+    else:
+        results = [fold_many(items)]
+
+    rebuild = []
+    for folded, refused in results:
+        states.update(folded)
+        rebuild.extend(refused)
+    return rebuild
+
+
+def update_states(conn, scnos, processes=1):
+    """
+    Bring each client's FlexState up to date by folding only the daily
+    summaries newer than its stored through_date. A client is rebuilt from
+    all its days when an already-folded day changed since the last save or
+    a new day introduces an hour never seen before. Folding runs in
+    processes worker processes when > 1. Returns {scno: FlexState} and saves
+    the states; the caller commits.
+    """
+    scnos = list(scnos)
+    cur = conn.cursor()
+    cur.execute("SELECT clock_timestamp();")
+    as_of = cur.fetchone()[0]
+
+    cur.execute(f"SELECT {', '.join(STATE_COLUMNS)} FROM flexibility_state WHERE scno = ANY(%s);", (scnos,))
+    states = {row[0]: _state_from_row(row) for row in cur.fetchall()}
+
+    # Old days rewritten since the state was saved (e.g. gap backfill)
+    cur.execute("""
+        SELECT DISTINCT s.scno FROM flexibility_state s
+        JOIN consumption_daily d ON d.scno = s.scno
+        WHERE s.scno = ANY(%s) AND d.date <= s.through_date AND d.updated_at > s.updated_at;
+    """, (scnos,))
+    stale = [r[0] for r in cur.fetchall()]
+    for scno in stale:
+        states.pop(scno, None)
+
+    cur.execute("""
+        SELECT d.scno, d.date, d.profile FROM consumption_daily d
+        LEFT JOIN flexibility_state s ON s.scno = d.scno
+        WHERE d.scno = ANY(%s)
+          AND (s.scno IS NULL OR s.scno = ANY(%s) OR d.date > s.through_date)
+        ORDER BY d.scno, d.date;
+    """, (scnos, stale))
+    rebuild = _fold_rows(states, cur.fetchall(), processes)
+
+    if rebuild:
+        for scno in rebuild:
+            states.pop(scno)
+        cur.execute("""
+            SELECT scno, date, profile FROM consumption_daily
+            WHERE scno = ANY(%s) ORDER BY scno, date;
+        """, (rebuild,))
+        _fold_rows(states, cur.fetchall(), processes)
+
+    if states:
+        execute_values(cur, f"""
+            INSERT INTO flexibility_state ({', '.join(STATE_COLUMNS)})
+            VALUES %s
+            ON CONFLICT (scno) DO UPDATE
+            SET {', '.join(f'{c} = EXCLUDED.{c}' for c in STATE_COLUMNS[1:])};
+        """, [_state_to_row(scno, st, as_of) for scno, st in states.items()], page_size=1000)
+    cur.close()
+    return states
+
+
+# ---------------- ROLLING WINDOWS ---------------- #
+def rolling_metrics(conn, scnos, as_of, windows=ROLLING_WINDOWS):
+    """
+    LF, LVI, DLSS and peak ratio over each trailing calendar window ending
+    at as_of, for every scno. Reads only the last max(windows) days of daily
+    summaries and sweeps them once per client through RollingFlex, so the
+    cost stays flat as history grows. Returns a long frame with one row per
+    (scno, window_days); windows without days are left out.
+    """
+    windows = tuple(sorted(windows))
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT scno, date, profile FROM consumption_daily
+        WHERE scno = ANY(%s) AND date > %s AND date <= %s
+        ORDER BY scno, date;
+    """, (list(scnos), as_of - timedelta(days=windows[-1]), as_of))
+    rows = cur.fetchall()
+    cur.close()
+
+    out = []
+    for scno, group in groupby(rows, key=lambda r: r[0]):
+        roll = RollingFlex(windows)
+        for _, day, profile in group:
+            roll.push(day, profile)
+        roll.advance(as_of)
+        for w in windows:
+            m = roll.metrics(w)
+            if m is not None:
+                out.append((scno, w) + m)
+    return pd.DataFrame(out, columns=["scno", "window_days", "LF", "LVI", "DLSS", "Peak_Ratio"])
@@ -0,0 +1,150 @@
+import csv
+import io
+import math
+import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+from telemetry import TELEMETRY
+
+CONSUMPTION_COLUMNS = ["scno", "date", "hour", "consumption"]
+
+# ---------------- CONNECTION POOL ---------------- #
+def make_pool(db_config, max_workers):
+    """Bounded pool with one connection per worker thread."""
+    return ThreadedConnectionPool(1, max_workers, **db_config)
+
+
+def with_pooled_conn(pool, fn, *args, **kwargs):
+    """
+    Check a connection out of pool, call fn(*args, conn=conn, **kwargs) and
+    return the connection afterwards, rolled back to a clean state.
+    """
+    conn = pool.getconn()
+    try:
+        return fn(*args, conn=conn, **kwargs)
+    finally:
+        if not conn.closed:
+            conn.rollback()
+        pool.putconn(conn)
+
+# ---------------- BULK LOAD ---------------- #
+def empty_consumption():
+    """Zero-row frame with load_consumption()'s dtypes."""
+    return pd.DataFrame({
+        "scno": pd.Series(dtype="category"),
+        "date": pd.Series(dtype="datetime64[ns]"),
+        "hour": pd.Series(dtype="int8"),
+        "consumption": pd.Series(dtype="float64"),
+    })
+
+
+def load_consumption(conn, scnos=None, start_date=None, end_date=None):
+    """
+    Read the consumption window in a single COPY ... TO STDOUT instead of one
+    query per scno. Returns a typed long frame (scno category, date
+    datetime64, hour int8, consumption float64).
+    """
+    cur = conn.cursor()
+    where, params = [], []
+    if scnos is not None:
+        where.append("scno = ANY(%s)")
+        params.append(list(scnos))
+    if start_date is not None:
+        where.append("date >= %s")
+        params.append(start_date)
+    if end_date is not None:
+        where.append("date <= %s")
+        params.append(end_date)
+    clause = (" WHERE " + " AND ".join(where)) if where else ""
+    query = cur.mogrify(f"SELECT scno, date, hour, consumption FROM consumption{clause}", params).decode()
+
+    buf = io.StringIO()
+    with TELEMETRY.timer("db_query_seconds", op="load_consumption"):
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buf)
+    cur.close()
+
+    if buf.tell() == 0:
+        return empty_consumption()
+    buf.seek(0)
+    df = pd.read_csv(
+        buf, names=CONSUMPTION_COLUMNS, parse_dates=["date"],
+        dtype={"scno": "category", "hour": "int8", "consumption": "float64"},
+    )
+    # pandas >= 3 parses to datetime64[us]; keep empty_consumption()'s unit
+    df["date"] = df["date"].astype("datetime64[ns]")
+    TELEMETRY.inc("rows_loaded_total", len(df))
+    return df
+
+
+# ---------------- BULK UPSERT ---------------- #
+def _csv_value(v):
+    if v is None or v is pd.NA or (isinstance(v, float) and math.isnan(v)):
+        return None
+    return v
+
+
+def frame_rows(df, columns):
+    """Tuples of df[columns] with NaN turned into None (NULL)."""
+    return [tuple(_csv_value(v) for v in row) for row in df[columns].itertuples(index=False, name=None)]
+
+
+def merge_frames(frames, on="scno", keys=None):
+    """
+    Outer-join several per-scno result frames into one row per scno. With
+    keys, every frame is first reindexed over those scnos, so a key missing
+    from a frame gets NaN in its columns (written as NULL) instead of being
+    left out of the merge.
+    """
+    if keys is not None:
+        keys = pd.Index(sorted(keys), name=on)
+        frames = [f.set_index(on).reindex(keys).reset_index() for f in frames]
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=[on])
+    merged = frames[0]
+    for f in frames[1:]:
+        merged = merged.merge(f, on=on, how="outer")
+    return merged
+
+
+def upsert_rows(conn, table, columns, rows, key="scno", update=None, stamp="calculated_at"):
+    """
+    Write rows (tuples in columns order) with one INSERT ... ON CONFLICT.
+
+    Rows are staged with COPY into a temp table shaped like the target, then
+    merged in a single statement. key is the conflict column or a tuple of
+    columns; update lists the columns overwritten on conflict (default:
+    every non-key column), which are written as given, NULLs included, so
+    a metric that became undefined is cleared. The caller commits.
+    """
+    if not rows:
+        return 0
+    cols = ", ".join(columns)
+    stage = f"_stage_{table}"
+    keys = [key] if isinstance(key, str) else list(key)
+    if update is None:
+        update = [c for c in columns if c not in keys]
+    sets = [f"{c} = EXCLUDED.{c}" for c in update]
+    if stamp:
+        sets.append(f"{stamp} = NOW()")
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([_csv_value(v) for v in row])
+    buf.seek(0)
+
+    cur = conn.cursor()
+    with TELEMETRY.timer("db_query_seconds", op=f"upsert_{table}"):
+        cur.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS SELECT {cols} FROM {table} WITH NO DATA;")
+        cur.copy_expert(f"COPY {stage} ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(f"""
+            INSERT INTO {table} ({cols}{', ' + stamp if stamp else ''})
+            SELECT {cols}{', NOW()' if stamp else ''} FROM {stage}
+            ON CONFLICT ({', '.join(keys)}) DO UPDATE
+            SET {', '.join(sets)};
+        """)
+        written = cur.rowcount
+        cur.execute(f"DROP TABLE {stage};")
+    cur.close()
+    TELEMETRY.inc("rows_upserted_total", written, table=table)
+    return written
@@ -0,0 +1,763 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+import pandas as pd
+
+# ---------------- CONFIG ---------------- #
+# Define peak hours (6–10 AM and 6–10 PM)
+PEAK_HOURS = list(range(6, 10)) + list(range(18, 22))
+CHUNK_CLIENTS = 2000      # clients per cube, bounds memory at chunk * days * 24 floats
+PROCESSES = os.cpu_count() or 1   # worker processes for the CPU-bound metric stage
+
+# ---------------- BUILD CUBE ---------------- #
+def encode_long(df, keep_nan=False):
+    """
+    Compact columnar form of a long (scno, date, hour, consumption) frame:
+    (scnos, dates, scno_codes, date_codes, hours, cons) with sorted code
+    tables, int32 codes, int8 hours and float64 consumption (NaN -> 0
+    unless keep_nan).
+    """
+    scno_codes, scnos = pd.factorize(df["scno"], sort=True)
+    date_codes, dates = pd.factorize(df["date"], sort=True)
+    hours = df["hour"].to_numpy(dtype=np.int8)
+    cons = pd.to_numeric(df["consumption"], errors="coerce")
+    if not keep_nan:
+        cons = cons.fillna(0.0)
+    cons = cons.to_numpy(dtype=np.float64)
+    return scnos, dates, scno_codes.astype(np.int32), date_codes.astype(np.int32), hours, cons
+
+
+def cube_from_codes(scno_codes, date_codes, hours, cons, n_clients, n_dates):
+    """Dense float64 [n_clients, n_dates, 24] cube (duplicates summed) and its presence mask."""
+    shape = (n_clients, n_dates, 24)
+    flat = (scno_codes.astype(np.int64) * n_dates + date_codes) * 24 + hours
+    size = n_clients * n_dates * 24
+    cube = np.bincount(flat, weights=cons, minlength=size).reshape(shape)
+    present = (np.bincount(flat, minlength=size) > 0).reshape(shape)
+    return cube, present
+
+
+def build_cube(df):
+    """
+    Turn a long (scno, date, hour, consumption) frame into a dense cube.
+
+    Returns (scnos, dates, cube, present) where cube is float64
+    [n_clients, n_days, 24] with duplicate (scno, date, hour) rows summed and
+    present marks which cells had at least one row.
+    """
+    scnos, dates, scno_codes, date_codes, hours, cons = encode_long(df)
+    cube, present = cube_from_codes(scno_codes, date_codes, hours, cons, len(scnos), len(dates))
+    return scnos, dates, cube, present
+
+# ---------------- COMPACT SERIES ---------------- #
+class HourlySeries:
+    """
+    One client's hourly consumption as a float32 [n_days, 24] matrix with a
+    presence mask and int32 day offsets from start; missing marks stored
+    hours whose consumption was NaN (None when there are none), which the
+    metrics count as 0 like consumption_daily does. Rows are grouped by day
+    of week (Mon..Sun, dates ascending within each), so weekday, weekend and
+    single-day-of-week selections are zero-copy slices; dow_bounds[d] is the
+    first row of day-of-week d. Metrics do not depend on row order.
+    """
+
+    __slots__ = ("start", "offsets", "values", "mask", "dow_bounds", "missing")
+
+    def __init__(self, start, offsets, values, mask, dow_bounds, missing=None):
+        self.start = start
+        self.offsets = offsets
+        self.values = values
+        self.mask = mask
+        self.dow_bounds = dow_bounds
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def n_days(self):
+        return len(self.offsets)
+
+    @property
+    def dates(self):
+        """datetime64[D] date of each row."""
+        return self.start + self.offsets
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.values.nbytes + self.mask.nbytes + (
+            0 if self.missing is None else self.missing.nbytes)
+
+    def days_of_week(self, first, last):
+        """View of the rows whose day of week is in [first, last] (Mon=0)."""
+        a, b = self.dow_bounds[first], self.dow_bounds[last + 1]
+        return HourlySeries(
+            self.start, self.offsets[a:b], self.values[a:b], self.mask[a:b],
+            np.clip(self.dow_bounds - a, 0, b - a),
+            None if self.missing is None else self.missing[a:b],
+        )
+
+    def weekdays(self):
+        return self.days_of_week(0, 4)
+
+    def weekend(self):
+        return self.days_of_week(5, 6)
+
+    def present_values(self):
+        """Consumption of every stored hour with a value (NaN hours left out), as float64."""
+        mask = self.mask if self.missing is None else self.mask & ~self.missing
+        return self.values[mask].astype(np.float64)
+
+    def metrics(self, peak_hours=PEAK_HOURS):
+        """(LF, LVI, DLSS, peak_ratio) with None for undefined metrics."""
+        if not self.n_days:
+            return None
+        m = flexibility_from_series([self], peak_hours)
+        return tuple(
+            None if np.isnan(m[k][0]) else float(m[k][0])
+            for k in ("LF", "LVI", "DLSS", "Peak_Ratio")
+        )
+
+
+def series_from_frame(df):
+    """
+    {scno: HourlySeries} from a long (scno, date, hour, consumption) frame,
+    built from the encoded columns without a groupby or pivot. Duplicate
+    (scno, date, hour) rows are summed; NaN consumption counts as 0 and
+    hours with only NaN rows are marked missing. The series share their
+    backing arrays.
+    """
+    if df.empty:
+        return {}
+    scnos, dates, scno_codes, date_codes, hours, cons = encode_long(df, keep_nan=True)
+    nan = np.isnan(cons)
+    if nan.any():
+        cons = np.where(nan, 0.0, cons)
+    dates = pd.to_datetime(pd.Index(dates))
+    day_num = dates.values.astype("datetime64[D]").astype(np.int64)
+    dow = dates.dayofweek.to_numpy()
+
+    # One row per (client, day), ordered by client, day of week, date
+    n_dates = len(dates)
+    keys, row = np.unique(scno_codes.astype(np.int64) * n_dates + date_codes, return_inverse=True)
+    client, day = keys // n_dates, keys % n_dates
+    order = np.lexsort((day_num[day], dow[day], client))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    client, day = client[order], day[order]
+
+    flat = rank[row.ravel()] * 24 + hours
+    size = len(keys) * 24
+    values = np.bincount(flat, weights=cons, minlength=size).astype(np.float32).reshape(-1, 24)
+    mask = (np.bincount(flat, minlength=size) > 0).reshape(-1, 24)
+    missing = None
+    if nan.any():
+        missing = mask & ~(np.bincount(flat, weights=~nan, minlength=size) > 0).reshape(-1, 24)
+
+    out = {}
+    cuts = np.searchsorted(client, np.arange(len(scnos) + 1))
+    for c, (a, b) in enumerate(zip(cuts, cuts[1:])):
+        d = day[a:b]
+        start = day_num[d].min()
+        out[scnos[c]] = HourlySeries(
+            np.datetime64(int(start), "D"),
+            (day_num[d] - start).astype(np.int32),
+            values[a:b], mask[a:b],
+            np.searchsorted(dow[d], np.arange(8)),
+            None if missing is None else missing[a:b],
+        )
+    return out
+
+# ---------------- METRICS ---------------- #
+def lf_from_cube(x, present, day_mask):
+    """Load Factor (LF): mean over days of each day's present-hours mean / max."""
+    n_hours = present.sum(axis=2)
+    day_max = np.where(present, x, -np.inf).max(axis=2)
+    day_lf = x.sum(axis=2) / n_hours / day_max
+    lf_ok = day_mask & (day_max != 0)
+    lf_n = lf_ok.sum(axis=1)
+    return np.where(lf_n > 0, np.where(lf_ok, day_lf, 0.0).sum(axis=1) / lf_n, np.nan)
+
+
+def lvi_from_cube(x, day_mask, n_days):
+    """Load Variability Index (LVI): std / mean of daily totals."""
+    totals = np.where(day_mask, x.sum(axis=2), 0.0)
+    mean_total = totals.sum(axis=1) / n_days
+    dev = np.where(day_mask, totals - mean_total[:, None], 0.0)
+    std_total = np.sqrt((dev ** 2).sum(axis=1) / (n_days - 1))
+    return np.where((n_days > 1) & (mean_total != 0), std_total / mean_total, np.nan)
+
+
+def dlss_from_cube(x, day_mask, hour_mask, n_days):
+    """Daily Load Shape Stability (DLSS): mean correlation with the typical day."""
+    w = hour_mask[:, None, :]
+    n_h = hour_mask.sum(axis=1)[:, None, None]
+    typical = x.sum(axis=1, keepdims=True) / n_days[:, None, None]
+    tc = np.where(w, typical - typical.sum(axis=2, keepdims=True) / n_h, 0.0)
+    xc = np.where(w, x - x.sum(axis=2, keepdims=True) / n_h, 0.0)
+    corr = (xc * tc).sum(axis=2) / np.sqrt((xc ** 2).sum(axis=2) * (tc ** 2).sum(axis=2))
+    corr = np.clip(corr, -1.0, 1.0)
+    dlss_ok = day_mask & ~np.isnan(corr)
+    dlss_n = dlss_ok.sum(axis=1)
+    return np.where(
+        (n_days >= 2) & (dlss_n > 0),
+        np.where(dlss_ok, corr, 0.0).sum(axis=1) / dlss_n,
+        np.nan,
+    )
+
+
+def peak_ratio_from_cube(x, peak_hours=PEAK_HOURS):
+    """Share of total usage that falls in peak_hours."""
+    total_usage = x.sum(axis=(1, 2))
+    peak_usage = x[:, :, list(peak_hours)].sum(axis=(1, 2))
+    return np.where(total_usage > 0, peak_usage / total_usage, 0.0)
+
+
+def prepare_cube(cube, present=None):
+    """(x, present, day_mask, hour_mask, n_days) shared by the *_from_cube metrics."""
+    cube = np.asarray(cube, dtype=np.float64)
+    if present is None:
+        present = np.ones(cube.shape, dtype=bool)
+    x = np.where(present, cube, 0.0)
+    day_mask = present.any(axis=2)                      # [C, D]
+    hour_mask = present.any(axis=1)                     # [C, 24]
+    return x, present, day_mask, hour_mask, day_mask.sum(axis=1)
+
+
+def flexibility_from_cube(cube, present=None, peak_hours=PEAK_HOURS):
+    """
+    LF, LVI, DLSS and peak ratio for every client of a [n_clients, n_days, 24]
+    cube at once. Matches calculate_flexibility() per client: only days with
+    at least one row count, LF uses the hours present that day and DLSS
+    correlates over the hours present on any of the client's days.
+    Metrics that calculate_flexibility() would return as None come back NaN.
+    """
+    x, present, day_mask, hour_mask, n_days = prepare_cube(cube, present)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "LF": lf_from_cube(x, present, day_mask),
+            "LVI": lvi_from_cube(x, day_mask, n_days),
+            "DLSS": dlss_from_cube(x, day_mask, hour_mask, n_days),
+            "Peak_Ratio": peak_ratio_from_cube(x, peak_hours),
+            "n_days": n_days,
+        }
+
+
+def flexibility_from_series(series, peak_hours=PEAK_HOURS):
+    """
+    flexibility_from_cube over a list of HourlySeries. Clients are stacked
+    into one cube padded with absent days, which the metrics ignore, so no
+    date alignment is needed.
+    """
+    n_max = max((s.n_days for s in series), default=0)
+    cube = np.zeros((len(series), n_max, 24))
+    present = np.zeros((len(series), n_max, 24), dtype=bool)
+    for i, s in enumerate(series):
+        cube[i, :s.n_days] = s.values
+        present[i, :s.n_days] = s.mask
+    return flexibility_from_cube(cube, present, peak_hours)
+
+
+def _series_chunk_metrics(chunk):
+    """Worker: metrics for one chunk of HourlySeries."""
+    series, peak_hours = chunk
+    m = flexibility_from_series(series, peak_hours)
+    return {k: m[k] for k in ("LF", "LVI", "DLSS", "Peak_Ratio")}
+
+
+def _chunk_metrics(chunk):
+    """Worker: metrics for one chunk of clients given as compact code arrays."""
+    scno_codes, date_codes, hours, cons, n_clients, peak_hours = chunk
+    day_ids, date_codes = np.unique(date_codes, return_inverse=True)
+    cube, present = cube_from_codes(scno_codes, date_codes, hours, cons, n_clients, len(day_ids))
+    m = flexibility_from_cube(cube, present, peak_hours)
+    return {k: m[k] for k in ("LF", "LVI", "DLSS", "Peak_Ratio")}
+
+
+def calculate_flexibility_batch(df, peak_hours=PEAK_HOURS, chunk_size=CHUNK_CLIENTS, processes=1):
+    """
+    Metrics for every scno in a long (scno, date, hour, consumption) frame
+    or a {scno: HourlySeries} mapping. Returns a DataFrame with scno, LF, LVI, DLSS, Peak_Ratio (NaN where the
+    per-client function returns None); clients without rows are absent.
+
+    With processes > 1 the client chunks are computed in a process pool;
+    workers receive only the chunk's int/float code arrays, not DataFrames.
+    """
+    columns = ["scno", "LF", "LVI", "DLSS", "Peak_Ratio"]
+    if isinstance(df, dict):
+        return _batch_from_series(df, columns, peak_hours, chunk_size, processes)
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    scnos, _, scno_codes, date_codes, hours, cons = encode_long(df)
+    order = np.argsort(scno_codes, kind="stable")
+    scno_codes, date_codes, hours, cons = scno_codes[order], date_codes[order], hours[order], cons[order]
+
+    n = len(scnos)
+    if processes > 1:
+        chunk_size = min(chunk_size, -(-n // processes))
+    bounds = list(range(0, n, chunk_size)) + [n]
+    cuts = np.searchsorted(scno_codes, bounds)
+    chunks = [
+        (scno_codes[a:b] - lo, date_codes[a:b], hours[a:b], cons[a:b], hi - lo, list(peak_hours))
+        for lo, hi, a, b in zip(bounds, bounds[1:], cuts, cuts[1:])
+    ]
+
+    if processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_chunk_metrics, chunks))
+    else:
+        parts = [_chunk_metrics(c) for c in chunks]
+
+    out = pd.DataFrame({k: np.concatenate([p[k] for p in parts]) for k in columns[1:]})
+    out.insert(0, "scno", np.asarray(scnos))
+    return out
+
+
+def _batch_from_series(series, columns, peak_hours, chunk_size, processes):
+    items = [(scno, s) for scno, s in series.items() if s.n_days]
+    if not items:
+        return pd.DataFrame(columns=columns)
+    if processes > 1:
+        chunk_size = min(chunk_size, -(-len(items) // processes))
+    chunks = [
+        ([s for _, s in items[i:i + chunk_size]], list(peak_hours))
+        for i in range(0, len(items), chunk_size)
+    ]
+    if processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_series_chunk_metrics, chunks))
+    else:
+        parts = [_series_chunk_metrics(c) for c in chunks]
+
+    out = pd.DataFrame({k: np.concatenate([p[k] for p in parts]) for k in columns[1:]})
+    out.insert(0, "scno", [scno for scno, _ in items])
+    return out
+
+
+def calculate_flexibility(df, peak_hours=PEAK_HOURS):
+    """
+    Single-client drop-in for the scripts' calculate_flexibility(); df is
+    the client's (date, hour, consumption) frame or its HourlySeries.
+    Returns (LF, LVI, DLSS, peak_ratio) with None for undefined metrics.
+    """
+    if isinstance(df, HourlySeries):
+        return df.metrics(peak_hours)
+    if df.empty:
+        return None
+    part = df[["date", "hour", "consumption"]].assign(scno=0)
+    _, _, cube, present = build_cube(part)
+    m = flexibility_from_cube(cube, present, peak_hours)
+    return tuple(
+        None if np.isnan(m[k][0]) else float(m[k][0])
+        for k in ("LF", "LVI", "DLSS", "Peak_Ratio")
+    )
+
+# ---------------- DAY TYPES ---------------- #
+# Days of week (Mon=0) making up each day type
+DAY_PARTITIONS = {
+    "all": range(7),
+    "weekday": range(5),
+    "weekend": (5, 6),
+    "monday": (0,),
+    "tuesday": (1,),
+    "wednesday": (2,),
+    "thursday": (3,),
+    "friday": (4,),
+    "saturday": (5,),
+    "sunday": (6,),
+}
+HOLIDAY = "holiday"   # extra day type when holiday dates are given
+
+
+def _dlss_rows(x, present, client, n_days):
+    """
+    dlss_from_cube over the [n_rows, 24] day rows of one day type, each
+    tagged with its client index, so only that day type's days are visited.
+    """
+    n_clients = len(n_days)
+    flat = (client[:, None] * 24 + np.arange(24)).ravel()
+    size = n_clients * 24
+    typical = np.bincount(flat, weights=x.ravel(), minlength=size).reshape(n_clients, 24) / n_days[:, None]
+    hour_mask = (np.bincount(flat, weights=present.ravel().astype(np.float64), minlength=size) > 0).reshape(n_clients, 24)
+    n_h = hour_mask.sum(axis=1)
+    tc = np.where(hour_mask, typical - typical.sum(axis=1, keepdims=True) / n_h[:, None], 0.0)[client]
+    xc = np.where(hour_mask[client], x - x.sum(axis=1, keepdims=True) / n_h[client, None], 0.0)
+    corr = (xc * tc).sum(axis=1) / np.sqrt((xc ** 2).sum(axis=1) * (tc ** 2).sum(axis=1))
+    corr = np.clip(corr, -1.0, 1.0)
+    ok = ~np.isnan(corr)
+    dlss_n = np.bincount(client, weights=ok.astype(np.float64), minlength=n_clients)
+    dlss_sum = np.bincount(client, weights=np.where(ok, corr, 0.0), minlength=n_clients)
+    return np.where((n_days >= 2) & (dlss_n > 0), dlss_sum / dlss_n, np.nan)
+
+
+def daytype_from_series(series, partitions=DAY_PARTITIONS, holidays=None, peak_hours=PEAK_HOURS):
+    """
+    flexibility_from_series for several day types in one pass over a list of
+    HourlySeries: {day_type: {"LF", "LVI", "DLSS", "Peak_Ratio", "n_days"}}.
+
+    Each day's LF, total and peak usage are computed once and summed into
+    every day type it belongs to through a [clients, days, day types]
+    membership mask. DLSS needs the day type's own typical day, so it visits
+    only that day type's days. holidays (dates) adds a HOLIDAY day type.
+    """
+    labels = list(partitions)
+    by_dow = np.zeros((7, len(labels) + bool(holidays)), dtype=bool)
+    for p, label in enumerate(labels):
+        by_dow[list(partitions[label]), p] = True
+    if holidays:
+        labels.append(HOLIDAY)
+        holidays = np.asarray(pd.to_datetime(list(holidays)).values.astype("datetime64[D]"))
+
+    n_max = max((s.n_days for s in series), default=0)
+    cube = np.zeros((len(series), n_max, 24))
+    present = np.zeros((len(series), n_max, 24), dtype=bool)
+    member = np.zeros((len(series), n_max, len(labels)), dtype=bool)
+    for i, s in enumerate(series):
+        cube[i, :s.n_days] = s.values
+        present[i, :s.n_days] = s.mask
+        member[i, :s.n_days] = by_dow[np.repeat(np.arange(7), np.diff(s.dow_bounds))]
+        if holidays is not None:
+            member[i, :s.n_days, -1] = np.isin(s.dates, holidays)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Per-day quantities, once
+        x = np.where(present, cube, 0.0)
+        day_has = present.any(axis=2)
+        day_total = x.sum(axis=2)
+        day_max = np.where(present, x, -np.inf).max(axis=2)
+        lf_ok = day_has & (day_max != 0)
+        day_lf = np.where(lf_ok, day_total / present.sum(axis=2) / day_max, 0.0)
+        day_peak = x[:, :, list(peak_hours)].sum(axis=2)
+
+        # Summed into every day type
+        member &= day_has[:, :, None]
+        weights = member.astype(np.float64)
+        n_days = weights.sum(axis=1)
+        lf_n = np.einsum("cd,cdp->cp", lf_ok.astype(np.float64), weights)
+        lf = np.where(lf_n > 0, np.einsum("cd,cdp->cp", day_lf, weights) / lf_n, np.nan)
+        total = np.einsum("cd,cdp->cp", day_total, weights)
+        mean_total = total / n_days
+        dev = np.where(member, day_total[:, :, None] - mean_total[:, None, :], 0.0)
+        std_total = np.sqrt((dev ** 2).sum(axis=1) / (n_days - 1))
+        lvi = np.where((n_days > 1) & (mean_total != 0), std_total / mean_total, np.nan)
+        peak = np.einsum("cd,cdp->cp", day_peak, weights)
+        peak_ratio = np.where(total > 0, peak / total, 0.0)
+
+        out = {}
+        for p, label in enumerate(labels):
+            client, day = np.nonzero(member[:, :, p])
+            out[label] = {
+                "LF": lf[:, p],
+                "LVI": lvi[:, p],
+                "DLSS": _dlss_rows(x[client, day], present[client, day], client, n_days[:, p]),
+                "Peak_Ratio": peak_ratio[:, p],
+                "n_days": n_days[:, p].astype(np.int64),
+            }
+    return out
+
+
+def _daytype_chunk_metrics(chunk):
+    """Worker: day-type metrics for one chunk of HourlySeries."""
+    series, partitions, holidays, peak_hours = chunk
+    return daytype_from_series(series, partitions, holidays, peak_hours)
+
+
+def calculate_daytype_batch(df, partitions=DAY_PARTITIONS, holidays=None, peak_hours=PEAK_HOURS,
+                            chunk_size=CHUNK_CLIENTS, processes=1):
+    """
+    calculate_flexibility_batch for several day types at once, from a long
+    (scno, date, hour, consumption) frame or a {scno: HourlySeries} mapping.
+    Returns {day_type: DataFrame of scno, LF, LVI, DLSS, Peak_Ratio}; clients
+    without days of a day type are absent from its frame.
+    """
+    columns = ["scno", "LF", "LVI", "DLSS", "Peak_Ratio"]
+    series = df if isinstance(df, dict) else series_from_frame(df)
+    items = [(scno, s) for scno, s in series.items() if s.n_days]
+    labels = list(partitions) + ([HOLIDAY] if holidays else [])
+    if not items:
+        return {label: pd.DataFrame(columns=columns) for label in labels}
+
+    holidays = list(holidays) if holidays else None
+    if processes > 1:
+        chunk_size = min(chunk_size, -(-len(items) // processes))
+    chunks = [
+        ([s for _, s in items[i:i + chunk_size]], dict(partitions), holidays, list(peak_hours))
+        for i in range(0, len(items), chunk_size)
+    ]
+    if processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_daytype_chunk_metrics, chunks))
+    else:
+        parts = [_daytype_chunk_metrics(c) for c in chunks]
+
+    scnos = np.asarray([scno for scno, _ in items], dtype=object)
+    out = {}
+    for label in labels:
+        frame = pd.DataFrame({k: np.concatenate([p[label][k] for p in parts]) for k in columns[1:] + ["n_days"]})
+        frame.insert(0, "scno", scnos)
+        out[label] = frame[frame["n_days"] > 0].drop(columns="n_days").reset_index(drop=True)
+    return out
+
+# ---------------- RUNNING STATE ---------------- #
+class FlexState:
+    """
+    Running flexibility state for one client, folded from daily 24-hour
+    profiles so new days update it without re-reading history.
+
+    Holds the LF sum, a mergeable (count, mean, M2) of daily totals, the
+    per-hour sum (typical day and peak ratio) and the sum of each day's
+    unit-length centred profile, which turns DLSS into one dot product with
+    the centred typical day.
+    """
+    __slots__ = (
+        "through_date", "n_days", "lf_sum", "lf_n", "tot_mean", "tot_m2",
+        "hour_sum", "unit_sum", "unit_n", "hour_mask",
+    )
+
+    def __init__(self):
+        self.through_date = None
+        self.n_days = 0
+        self.lf_sum = 0.0
+        self.lf_n = 0
+        self.tot_mean = 0.0
+        self.tot_m2 = 0.0
+        self.hour_sum = np.zeros(24)
+        self.unit_sum = np.zeros(24)
+        self.unit_n = 0
+        self.hour_mask = np.zeros(24, dtype=bool)
+
+    def fold(self, dates, profiles):
+        """
+        Add days given as a [k, 24] array with NaN for missing hours.
+        Returns False (state untouched) if the days bring an hour never seen
+        before, since earlier centred profiles then need rebuilding.
+        """
+        profiles = np.asarray(profiles, dtype=np.float64).reshape(-1, 24)
+        present = ~np.isnan(profiles)
+        keep = present.any(axis=1)
+        profiles, present = profiles[keep], present[keep]
+        dates = [d for d, k in zip(dates, keep) if k]
+        if not len(dates):
+            return True
+
+        mask = self.hour_mask | present.any(axis=0)
+        if self.n_days and (mask != self.hour_mask).any():
+            return False
+        x = np.where(present, profiles, 0.0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # LF terms
+            day_max = np.where(present, x, -np.inf).max(axis=1)
+            day_lf = x.sum(axis=1) / present.sum(axis=1) / day_max
+            lf_ok = day_max != 0
+            self.lf_sum += float(day_lf[lf_ok].sum())
+            self.lf_n += int(lf_ok.sum())
+
+            # Daily totals, merged (count, mean, M2)
+            totals = x.sum(axis=1)
+            n_b = len(totals)
+            mean_b = float(totals.mean())
+            m2_b = float(((totals - mean_b) ** 2).sum())
+            n = self.n_days + n_b
+            delta = mean_b - self.tot_mean
+            self.tot_mean += delta * n_b / n
+            self.tot_m2 += m2_b + delta ** 2 * self.n_days * n_b / n
+
+            # Unit-length centred day profiles for DLSS
+            xc = np.where(mask, x - x.sum(axis=1, keepdims=True) / mask.sum(), 0.0)
+            norms = np.sqrt((xc ** 2).sum(axis=1))
+            ok = norms > 0
+            self.unit_sum += (xc[ok] / norms[ok, None]).sum(axis=0)
+            self.unit_n += int(ok.sum())
+
+        self.hour_sum += x.sum(axis=0)
+        self.hour_mask = mask
+        self.n_days = n
+        last = max(dates)
+        self.through_date = last if self.through_date is None else max(self.through_date, last)
+        return True
+
+    def metrics(self, peak_hours=PEAK_HOURS):
+        """(LF, LVI, DLSS, peak_ratio) with None for undefined metrics."""
+        return _state_metrics(self, peak_hours)
+
+
+def fold_many(items):
+    """
+    Fold a batch of (scno, state or None, dates, profiles) items; the unit of
+    work handed to worker processes. Returns ([(scno, state)], [scnos whose
+    fold was refused and need a rebuild]).
+    """
+    folded, rebuild = [], []
+    for scno, st, dates, profiles in items:
+        st = st if st is not None else FlexState()
+        if st.fold(dates, profiles):
+            folded.append((scno, st))
+        else:
+            rebuild.append(scno)
+    return folded, rebuild
+
+
+def _state_metrics(st, peak_hours):
+    """
+    Metrics from running sums shared by FlexState and the rolling windows.
+    st.tol (if any) is the rounding residue below which a sum counts as zero.
+    """
+    if not st.n_days:
+        return None
+    tol = getattr(st, "tol", 0.0)
+    LF = st.lf_sum / st.lf_n if st.lf_n else None
+    LVI = None
+    if st.n_days > 1 and abs(st.tot_mean) > tol:
+        LVI = float(np.sqrt(max(st.tot_m2, 0.0) / (st.n_days - 1)) / st.tot_mean)
+
+    DLSS = None
+    typical = st.hour_sum / st.n_days
+    mask = st.hour_mask
+    tc = np.where(mask, typical - typical[mask].mean(), 0.0)
+    tn = float(np.sqrt((tc ** 2).sum()))
+    if st.n_days >= 2 and st.unit_n and tn > tol:
+        DLSS = float(np.clip(st.unit_sum @ tc / tn / st.unit_n, -1.0, 1.0))
+
+    total = float(st.hour_sum.sum())
+    peak_ratio = float(st.hour_sum[list(peak_hours)].sum() / total) if total > tol else 0.0
+    return LF, LVI, DLSS, peak_ratio
+
+# ---------------- ROLLING WINDOWS ---------------- #
+ROLLING_WINDOWS = (7, 30, 60, 90)
+
+
+def _unit_profile(x, mask):
+    """Day profile centred over mask hours and scaled to unit length, or None."""
+    xc = np.where(mask, x - x.sum() / mask.sum(), 0.0)
+    norm = np.sqrt((xc ** 2).sum())
+    return xc / norm if norm > 0 else None
+
+
+class _WindowSums:
+    """Add/evict sums for one window; same fields _state_metrics() reads."""
+    __slots__ = (
+        "start", "tol", "n_days", "lf_sum", "lf_n", "tot_mean", "tot_m2",
+        "hour_sum", "hour_count", "unit_sum", "unit_n", "hour_mask",
+    )
+
+    def __init__(self):
+        self.start = 0
+        self.tol = 0.0
+        self.n_days = 0
+        self.lf_sum = 0.0
+        self.lf_n = 0
+        self.tot_mean = 0.0
+        self.tot_m2 = 0.0
+        self.hour_sum = np.zeros(24)
+        self.hour_count = np.zeros(24, dtype=np.int64)
+        self.unit_sum = np.zeros(24)
+        self.unit_n = 0
+        self.hour_mask = np.zeros(24, dtype=bool)
+
+    def _rebuild_units(self, days, end):
+        self.hour_mask = self.hour_count > 0
+        self.unit_sum = np.zeros(24)
+        self.unit_n = 0
+        for i in range(self.start, end):
+            u = _unit_profile(days[i][1], self.hour_mask)
+            if u is not None:
+                self.unit_sum += u
+                self.unit_n += 1
+
+    def add(self, days):
+        """Add days[-1]; the window is days[start:]."""
+        _, x, present, lf, total = days[-1]
+        self.tol = max(self.tol, 1e-9 * float(np.abs(x).sum()))
+        self.n_days += 1
+        if lf is not None:
+            self.lf_sum += lf
+            self.lf_n += 1
+        delta = total - self.tot_mean
+        self.tot_mean += delta / self.n_days
+        self.tot_m2 += delta * (total - self.tot_mean)
+        self.hour_sum += x
+        self.hour_count += present
+        if ((self.hour_count > 0) != self.hour_mask).any():
+            self._rebuild_units(days, len(days))
+        else:
+            u = _unit_profile(x, self.hour_mask)
+            if u is not None:
+                self.unit_sum += u
+                self.unit_n += 1
+
+    def evict(self, days, end):
+        """Drop days[start] from the window days[start:end]."""
+        _, x, present, lf, total = days[self.start]
+        self.start += 1
+        if lf is not None:
+            self.lf_sum -= lf
+            self.lf_n -= 1
+        self.n_days -= 1
+        if self.n_days:
+            delta = total - self.tot_mean
+            self.tot_mean -= delta / self.n_days
+            self.tot_m2 -= delta * (total - self.tot_mean)
+        else:
+            self.tot_mean = self.tot_m2 = 0.0
+        self.hour_sum -= x
+        self.hour_count -= present
+        if ((self.hour_count > 0) != self.hour_mask).any():
+            self._rebuild_units(days, end)
+        else:
+            u = _unit_profile(x, self.hour_mask)
+            if u is not None:
+                self.unit_sum -= u
+                self.unit_n -= 1
+
+
+class RollingFlex:
+    """
+    Sliding calendar-day windows (e.g. 7/30/60/90 days) over one client's
+    daily profiles. Each push() adds the new day to every window and evicts
+    the days that fell out of it, so an update costs O(1) per window
+    regardless of history length. Days must be pushed in date order.
+    """
+    __slots__ = ("windows", "days", "sums")
+
+    def __init__(self, windows=ROLLING_WINDOWS):
+        self.windows = tuple(sorted(windows))
+        self.days = []
+        self.sums = {w: _WindowSums() for w in self.windows}
+
+    def push(self, day_date, profile):
+        profile = np.asarray(profile, dtype=np.float64)
+        present = ~np.isnan(profile)
+        if not present.any():
+            return
+        x = np.where(present, profile, 0.0)
+        day_max = x[present].max()
+        lf = float(x.sum() / present.sum() / day_max) if day_max != 0 else None
+        ordinal = day_date.toordinal()
+        self.days.append((ordinal, x, present, lf, float(x.sum())))
+
+        end = len(self.days) - 1
+        for w, acc in self.sums.items():
+            while self.days[acc.start][0] <= ordinal - w:
+                acc.evict(self.days, end)
+            acc.add(self.days)
+
+        # Drop days older than the longest window once they pile up
+        drop = self.sums[self.windows[-1]].start
+        if drop > 64 and drop * 2 > len(self.days):
+            del self.days[:drop]
+            for acc in self.sums.values():
+                acc.start -= drop
+
+    def advance(self, as_of):
+        """Evict days that fall outside every window as of as_of without adding one."""
+        ordinal = as_of.toordinal()
+        end = len(self.days)
+        for w, acc in self.sums.items():
+            while acc.start < end and self.days[acc.start][0] <= ordinal - w:
+                acc.evict(self.days, end)
+
+    def metrics(self, window, peak_hours=PEAK_HOURS):
+        """(LF, LVI, DLSS, peak_ratio) for one window, None if it holds no days."""
+        return _state_metrics(self.sums[window], peak_hours)
@@ -0,0 +1,99 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse, Response
+from typing import Optional
+from rank_index import DAY_TYPES, RankService
+
+# ---------------- CONFIG ---------------- #
+DB_CONFIG = {
+    "host": "localhost",
+    "dbname": "elements_flex",
+    "user": "postgres",
+    "password": "ABcd1234!@",
+    "port": 5432
+}
+
+MAX_PAGE_SIZE = 500
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Open the pool, load the rank index and start listening for reloads
+    before serving; nothing connects to the database at import time.
+    """
+    app.state.service = RankService(DB_CONFIG)
+    await app.state.service.start()
+    try:
+        yield
+    finally:
+        app.state.service.close()
+
+
+app = FastAPI(title="Flexibility Rank API", lifespan=lifespan)
+
+
+def error(message, status_code):
+    return JSONResponse(content={"status": "error", "message": message}, status_code=status_code)
+
+# ---------------- ENDPOINTS ---------------- #
+@app.get("/api/fetchFlexibilityRank")
+async def fetch_flexibility_rank(scno: Optional[str] = Query(None, description="Client SCNO (optional)")):
+    """
+    Fetch flexibility_rank (and scno) from the in-memory rank index.
+    If scno is given, return only that client's rank.
+    """
+    try:
+        index = await app.state.service.get_index()
+        if not scno:
+            if not len(index):
+                return error("No records found.", 404)
+            return Response(content=index.all_ranks_body, media_type="application/json")
+
+        row = index.get(scno)
+        if row is None:
+            return error(f"No rank found for scno={scno}", 404)
+        return {"status": "success", "data": [{"scno": row["scno"], "flexibility_rank": row["flexibility_rank"]}]}
+
+    except Exception as e:
+        print(" ERROR:", str(e))
+        return error(str(e), 500)
+
+
+@app.get("/api/flexibilityRanks")
+async def flexibility_ranks(
+    day_type: str = Query("all", description=f"One of {', '.join(DAY_TYPES)}"),
+    category: Optional[str] = Query(None, description="client_categories.final_category (optional)"),
+    top: Optional[int] = Query(None, ge=1, description="Return only the top K clients"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Rank-ordered clients of one day type, as top-K or one page, optionally by category."""
+    if day_type not in DAY_TYPES:
+        return error(f"Unknown day_type={day_type}", 400)
+    try:
+        index = await app.state.service.get_index()
+        if top is not None:
+            rows = index.top(top, day_type, category)
+            return {"status": "success", "day_type": day_type, "total": len(rows), "data": rows}
+        rows, total = index.page(page, page_size, day_type, category)
+        return {
+            "status": "success", "day_type": day_type, "total": total,
+            "page": page, "page_size": page_size, "data": rows,
+        }
+
+    except Exception as e:
+        print(" ERROR:", str(e))
+        return error(str(e), 500)
+
+
+@app.get("/api/flexibilityCategories")
+async def flexibility_categories():
+    """Category labels available for filtering."""
+    try:
+        index = await app.state.service.get_index()
+        return {"status": "success", "data": index.categories}
+
+    except Exception as e:
+        print(" ERROR:", str(e))
+        return error(str(e), 500)
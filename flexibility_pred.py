@@ -1,11 +1,20 @@
-import requests
-import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta
 import psycopg2
 from psycopg2.extras import execute_values
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading, warnings
+import time, warnings
+from daily_store import update_states, rolling_metrics
+from flex_engine import PROCESSES
+from db import upsert_rows, frame_rows
+from api_client import get_json
+from ingest import CONSUMPTION_RANGE_API
+from backfill_plan import plan_backfill, backfill
+from response_cache import CACHE_PATH, ResponseCache
+from snapshot import SNAPSHOT_DIR, open_snapshot
+from summary_views import ensure_summary_views, refresh_summary_views
+from rank_index import notify_rank_change
+from ranking import RANK_COLUMNS, load_ranker, stamp_calculated
+from telemetry import TELEMETRY
 warnings.filterwarnings("ignore")
 
 # ---------------- CONFIG ---------------- #
@@ -19,8 +28,8 @@ DB_CONFIG = {
 
 CLIENTS_API = "https://ee.elementsenergies.com/api/fetchAllParUniqueMSN"
 CONSUMPTION_API = "https://ee.elementsenergies.com/api/fetchHourlyConsumption?scno={}&date={}"
-MAX_WORKERS = 10
-lock = threading.Lock()
+REPORT_PATH = "flexibility_run.json"    # run telemetry; use a .prom name for Prometheus text
+ROLLING_WINDOWS = [7, 30, 60, 90]   # days, published to flexibility_windows
 
 # ---------------- DB CONNECT ---------------- #
 def get_conn():
@@ -29,84 +38,13 @@ def get_conn():
 # ---------------- FETCH CLIENTS ---------------- #
 def fetch_clients():
     try:
-        r = requests.get(CLIENTS_API, timeout=30)
-        r.raise_for_status()
-        data = r.json()
+        data = get_json(CLIENTS_API, timeout=30)
         clients = [(c["scno"], c["short_name"]) for c in data if "scno" in c and "short_name" in c]
         return clients
     except Exception as e:
         print("Error fetching clients:", e)
         return []
 
-# ---------------- HELPER ---------------- #
-def parse_hour_field(hour_value):
-    if hour_value is None:
-        raise ValueError("hour is None")
-    hs = str(hour_value).strip().split(":")[0]
-    hour_int = int(float(hs))
-    if not (0 <= hour_int <= 23):
-        raise ValueError(f"Parsed hour out of range: {hour_int}")
-    return hour_int
-
-# ---------------- FETCH CONSUMPTION ---------------- #
-def fetch_consumption(scno, start_date, end_date):
-    all_data = []
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        try:
-            url = CONSUMPTION_API.format(scno, date_str)
-            r = requests.get(url, timeout=10)
-            if r.status_code == 404:
-                current_date += timedelta(days=1)
-                continue
-            r.raise_for_status()
-            daily = r.json()
-            if isinstance(daily, list):
-                for e in daily:
-                    if "hour" in e and "consumption" in e:
-                        try:
-                            hour = parse_hour_field(e["hour"])
-                            cons = float(e["consumption"])
-                            all_data.append((scno, date_str, hour, cons))
-                        except Exception:
-                            continue
-        except Exception:
-            pass
-        current_date += timedelta(days=1)
-    return all_data
-
-# ---------------- CALCULATE FLEXIBILITY ---------------- #
-def calculate_flexibility(df):
-    if df.empty:
-        return None
-    df["consumption"] = pd.to_numeric(df["consumption"], errors="coerce").fillna(0.0)
-
-    # Load Factor (LF)
-    daily_profiles = df.groupby(["date", "hour"])["consumption"].sum().reset_index()
-    lf_list = [
-        g["consumption"].mean() / g["consumption"].max()
-        for _, g in daily_profiles.groupby("date") if g["consumption"].max() != 0
-    ]
-    LF = float(np.mean(lf_list)) if lf_list else None
-
-    # Load Variability Index (LVI)
-    daily_totals = df.groupby("date")["consumption"].sum()
-    LVI = float(daily_totals.std() / daily_totals.mean()) if len(daily_totals) > 1 and daily_totals.mean() != 0 else None
-
-    # Daily Load Shape Stability (DLSS)
-    pivot = daily_profiles.pivot(index="hour", columns="date", values="consumption").fillna(0)
-    DLSS = None
-    if pivot.shape[1] >= 2:
-        typical_day = pivot.mean(axis=1)
-        correlations = [
-            np.corrcoef(pivot[c], typical_day)[0, 1]
-            for c in pivot.columns if not np.isnan(np.corrcoef(pivot[c], typical_day)[0, 1])
-        ]
-        DLSS = float(np.mean(correlations)) if correlations else None
-
-    return LF, LVI, DLSS
-
 # ---------------- RANK CLIENTS ---------------- #
 def rank_clients(df):
     if df.empty:
@@ -123,62 +61,25 @@ def rank_clients(df):
     return df.sort_values("Flexibility_Rank").reset_index(drop=True)
 
 # ---------------- PROCESS CLIENT ---------------- #
-def process_client(scno, name, start_date, end_date, conn):
+def process_client(scno, name, state):
+    t0 = time.perf_counter()
     try:
-        cur = conn.cursor()
-
-        # ✅ Skip if already processed today
-        cur.execute("SELECT calculated_at FROM flexibility_metrics WHERE scno=%s;", (scno,))
-        row = cur.fetchone()
-        if row and row[0] and row[0].date() == date.today():
-            with lock:
-                print(f"⏭ {name} ({scno}) — already processed today.")
-            return None
-
-        with lock:
-            print(f"⚙️ Processing {name} ({scno})...")
-
-        # --- Get last available date --- #
-        cur.execute("SELECT MAX(date) FROM consumption WHERE scno=%s;", (scno,))
-        last_date_row = cur.fetchone()
-        last_date = last_date_row[0]
-
-        fetch_end = datetime.today().date() - timedelta(days=1)
-        if last_date:
-            fetch_start = last_date + timedelta(days=1)
-        else:
-            fetch_start = start_date.date() if isinstance(start_date, datetime) else start_date
-
-        # --- Fetch new data --- #
-        new_data = fetch_consumption(scno, fetch_start, fetch_end)
-        if new_data:
-            execute_values(cur, """
-                INSERT INTO consumption (scno, date, hour, consumption)
-                VALUES %s
-                ON CONFLICT (scno, date, hour)
-                DO UPDATE SET consumption = EXCLUDED.consumption;
-            """, new_data)
-            conn.commit()
-            with lock:
-                print(f"✅ {name} ({scno}) — data updated until today.")
-        else:
-            with lock:
-                print(f"⏩ {name} ({scno}) — already up to date.")
+        print(f"⚙️ Processing {name} ({scno})...")
 
         # --- Calculate flexibility --- #
-        df = pd.read_sql("SELECT date, hour, consumption FROM consumption WHERE scno=%s;", conn, params=(scno,))
-        if df.empty:
+        if state is None:
             return None
 
-        flex = calculate_flexibility(df)
+        flex = state.metrics()
         if flex:
-            lf, lvi, dlss = flex
+            lf, lvi, dlss, _ = flex
             return {"scno": scno, "name": name, "LF": lf, "LVI": lvi, "DLSS": dlss}
 
     except Exception as e:
+        TELEMETRY.inc("client_errors_total")
         print(f"❌ Error {scno}: {e}")
     finally:
-        conn.close()
+        TELEMETRY.client(scno, time.perf_counter() - t0)
     return None
 
 # ---------------- MAIN ---------------- #
@@ -220,38 +121,68 @@ def main():
     """, clients)
     conn.commit()
 
-    print(f"\n🚀 Updating data for {len(clients)} clients...\n")
+    ensure_summary_views(conn)
+
+    # --- Fetch exactly the missing days (tail and holes) for pending clients --- #
+    cur.execute("SELECT scno FROM flexibility_metrics WHERE DATE(calculated_at) = CURRENT_DATE;")
+    done_today = {r[0] for r in cur.fetchall()}
+    pending = [(scno, name) for scno, name in clients if scno not in done_today]
+    fetch_end = datetime.today().date() - timedelta(days=1)
+
+    cache = ResponseCache(CACHE_PATH)
+    with TELEMETRY.stage("plan"):
+        jobs = plan_backfill(conn, [scno for scno, _ in pending], start_date.date(), fetch_end, cache=cache)
+    print(f"\n🚀 Updating data for {len(pending)} clients ({len(jobs)} missing days)...\n")
+    with TELEMETRY.stage("ingest"):
+        updated = backfill(jobs, conn, api=CONSUMPTION_API, range_api=CONSUMPTION_RANGE_API, cache=cache, snapshot=open_snapshot(SNAPSHOT_DIR))
+    cache.close()
+    print(f"✅ {len(updated)} clients updated ({sum(updated.values())} rows).\n")
+    if updated:
+        with TELEMETRY.stage("summary_views"):
+            refresh_summary_views(conn)
+
+    # --- Fold the new daily summaries into each client's running state --- #
+    with TELEMETRY.stage("update_states"):
+        states = update_states(conn, [scno for scno, _ in pending], processes=PROCESSES)
+        conn.commit()
 
+    # --- Metrics from the folded states; clients done today were filtered out above --- #
+    for scno, name in clients:
+        if scno in done_today:
+            print(f"⏭ {name} ({scno}) — already processed today.")
     results = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [
-            executor.submit(process_client, scno, name, start_date, end_date, get_conn())
-            for scno, name in clients
-        ]
-        for future in as_completed(futures):
-            result = future.result()
+    with TELEMETRY.stage("metrics"):
+        for scno, name in pending:
+            result = process_client(scno, name, states.get(scno))
             if result:
                 results.append(result)
 
     if results:
-        df = pd.DataFrame(results)
-        ranked = rank_clients(df)
-        print("\n🏆 Ranking complete!\n")
-
-        for _, row in ranked.iterrows():
-            cur.execute("""
-                INSERT INTO flexibility_metrics (scno, lf, lvi, dlss, flexibility_index, flexibility_rank, calculated_at)
-                VALUES (%s,%s,%s,%s,%s,%s,NOW())
-                ON CONFLICT (scno) DO UPDATE
-                SET lf=EXCLUDED.lf, lvi=EXCLUDED.lvi, dlss=EXCLUDED.dlss,
-                    flexibility_index=EXCLUDED.flexibility_index,
-                    flexibility_rank=EXCLUDED.flexibility_rank,
-                    calculated_at=NOW();
-            """, (row["scno"], row["LF"], row["LVI"], row["DLSS"], row["Flexibility_Index"], row["Flexibility_Rank"]))
+        # --- Re-rank incrementally; write only what moved, stamp every processed client --- #
+        with TELEMETRY.stage("rank"):
+            ranker = load_ranker(conn)
+            changed = ranker.update({r["scno"]: (r["LF"], r["LVI"], r["DLSS"]) for r in results})
+        print(f"\n🏆 Ranking complete! {len(changed)} rows changed.\n")
+
+        upsert_rows(conn, "flexibility_metrics", RANK_COLUMNS, changed)
+        stamp_calculated(conn, [r["scno"] for r in results])
         conn.commit()
+        notify_rank_change(conn)
+
+    # --- Short- and long-term flexibility over trailing windows --- #
+    with TELEMETRY.stage("windows"):
+        windows = rolling_metrics(conn, [scno for scno, _ in pending], fetch_end, ROLLING_WINDOWS)
+    upsert_rows(
+        conn, "flexibility_windows",
+        ["scno", "window_days", "lf", "lvi", "dlss", "peak_ratio"],
+        frame_rows(windows, ["scno", "window_days", "LF", "LVI", "DLSS", "Peak_Ratio"]),
+        key=("scno", "window_days"),
+    )
+    conn.commit()
 
     cur.close()
     conn.close()
+    print(f"📈 Run report written to {TELEMETRY.write_report(REPORT_PATH)}")
     print("\n✅ All done! Data updated until today.\n")
 
 if __name__ == "__main__":
@@ -0,0 +1,421 @@
+import asyncio
+import io
+import json
+import queue
+import threading
+from datetime import timedelta
+import numpy as np
+from api_client import ApiError, open_client
+from daily_store import refresh_daily
+from db import CONSUMPTION_COLUMNS, upsert_rows
+from telemetry import TELEMETRY
+
+try:
+    import ijson
+except ImportError:   # optional, range bodies only: they are then parsed with json.loads
+    ijson = None
+
+# ---------------- CONFIG ---------------- #
+CONSUMPTION_API = "https://ee.elementsenergies.com/api/fetchHourlyConsumption?scno={}&date={}"
+# Multi-day endpoint, formatted with (scno, first_date, last_date) and answering one
+# JSON array of hourly entries that each carry a "date". None = per-day requests only.
+# The scripts and the pipeline all use this one setting.
+CONSUMPTION_RANGE_API = None
+RANGE_MAX_DAYS = 31       # longest run of consecutive days in one work unit
+MAX_CONCURRENCY = 64      # upper bound for the adaptive in-flight window
+REQUEST_TIMEOUT = 10      # seconds, per attempt
+UPSERT_BATCH = 5000       # rows per COPY batch; each batch is its own transaction
+QUEUE_SIZE = 64           # parsed work units waiting for the writer before fetching pauses
+
+_DONE = object()
+
+# ---------------- HELPER ---------------- #
+def parse_hour_field(hour_value):
+    if hour_value is None:
+        raise ValueError("hour is None")
+    hs = str(hour_value).strip().split(":")[0]
+    hour_int = int(float(hs))
+    if not (0 <= hour_int <= 23):
+        raise ValueError(f"Parsed hour out of range: {hour_int}")
+    return hour_int
+
+
+# Precomputed hour for the formats the API sends ("HH:MM", "H:MM", "HH:MM:SS", "HH", ints);
+# anything else falls back to parse_hour_field
+HOUR_LOOKUP = {}
+for _h in range(24):
+    for _m in range(60):
+        HOUR_LOOKUP[f"{_h:02d}:{_m:02d}"] = _h
+        HOUR_LOOKUP[f"{_h}:{_m:02d}"] = _h
+    HOUR_LOOKUP.update({f"{_h:02d}:00:00": _h, f"{_h:02d}": _h, str(_h): _h, _h: _h})
+del _h, _m
+
+_NO_HOURS = np.empty(0, dtype=np.int8)
+_NO_VALUES = np.empty(0, dtype=np.float64)
+
+
+def parse_day(daily):
+    """
+    One day's JSON list → (hours int8, values float64, n_malformed). Hours
+    come from HOUR_LOOKUP, consumption is converted in one numpy call;
+    entries without a valid hour or a numeric consumption are counted in
+    n_malformed instead of raising.
+    """
+    if not isinstance(daily, list):
+        return _NO_HOURS, _NO_VALUES, 0
+    hours, values, bad = [], [], 0
+    lookup = HOUR_LOOKUP.get
+    for e in daily:
+        try:
+            h, c = e["hour"], e["consumption"]
+            hour = lookup(h)
+        except (TypeError, KeyError):
+            bad += 1
+            continue
+        if hour is None or h is True or h is False:
+            try:
+                hour = parse_hour_field(h)
+            except (TypeError, ValueError):
+                bad += 1
+                continue
+        if c is None:
+            bad += 1
+            continue
+        hours.append(hour)
+        values.append(c)
+    if not hours:
+        return _NO_HOURS, _NO_VALUES, bad
+
+    hours = np.array(hours, dtype=np.int8)
+    try:
+        # fromiter, unlike np.array, refuses nested values such as [2]
+        values = np.fromiter(values, dtype=np.float64, count=len(values))
+    except (TypeError, ValueError):
+        # rare: some consumption is not numeric, convert one by one
+        ok = np.ones(len(values), dtype=bool)
+        out = np.empty(len(values), dtype=np.float64)
+        for i, c in enumerate(values):
+            try:
+                out[i] = float(c)
+            except (TypeError, ValueError):
+                ok[i] = False
+        bad += int((~ok).sum())
+        hours, values = hours[ok], out[ok]
+    return hours, values, bad
+
+
+def parse_daily(scno, date_str, daily):
+    """(scno, date, hour, consumption) rows for one day; malformed entries are counted."""
+    hours, values, bad = parse_day(daily)
+    if bad:
+        TELEMETRY.inc("api_entries_malformed_total", bad)
+    return [(scno, date_str, h, v) for h, v in zip(hours.tolist(), values.tolist())]
+
+
+def iter_json_items(body):
+    """Elements of the top-level JSON array in body, streamed with ijson when installed."""
+    if ijson is not None:
+        return ijson.items(io.BytesIO(body), "item", use_float=True)
+    data = json.loads(body)
+    return data if isinstance(data, list) else []
+
+
+def day_jobs(scno, start_date, end_date):
+    """All (scno, date) pairs from start_date to end_date inclusive."""
+    jobs = []
+    current_date = start_date
+    while current_date <= end_date:
+        jobs.append((scno, current_date))
+        current_date += timedelta(days=1)
+    return jobs
+
+
+def coalesce_jobs(jobs, max_days=RANGE_MAX_DAYS):
+    """
+    Group (scno, date) jobs into (scno, first_date, last_date) runs of
+    consecutive days, each at most max_days long.
+    """
+    runs = []
+    for scno, day in sorted(set(jobs)):
+        if runs:
+            last = runs[-1]
+            if last[0] == scno and day == last[2] + timedelta(days=1) and (day - last[1]).days < max_days:
+                last[2] = day
+                continue
+        runs.append([scno, day, day])
+    return [tuple(r) for r in runs]
+
+# ---------------- ASYNC FETCH ---------------- #
+async def _fetch_day(client, api, scno, day, cache=None):
+    date_str = day.strftime("%Y-%m-%d")
+    try:
+        status, body = await client.get(api.format(scno, date_str))
+        if status == 404:
+            TELEMETRY.inc("api_requests_total", status="404", mode="day")
+            if cache is not None:
+                cache.put(scno, date_str, "404", 404)
+            return []
+        if status != 200:
+            raise ApiError(f"HTTP {status}")
+        daily = json.loads(body)
+    except Exception:
+        TELEMETRY.inc("api_requests_total", status="error", mode="day")
+        if cache is not None:
+            cache.put(scno, date_str, "failed")
+        return []
+    TELEMETRY.inc("api_requests_total", status="ok", mode="day")
+    rows = parse_daily(scno, date_str, daily)
+    if cache is not None:
+        cache.put(scno, date_str, "staged" if rows else "empty", 200, body)
+    return rows
+
+
+async def _fetch_range(client, range_api, scno, first, last, cache=None):
+    """
+    One request for the run first..last. The body is split by entry date, so
+    each day is parsed and cached exactly as if it had been fetched alone.
+    """
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    date_strs = [d.strftime("%Y-%m-%d") for d in days]
+    try:
+        status, body = await client.get(range_api.format(scno, date_strs[0], date_strs[-1]))
+        if status == 404:
+            TELEMETRY.inc("api_requests_total", status="404", mode="range")
+            if cache is not None:
+                for date_str in date_strs:
+                    cache.put(scno, date_str, "404", 404)
+            return []
+        if status != 200:
+            raise ApiError(f"HTTP {status}")
+        by_day = {}
+        for e in iter_json_items(body):
+            if isinstance(e, dict):
+                by_day.setdefault(str(e.get("date", ""))[:10], []).append(e)
+    except Exception:
+        TELEMETRY.inc("api_requests_total", status="error", mode="range")
+        if cache is not None:
+            for date_str in date_strs:
+                cache.put(scno, date_str, "failed")
+        return []
+    TELEMETRY.inc("api_requests_total", status="ok", mode="range")
+
+    rows = []
+    for date_str in date_strs:
+        daily = by_day.get(date_str, [])
+        day_rows = parse_daily(scno, date_str, daily)
+        rows.extend(day_rows)
+        if cache is not None:
+            cache.put(scno, date_str, "staged" if day_rows else "empty", 200, json.dumps(daily).encode())
+    return rows
+
+
+async def _fetch_unit(client, api, range_api, scno, first, last, cache=None):
+    """Rows for one run of consecutive days: a range request, or the days pipelined."""
+    if range_api is not None:
+        return await _fetch_range(client, range_api, scno, first, last, cache)
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    parts = await asyncio.gather(*(_fetch_day(client, api, scno, day, cache) for day in days))
+    return [row for rows in parts for row in rows]
+
+
+async def fetch_jobs(jobs, on_rows, api=CONSUMPTION_API, max_concurrency=MAX_CONCURRENCY, cache=None,
+                     range_api=CONSUMPTION_RANGE_API, max_days=RANGE_MAX_DAYS, refetch_fetched=False):
+    """
+    Fetch every (scno, date) in jobs through one rate-limited, retrying
+    ApiClient (concurrency adapts up to max_concurrency). Consecutive days
+    of a client are coalesced into work units of up to max_days: one
+    request each when range_api is set, otherwise their per-day requests
+    are issued together over the shared keep-alive session. A fixed set of
+    max_concurrency workers pulls units, so pending work stays bounded
+    however many jobs there are. Each unit's parsed rows go to on_rows
+    (awaited if it is a coroutine function, which lets the consumer apply
+    backpressure). With a ResponseCache, days already cached are skipped
+    and every outcome is recorded, so days that still fail after retries
+    are retried next run. Days with rows are recorded as staged; the writer
+    marks them fetched only once they are committed. refetch_fetched also
+    re-requests fetched days (see ResponseCache.pending).
+    """
+    if cache is not None:
+        wanted = len(jobs)
+        jobs = cache.pending(jobs, refetch_fetched=refetch_fetched)
+        TELEMETRY.inc("api_cache_hits_total", wanted - len(jobs))
+    units = iter(coalesce_jobs(jobs, max_days))
+    is_async = asyncio.iscoroutinefunction(on_rows)
+
+    async with open_client(max_concurrency, timeout=REQUEST_TIMEOUT) as client:
+        async def worker():
+            for scno, first, last in units:
+                rows = await _fetch_unit(client, api, range_api, scno, first, last, cache)
+                if rows:
+                    if is_async:
+                        await on_rows(rows)
+                    else:
+                        on_rows(rows)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(max_concurrency, 1))))
+        finally:
+            if cache is not None:
+                cache.commit()
+
+
+class _Stopped(Exception):
+    """The consumer of iter_rows() went away."""
+
+
+def iter_rows(jobs, api=CONSUMPTION_API, max_concurrency=MAX_CONCURRENCY, cache=None,
+              range_api=CONSUMPTION_RANGE_API, queue_size=QUEUE_SIZE, refetch_fetched=False):
+    """
+    Generator over parsed row lists, one per work unit, as they arrive.
+    Fetching runs on a background thread and waits whenever queue_size
+    lists are queued, so memory is set by the consumer's pace, not by the
+    length of the date range. Closing the generator early stops the fetch
+    and discards the queued rows; a fetch error is re-raised here once the
+    queued rows are consumed.
+    """
+    q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    async def on_rows(rows):
+        await asyncio.to_thread(put, rows)
+
+    def produce():
+        try:
+            asyncio.run(fetch_jobs(jobs, on_rows, api=api, max_concurrency=max_concurrency, cache=cache,
+                                   range_api=range_api, refetch_fetched=refetch_fetched))
+        except _Stopped:
+            return
+        except BaseException as e:
+            errors.append(e)
+        try:
+            put(_DONE)
+        except _Stopped:
+            pass
+
+    producer = threading.Thread(target=produce, name="ingest-fetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            rows = q.get()
+            if rows is _DONE:
+                break
+            yield rows
+    finally:
+        stop.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+
+def fetch_rows(jobs, api=CONSUMPTION_API, max_concurrency=MAX_CONCURRENCY, cache=None,
+               range_api=CONSUMPTION_RANGE_API):
+    """Blocking helper: fetch jobs and return all parsed rows as one list."""
+    all_data = []
+    for rows in iter_rows(jobs, api=api, max_concurrency=max_concurrency, cache=cache, range_api=range_api):
+        all_data.extend(rows)
+    return all_data
+
+# ---------------- INGEST ---------------- #
+class _ConsumptionWriter:
+    """
+    Collects parsed rows and writes every batch_size rows with a COPY into a
+    staging table merged by one INSERT ... ON CONFLICT, refreshing
+    consumption_daily for the touched days and committing, so each batch
+    is durable on its own. After the commit the batch's days are marked
+    fetched in the ResponseCache and mirrored into the Parquet snapshot,
+    when given.
+    """
+
+    def __init__(self, conn, batch_size, snapshot=None, cache=None):
+        self.conn = conn
+        self.snapshot = snapshot
+        self.cache = cache
+        self.batch_size = batch_size
+        self.pending = []
+        self.counts = {}
+
+    def add(self, rows):
+        self.pending.extend(rows)
+        scno = rows[0][0]
+        self.counts[scno] = self.counts.get(scno, 0) + len(rows)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        # one row per key, last wins: ON CONFLICT cannot touch a row twice in one statement
+        rows = list({r[:3]: r for r in self.pending}.values())
+        upsert_rows(self.conn, "consumption", CONSUMPTION_COLUMNS, rows, key=("scno", "date", "hour"), stamp=None)
+        cur = self.conn.cursor()
+        with TELEMETRY.timer("db_query_seconds", op="refresh_daily"):
+            refresh_daily(cur, {(r[0], r[1]) for r in rows})
+            self.conn.commit()
+        cur.close()
+        if self.cache is not None:
+            self.cache.mark_fetched({(r[0], str(r[1])) for r in rows})
+        if self.snapshot is not None:
+            self.snapshot.upsert(rows)
+        self.pending.clear()
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return self.counts
+
+
+def ingest(jobs, conn, api=CONSUMPTION_API, max_concurrency=MAX_CONCURRENCY, batch_size=UPSERT_BATCH,
+           cache=None, snapshot=None, range_api=CONSUMPTION_RANGE_API, refetch_fetched=False):
+    """
+    Stream all (scno, date) jobs into consumption: rows fetched on a
+    background thread flow through iter_rows()' bounded queue to a writer
+    that COPYs and commits batches of batch_size rows (consumption_daily
+    refreshed in the same transaction), so memory stays flat over long
+    ranges. A crash or writer error drops whatever was not committed yet:
+    the open batch plus up to queue_size queued and all in-flight units.
+    Those days stay missing from consumption, and in a ResponseCache stay
+    staged rather than fetched, so the next run requests them again. With
+    a ResponseCache only uncached, failed or uncommitted days go to the
+    network; with a ConsumptionSnapshot each batch is also merged into it. range_api
+    switches to one request per run of consecutive days. Returns
+    {scno: rows_upserted}.
+    """
+    out = _ConsumptionWriter(conn, batch_size, snapshot, cache)
+    fetched = iter_rows(jobs, api=api, max_concurrency=max_concurrency, cache=cache, range_api=range_api,
+                        refetch_fetched=refetch_fetched)
+    try:
+        for rows in fetched:
+            out.add(rows)
+    finally:
+        fetched.close()   # a writer error stops the fetch thread here, not at garbage collection
+        counts = out.close()
+    return counts
+
+
+def replay(cache, conn, scnos=None, start_date=None, end_date=None, batch_size=UPSERT_BATCH, snapshot=None):
+    """
+    Rebuild consumption offline from the fetched days in a ResponseCache,
+    without touching the API. Returns {scno: rows_upserted}.
+    """
+    out = _ConsumptionWriter(conn, batch_size, snapshot, cache)
+    try:
+        for scno, date_str, body in cache.iter_fetched(scnos, start_date, end_date):
+            rows = parse_daily(scno, date_str, json.loads(body))
+            if rows:
+                out.add(rows)
+    finally:
+        counts = out.close()
+    return counts
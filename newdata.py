@@ -1,11 +1,20 @@
-import requests
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta, date
 import psycopg2
 from psycopg2.extras import execute_values
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading, warnings
+import threading, time, warnings
+from daily_store import update_states
+from flex_engine import PROCESSES
+from db import upsert_rows
+from api_client import get_json
+from ingest import CONSUMPTION_RANGE_API
+from backfill_plan import plan_backfill, backfill
+from response_cache import CACHE_PATH, ResponseCache
+from snapshot import SNAPSHOT_DIR, open_snapshot
+from summary_views import ensure_summary_views, refresh_summary_views
+from rank_index import notify_rank_change
+from ranking import RANK_COLUMNS, load_ranker, stamp_calculated
+from telemetry import TELEMETRY
 warnings.filterwarnings("ignore")
 
 # ---------------- CONFIG ---------------- #
@@ -19,6 +28,7 @@ DB_CONFIG = {
 
 CLIENTS_API = "https://ee.elementsenergies.com/api/fetchAllParUniqueMSN"
 CONSUMPTION_API = "https://ee.elementsenergies.com/api/fetchHourlyConsumption?scno={}&date={}"
+REPORT_PATH = "newdata_run.json"        # run telemetry; use a .prom name for Prometheus text
 MAX_WORKERS = 16
 lock = threading.Lock()
 
@@ -29,156 +39,43 @@ def get_conn():
 # ---------------- FETCH CLIENTS ---------------- #
 def fetch_clients():
     try:
-        r = requests.get(CLIENTS_API, timeout=30)
-        r.raise_for_status()
-        data = r.json()
+        data = get_json(CLIENTS_API, timeout=30)
         clients = [(c["scno"], c["short_name"]) for c in data if "scno" in c and "short_name" in c]
         return clients
     except Exception as e:
         print("Error fetching clients:", e)
         return []
 
-# ---------------- HELPER ---------------- #
-def parse_hour_field(hour_value):
-    if hour_value is None:
-        raise ValueError("hour is None")
-    hs = str(hour_value).strip().split(":")[0]
-    hour_int = int(float(hs))
-    if not (0 >= hour_int >= 0 and hour_int <= 23):
-        if hour_int < 0 or hour_int > 23:
-            raise ValueError(f"Parsed hour out of range: {hour_int}")
-    return hour_int
-
-# ---------------- FETCH CONSUMPTION ---------------- #
-def fetch_consumption(scno, start_date, end_date):
-    all_data = []
-    current_date = start_date
-
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        try:
-            url = CONSUMPTION_API.format(scno, date_str)
-            r = requests.get(url, timeout=10)
-
-            if r.status_code == 404:
-                current_date += timedelta(days=1)
-                continue
-
-            r.raise_for_status()
-            daily = r.json()
-
-            if isinstance(daily, list):
-                for e in daily:
-                    if "hour" in e and "consumption" in e:
-                        try:
-                            hour = parse_hour_field(e["hour"])
-                            cons = float(e["consumption"])
-                            all_data.append((scno, date_str, hour, cons))
-                        except Exception:
-                            continue
-        except Exception:
-            pass
-
-        current_date += timedelta(days=1)
-
-    return all_data
-
-# ---------------- CALCULATE FLEXIBILITY ---------------- #
-def calculate_flexibility(df):
-    if df.empty:
-        return None
-
-    df["consumption"] = pd.to_numeric(df["consumption"], errors="coerce").fillna(0.0)
-
-    daily_profiles = df.groupby(["date", "hour"])["consumption"].sum().reset_index()
-    lf_list = [
-        g["consumption"].mean() / g["consumption"].max()
-        for _, g in daily_profiles.groupby("date") if g["consumption"].max() != 0
-    ]
-    LF = float(np.mean(lf_list)) if lf_list else None
-
-    daily_totals = df.groupby("date")["consumption"].sum()
-    LVI = float(daily_totals.std() / daily_totals.mean()) if len(daily_totals) > 1 and daily_totals.mean() != 0 else None
-
-    pivot = daily_profiles.pivot(index="hour", columns="date", values="consumption").fillna(0)
-    DLSS = None
-    if pivot.shape[1] >= 2:
-        typical_day = pivot.mean(axis=1)
-        correlations = [
-            np.corrcoef(pivot[c], typical_day)[0, 1]
-            for c in pivot.columns if not np.isnan(np.corrcoef(pivot[c], typical_day)[0, 1])
-        ]
-        DLSS = float(np.mean(correlations)) if correlations else None
-
-    return LF, LVI, DLSS
-
-# ---------------- RANK CLIENTS ---------------- #
-def rank_clients(df):
-    if df.empty:
-        return df
-
-    df = df.dropna(subset=["LF", "LVI", "DLSS"]).copy()
-
-    df["LF_norm"] = 1 - (df["LF"] - df["LF"].min()) / (df["LF"].max() - df["LF"].min())
-    df["LVI_norm"] = (df["LVI"] - df["LVI"].min()) / (df["LVI"].max() - df["LVI"].min())
-    df["DLSS_norm"] = 1 - (df["DLSS"] - df["DLSS"].min()) / (df["DLSS"].max() - df["DLSS"].min())
-
-    df = df.replace([np.inf, -np.inf], np.nan).dropna(subset=["LF_norm", "LVI_norm", "DLSS_norm"])
-    df["Flexibility_Index"] = df[["LF_norm", "LVI_norm", "DLSS_norm"]].mean(axis=1)
-    df["Flexibility_Rank"] = df["Flexibility_Index"].rank(ascending=False, method="min").astype(int)
-
-    return df.sort_values("Flexibility_Rank").reset_index(drop=True)
+# ---------------- NEW CLIENTS ---------------- #
+def find_new_clients(cur, clients):
+    """Clients with no rows in consumption yet."""
+    cur.execute("""
+        SELECT c.scno FROM clients c
+        WHERE EXISTS (SELECT 1 FROM consumption WHERE scno = c.scno);
+    """)
+    existing = {r[0] for r in cur.fetchall()}
+    return [(scno, name) for scno, name in clients if scno not in existing]
 
 # ---------------- PROCESS CLIENT ---------------- #
-def process_client(scno, name, start_date, end_date, conn):
+def process_client(scno, name, state):
+    t0 = time.perf_counter()
     try:
-        cur = conn.cursor()
-
-        # --------------------------------------------
-        # FIRST: Check if SCNO already exists in DB
-        # --------------------------------------------
-        cur.execute("SELECT 1 FROM consumption WHERE scno=%s LIMIT 1;", (scno,))
-        exists = cur.fetchone()
-
-        if exists:
-            with lock:
-                print(f"⏭ {name} ({scno}) — already in DB, skipping.")
-            return None
-
-        # Only print if we will actually process
         with lock:
-            print(f"⚙️ Processing NEW client {name} ({scno})…")
+            print(f"⚙️ Processing {name} ({scno})…")
 
-        new_data = fetch_consumption(scno, start_date, end_date)
-
-        if new_data:
-            execute_values(cur, """
-                INSERT INTO consumption (scno, date, hour, consumption)
-                VALUES %s
-                ON CONFLICT (scno, date, hour)
-                DO UPDATE SET consumption = EXCLUDED.consumption;
-            """, new_data)
-            conn.commit()
-
-            with lock:
-                print(f"✅ Saved consumption for {name} ({scno}).")
-        else:
-            with lock:
-                print(f"❗ No data found for {name} ({scno}).")
-
-        df = pd.read_sql("SELECT date, hour, consumption FROM consumption WHERE scno=%s;", conn, params=(scno,))
-        if df.empty:
+        if state is None:
             return None
 
-        flex = calculate_flexibility(df)
+        flex = state.metrics()
         if flex:
-            lf, lvi, dlss = flex
+            lf, lvi, dlss, _ = flex
             return {"scno": scno, "name": name, "LF": lf, "LVI": lvi, "DLSS": dlss}
 
     except Exception as e:
+        TELEMETRY.inc("client_errors_total")
         print(f"❌ Error {scno}: {e}")
     finally:
-        conn.close()
+        TELEMETRY.client(scno, time.perf_counter() - t0)
 
     return None
 
@@ -199,16 +96,42 @@ def main():
     """, clients)
     conn.commit()
 
-    print(f"\n🚀 Updating data for {len(clients)} clients...\n")
-
-    results = []
     end_date = datetime.today().date() - timedelta(days=1)
     start_date = end_date - timedelta(days=60)
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    ensure_summary_views(conn)
+    new_clients = find_new_clients(cur, clients)
+
+    # --- Backfill every missing (scno, date): new clients and holes in existing ones --- #
+    cache = ResponseCache(CACHE_PATH)
+    with TELEMETRY.stage("plan"):
+        jobs = plan_backfill(conn, [scno for scno, _ in clients], start_date, end_date, cache=cache)
+    new_scnos = {scno for scno, _ in new_clients}
+    gapped = {scno for scno, _ in jobs} - new_scnos
+    print(f"\n🚀 Backfilling {len(new_clients)} new clients and gaps in {len(gapped)} others ({len(jobs)} missing days)...\n")
+    with TELEMETRY.stage("ingest"):
+        saved = backfill(jobs, conn, api=CONSUMPTION_API, range_api=CONSUMPTION_RANGE_API, cache=cache, snapshot=open_snapshot(SNAPSHOT_DIR))
+    cache.close()
+    for scno, name in new_clients:
+        if scno in saved:
+            print(f"✅ Saved consumption for {name} ({scno}).")
+        else:
+            print(f"❗ No data found for {name} ({scno}).")
+    if saved:
+        with TELEMETRY.stage("summary_views"):
+            refresh_summary_views(conn)
+
+    # --- Bring running state and metrics up to date for new and backfilled clients --- #
+    with TELEMETRY.stage("update_states"):
+        touched = new_scnos | set(saved)
+        states = update_states(conn, touched, processes=PROCESSES)
+        conn.commit()
+
+    results = []
+    with TELEMETRY.stage("metrics"), ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         futures = [
-            executor.submit(process_client, scno, name, start_date, end_date, get_conn())
-            for scno, name in clients
+            executor.submit(process_client, scno, name, states.get(scno))
+            for scno, name in clients if scno in touched
         ]
         for future in as_completed(futures):
             res = future.result()
@@ -216,27 +139,20 @@ def main():
                 results.append(res)
 
     if results:
-        df = pd.DataFrame(results)
-        ranked = rank_clients(df)
-        print("\n🏆 Ranking complete.\n")
-
-        for _, row in ranked.iterrows():
-            cur.execute("""
-                INSERT INTO flexibility_metrics (scno, lf, lvi, dlss, flexibility_index, flexibility_rank, calculated_at)
-                VALUES (%s,%s,%s,%s,%s,%s,NOW())
-                ON CONFLICT (scno) DO UPDATE SET
-                    lf=EXCLUDED.lf, lvi=EXCLUDED.lvi, dlss=EXCLUDED.dlss,
-                    flexibility_index=EXCLUDED.flexibility_index,
-                    flexibility_rank=EXCLUDED.flexibility_rank,
-                    calculated_at=NOW();
-            """, (
-                row["scno"], row["LF"], row["LVI"], row["DLSS"],
-                row["Flexibility_Index"], row["Flexibility_Rank"]
-            ))
+        # --- Re-rank incrementally; write only what moved, stamp every processed client --- #
+        with TELEMETRY.stage("rank"):
+            ranker = load_ranker(conn)
+            changed = ranker.update({r["scno"]: (r["LF"], r["LVI"], r["DLSS"]) for r in results})
+        print(f"\n🏆 Ranking complete. {len(changed)} rows changed.\n")
+
+        upsert_rows(conn, "flexibility_metrics", RANK_COLUMNS, changed)
+        stamp_calculated(conn, [r["scno"] for r in results])
         conn.commit()
+        notify_rank_change(conn)
 
     cur.close()
     conn.close()
+    print(f"📈 Run report written to {TELEMETRY.write_report(REPORT_PATH)}")
     print("\n✅ All done.\n")
 
 if __name__ == "__main__":
@@ -0,0 +1,277 @@
+import argparse
+import warnings
+from datetime import datetime, timedelta
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
+import flexibility_pred
+import weekend_weekday
+from backfill_plan import plan_backfill, backfill
+from categories import categorize_client, create_category_table
+from daily_store import rolling_metrics
+from db import load_consumption, merge_frames, upsert_rows, frame_rows
+from flex_engine import DAY_PARTITIONS, PROCESSES, calculate_daytype_batch, series_from_frame
+from ingest import CONSUMPTION_RANGE_API
+from rank_index import notify_rank_change
+from ranking import RANK_COLUMNS, load_ranker, stamp_calculated
+from response_cache import CACHE_PATH, ResponseCache
+from snapshot import SNAPSHOT_DIR, ConsumptionSnapshot, open_snapshot
+from summary_views import ensure_summary_views, refresh_summary_views
+from tariff import TARIFFS, create_tariff_table, tariff_ratios
+from telemetry import TELEMETRY
+warnings.filterwarnings("ignore")
+
+# ---------------- CONFIG ---------------- #
+DB_CONFIG = flexibility_pred.DB_CONFIG
+CONSUMPTION_API = flexibility_pred.CONSUMPTION_API
+ROLLING_WINDOWS = flexibility_pred.ROLLING_WINDOWS
+IGNORE_SCNOS = weekend_weekday.IGNORE_SCNOS   # left out of the day-type metrics
+HISTORY_DAYS = 60                             # ingest window ending yesterday
+REPORT_PATH = "pipeline_run.json"   # run telemetry; use a .prom name for Prometheus text
+
+STAGES = ["ingest", "load", "compute", "rank", "write"]
+REQUIRES = {"compute": "load", "rank": "compute", "write": "compute"}
+METRICS = ["all", "weekday", "weekend", "saturday", "sunday", "categories", "windows", "tariffs"]
+RANKED = {"all", "weekday", "weekend"}   # metric sets whose ranks are written with them
+
+DAY_TYPES = ["all", "weekday", "weekend", "saturday", "sunday"]   # metric sets computed per day type
+
+# ---------------- STAGES ---------------- #
+def stage_ingest(conn, run):
+    """Refresh the client list and fetch every missing (scno, date) in the window."""
+    clients = flexibility_pred.fetch_clients()
+    if not clients:
+        print("No clients fetched.")
+        return
+    cur = conn.cursor()
+    execute_values(cur, """
+        INSERT INTO clients (scno, short_name)
+        VALUES %s
+        ON CONFLICT (scno) DO UPDATE SET short_name = EXCLUDED.short_name;
+    """, clients)
+    conn.commit()
+    cur.close()
+
+    ensure_summary_views(conn)
+    cache = ResponseCache(CACHE_PATH)
+    jobs = plan_backfill(conn, [scno for scno, _ in clients], run["as_of"] - timedelta(days=HISTORY_DAYS), run["as_of"],
+                         cache=cache)
+    print(f"\n🚀 Ingesting {len(jobs)} missing days for {len(clients)} clients...\n")
+    updated = backfill(jobs, conn, api=CONSUMPTION_API, range_api=CONSUMPTION_RANGE_API, cache=cache, snapshot=open_snapshot(SNAPSHOT_DIR))
+    cache.close()
+    print(f"✅ {len(updated)} clients updated ({sum(updated.values())} rows).\n")
+    if updated:
+        refresh_summary_views(conn)
+
+
+def stage_load(conn, run):
+    """
+    Read clients and all consumption once for every later stage, from the DB
+    or, with source="snapshot", from the Parquet snapshot.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT scno, short_name FROM clients;")
+    run["clients"] = cur.fetchall()
+    cur.close()
+
+    scnos = [scno for scno, _ in run["clients"]]
+    if run["source"] == "snapshot":
+        data = ConsumptionSnapshot(SNAPSHOT_DIR).read(scnos)
+    else:
+        data = load_consumption(conn, scnos=scnos)
+    run["series"] = series_from_frame(data)
+    for scno, name in run["clients"]:
+        if scno not in run["series"]:
+            print(f"⚠️ No data for {name} ({scno}), skipping.")
+    print(f"📥 Loaded {len(data)} rows for {len(run['series'])} clients.\n")
+
+
+def stage_compute(conn, run):
+    """Metric sets selected for this run, all from the shared per-client series."""
+    series, names = run["series"], dict(run["clients"])
+
+    results = run["results"] = {}
+    day_types = [label for label in DAY_TYPES if label in run["metrics"]]
+    if day_types:
+        # Every selected day type in one pass over each client's days
+        frames = calculate_daytype_batch(series, {label: DAY_PARTITIONS[label] for label in day_types}, processes=PROCESSES)
+        for label in day_types:
+            res = frames[label]
+            if label != "all":
+                res = res[~res["scno"].isin(IGNORE_SCNOS)].reset_index(drop=True)
+            res["name"] = res["scno"].map(names)
+            results[label] = res
+            print(f"⚙️ {label}: metrics for {len(res)} clients.")
+
+    if "categories" in run["metrics"]:
+        rows = [categorize_client(scno, name, series.get(scno)) for scno, name in run["clients"]]
+        results["categories"] = [r for r in rows if r]
+        print(f"⚙️ categories: {len(results['categories'])} clients.")
+
+    if "windows" in run["metrics"]:
+        results["windows"] = rolling_metrics(conn, [scno for scno, _ in run["clients"]], run["as_of"], ROLLING_WINDOWS)
+        print(f"⚙️ windows: {len(results['windows'])} rows.")
+
+    if "tariffs" in run["metrics"]:
+        results["tariffs"] = tariff_ratios(series, TARIFFS)
+        print(f"⚙️ tariffs: {len(TARIFFS)} tariffs, {len(results['tariffs'])} rows.")
+
+
+def stage_rank(conn, run):
+    """
+    All-day ranking through the same IncrementalRanker as the scripts (only
+    the RANK_COLUMNS rows that moved are kept), plus weekday/weekend
+    rankings with the off-peak penalty.
+    """
+    results = run["results"]
+    ranked = run["ranked"] = {}
+    if "all" in results:
+        ranker = load_ranker(conn)
+        ranked["all"] = ranker.update({
+            r.scno: tuple(None if pd.isna(v) else float(v) for v in (r.LF, r.LVI, r.DLSS))
+            for r in results["all"].itertuples(index=False)
+        })
+    for label, period in (("weekday", "Weekday"), ("weekend", "Weekend")):
+        if label in results:
+            ranked[label] = weekend_weekday.rank_clients(results[label], period)
+    print("\n🏆 Rankings calculated.\n")
+
+
+def _metrics_frames(run):
+    """flexibility_metrics day-type column sets for whatever was computed and ranked."""
+    results, ranked = run["results"], run.get("ranked", {})
+    frames = []
+
+    for suffix in ("weekday", "weekend"):
+        if suffix not in results:
+            continue
+        part = results[suffix][["scno", "LF", "LVI", "DLSS", "Peak_Ratio"]].copy()
+        if suffix == "weekday":
+            part["DLSS"] = (part["DLSS"] + 1) / 2   # stored normalized to [0, 1], as dlss.py does
+        frames.append(part.set_axis(["scno"] + [f"{c}_{suffix}" for c in ("lf", "lvi", "dlss", "peak_ratio")], axis=1))
+        if suffix in ranked and not ranked[suffix].empty:
+            part = ranked[suffix][["scno", "Flexibility_Reason", "Flexibility_Rank"]].copy()
+            part["Flexibility_Rank"] = part["Flexibility_Rank"].astype("Int64")
+            frames.append(part.set_axis(["scno", f"reason_{suffix}", f"flexibility_rank_{suffix}"], axis=1))
+
+    for day in ("saturday", "sunday"):
+        if day in results:
+            res = results[day].dropna(subset=["DLSS"])
+            frames.append(pd.DataFrame({"scno": res["scno"], f"dlss_{day}": (res["DLSS"] + 1) / 2}))
+    return frames
+
+
+def stage_write(conn, run):
+    """One upsert per target table."""
+    results, ranked = run["results"], run.get("ranked", {})
+
+    if "all" in ranked:
+        # As flexibility_pred/newdata: the rows that moved, and calculated_at for every client computed
+        upsert_rows(conn, "flexibility_metrics", RANK_COLUMNS, ranked["all"])
+        stamp_calculated(conn, results["all"]["scno"].tolist())
+
+    # Every loaded client gets every column, so metrics and ranks that became undefined are cleared
+    merged = merge_frames(_metrics_frames(run), keys=run["series"])
+    if len(merged.columns) > 1:
+        columns = list(merged.columns)
+        upsert_rows(conn, "flexibility_metrics", columns, frame_rows(merged, columns), update=columns[1:])
+
+    if results.get("categories"):
+        create_category_table()
+        columns = [
+            "scno", "name", "avg_consumption", "variability",
+            "consumption_level", "variability_level", "final_category",
+        ]
+        upsert_rows(
+            conn, "client_categories", columns,
+            [tuple(r[c] for c in columns) for r in results["categories"]],
+            update=columns[2:],
+        )
+
+    if "windows" in results:
+        upsert_rows(
+            conn, "flexibility_windows",
+            ["scno", "window_days", "lf", "lvi", "dlss", "peak_ratio"],
+            frame_rows(results["windows"], ["scno", "window_days", "LF", "LVI", "DLSS", "Peak_Ratio"]),
+            key=("scno", "window_days"),
+        )
+
+    if "tariffs" in results:
+        create_tariff_table(conn)
+        columns = ["scno", "tariff", "tou_window", "usage", "ratio"]
+        upsert_rows(
+            conn, "tariff_ratios", columns, frame_rows(results["tariffs"], columns),
+            key=("scno", "tariff", "tou_window"),
+        )
+    conn.commit()
+    notify_rank_change(conn)
+    print("💾 Results stored.")
+
+
+STAGE_FUNCS = {
+    "ingest": stage_ingest,
+    "load": stage_load,
+    "compute": stage_compute,
+    "rank": stage_rank,
+    "write": stage_write,
+}
+
+# ---------------- MAIN ---------------- #
+def run_pipeline(stages=STAGES, metrics=METRICS, as_of=None, source="db"):
+    """
+    Run the selected stages in pipeline order over one connection. Stages
+    that a selected stage depends on are added (e.g. write alone also loads,
+    computes and, for ranked metric sets, ranks). Returns the run dict (clients, series, results, ranked).
+    """
+    run = {
+        "metrics": set(metrics),
+        "source": source,
+        "as_of": as_of or (datetime.today().date() - timedelta(days=1)),
+    }
+    selected = set(stages)
+    requires = dict(REQUIRES)
+    if run["metrics"] & RANKED:
+        requires["write"] = "rank"   # never store new metrics next to old ranks
+    for name in reversed(STAGES):
+        if name in selected and name in requires:
+            selected.add(requires[name])
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        for name in STAGES:
+            if name in selected:
+                with TELEMETRY.stage(name):
+                    STAGE_FUNCS[name](conn, run)
+    finally:
+        conn.close()
+    return run
+
+
+def _csv_choices(choices):
+    def parse(value):
+        items = [v.strip() for v in value.split(",") if v.strip()]
+        unknown = set(items) - set(choices)
+        if unknown:
+            raise argparse.ArgumentTypeError(f"unknown: {', '.join(sorted(unknown))} (choose from {', '.join(choices)})")
+        return items
+    return parse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flexibility pipeline: ingest → load → compute → rank → write.")
+    parser.add_argument("--stages", type=_csv_choices(STAGES), default=STAGES,
+                        help=f"comma-separated stages to run (default: {','.join(STAGES)})")
+    parser.add_argument("--metrics", type=_csv_choices(METRICS), default=METRICS,
+                        help=f"comma-separated metric sets to compute (default: {','.join(METRICS)})")
+    parser.add_argument("--source", choices=["db", "snapshot"], default="db",
+                        help="where the load stage reads consumption from (default: db)")
+    parser.add_argument("--report", default=REPORT_PATH,
+                        help="run telemetry output; *.prom for Prometheus text, JSON otherwise (default: %(default)s)")
+    args = parser.parse_args()
+
+    run_pipeline(args.stages, args.metrics, source=args.source)
+    print(f"📈 Run report written to {TELEMETRY.write_report(args.report)}")
+    print("\n✅ Pipeline finished.\n")
+
+if __name__ == "__main__":
+    main()
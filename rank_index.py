@@ -0,0 +1,205 @@
+import asyncio
+import json
+import select
+import threading
+import time
+import psycopg2
+from db import make_pool, with_pooled_conn
+from telemetry import TELEMETRY
+
+# ---------------- CONFIG ---------------- #
+RANK_CHANNEL = "flexibility_ranks"   # NOTIFY channel written after rank tables change
+MAX_AGE = 900                        # seconds; reload even without a notification
+LISTEN_TIMEOUT = 5.0                 # seconds between checks of the listener socket
+POOL_SIZE = 2
+DAY_TYPES = {                        # rank column per day type
+    "all": "flexibility_rank",
+    "weekday": "flexibility_rank_weekday",
+    "weekend": "flexibility_rank_weekend",
+}
+
+INDEX_SQL = """
+    SELECT m.scno, c.short_name, m.flexibility_index,
+           m.flexibility_rank, m.flexibility_rank_weekday, m.reason_weekday,
+           m.flexibility_rank_weekend, m.reason_weekend,
+           {category} AS category, m.calculated_at
+    FROM flexibility_metrics m
+    LEFT JOIN clients c ON c.scno = m.scno
+    {join}
+    ORDER BY m.scno;
+"""
+
+# ---------------- INDEX ---------------- #
+class RankIndex:
+    """
+    Read-only snapshot of the rank rows, indexed by scno and, per day type
+    (all/weekday/weekend), as rank-ordered lists overall and per category.
+    A new snapshot replaces the old one whole, so readers never lock.
+    """
+
+    def __init__(self, rows):
+        self.loaded_at = time.time()
+        self.rows = {r["scno"]: r for r in rows}
+        self.by_rank = {}
+        for day_type, rank_col in DAY_TYPES.items():
+            ranked = sorted((r for r in rows if r[rank_col] is not None), key=lambda r: (r[rank_col], r["scno"]))
+            groups = {None: ranked}
+            for r in ranked:
+                groups.setdefault(r["category"], []).append(r)
+            self.by_rank[day_type] = groups
+        self.categories = sorted({r["category"] for r in rows if r["category"] is not None})
+        # Legacy full-list payload, encoded once per snapshot
+        self.all_ranks_body = json.dumps({
+            "status": "success",
+            "data": [{"scno": r["scno"], "flexibility_rank": r["flexibility_rank"]} for r in rows],
+        }).encode()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, scno):
+        return self.rows.get(scno)
+
+    def ranked(self, day_type="all", category=None):
+        """Rank-ordered rows of one day type, optionally of one category."""
+        if day_type not in DAY_TYPES:
+            raise ValueError(f"unknown day type: {day_type}")
+        return self.by_rank[day_type].get(category, [])
+
+    def top(self, k, day_type="all", category=None):
+        return self.ranked(day_type, category)[:k]
+
+    def page(self, page, page_size, day_type="all", category=None):
+        """(rows of 1-based page, total rows)."""
+        ranked = self.ranked(day_type, category)
+        start = (max(page, 1) - 1) * page_size
+        return ranked[start:start + page_size], len(ranked)
+
+
+def _json_value(v):
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return v
+
+
+def load_index(conn):
+    """RankIndex from flexibility_metrics, clients and (if present) client_categories."""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('client_categories') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        sql = INDEX_SQL.format(category="cc.final_category", join="LEFT JOIN client_categories cc ON cc.scno = m.scno")
+    else:
+        sql = INDEX_SQL.format(category="NULL", join="")
+    with TELEMETRY.timer("db_query_seconds", op="load_rank_index"):
+        cur.execute(sql)
+        columns = [d[0] for d in cur.description]
+        rows = [dict(zip(columns, (_json_value(v) for v in row))) for row in cur.fetchall()]
+    cur.close()
+    return RankIndex(rows)
+
+
+def notify_rank_change(conn):
+    """Tell serving processes to reload; call after the rank tables are committed."""
+    cur = conn.cursor()
+    cur.execute(f"NOTIFY {RANK_CHANNEL};")
+    conn.commit()
+    cur.close()
+
+# ---------------- SERVICE ---------------- #
+class RankService:
+    """
+    Serves RankIndex snapshots to async handlers. The first request loads
+    the index; after that a NOTIFY on RANK_CHANNEL (or MAX_AGE passing)
+    rebuilds it in the background from a small psycopg2 pool while the old
+    snapshot keeps answering, so requests never wait on Postgres.
+    """
+
+    def __init__(self, db_config, pool_size=POOL_SIZE, max_age=MAX_AGE):
+        self.db_config = db_config
+        self.pool = make_pool(db_config, pool_size)
+        self.max_age = max_age
+        self.index = None
+        self.loop = None
+        self.reloading = None
+        self.dirty = False
+        self.stop = threading.Event()
+        self.listener = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.listener = threading.Thread(target=self._listen, name="rank-listen", daemon=True)
+        self.listener.start()
+        await self.reload()
+
+    def close(self):
+        self.stop.set()
+        if self.listener is not None:
+            self.listener.join()
+        self.pool.closeall()
+
+    async def reload(self):
+        """Load a fresh snapshot; concurrent callers share one load."""
+        if self.reloading is None:
+            self.reloading = asyncio.ensure_future(asyncio.to_thread(with_pooled_conn, self.pool, load_index))
+        task = self.reloading
+        try:
+            self.index = await task
+            TELEMETRY.inc("rank_index_reloads_total")
+        finally:
+            if self.reloading is task:
+                self.reloading = None
+        return self.index
+
+    def invalidate(self):
+        """
+        Start a background reload, keeping the current snapshot meanwhile. A
+        load already running may predate the change, so it is followed by
+        another one.
+        """
+        if self.reloading is not None:
+            self.dirty = True
+        else:
+            asyncio.ensure_future(self._background_reload())
+
+    async def _background_reload(self):
+        try:
+            while True:
+                self.dirty = False
+                await self.reload()
+                if not self.dirty:
+                    break
+        except Exception as e:
+            TELEMETRY.inc("rank_index_reload_errors_total")
+            print("❌ Rank index reload failed:", e)
+
+    async def get_index(self):
+        if self.index is None:
+            return await self.reload()
+        if time.time() - self.index.loaded_at > self.max_age:
+            self.invalidate()
+        return self.index
+
+    def _listen(self):
+        """LISTEN on its own connection; each notification schedules a reload."""
+        conn = None
+        while not self.stop.is_set():
+            try:
+                if conn is None:
+                    conn = psycopg2.connect(**self.db_config)
+                    conn.autocommit = True
+                    conn.cursor().execute(f"LISTEN {RANK_CHANNEL};")
+                if select.select([conn], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    self.loop.call_soon_threadsafe(self.invalidate)
+            except (psycopg2.Error, OSError):
+                # Reconnect and reload, since notifications may have been missed
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                self.loop.call_soon_threadsafe(self.invalidate)
+                self.stop.wait(LISTEN_TIMEOUT)
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,174 @@
+import math
+from bisect import bisect_left, insort
+
+# ---------------- CONFIG ---------------- #
+RANK_COLUMNS = ["scno", "lf", "lvi", "dlss", "flexibility_index", "flexibility_rank"]
+
+# ---------------- RANKER ---------------- #
+def _usable(metrics):
+    return metrics is not None and all(v is not None and not math.isnan(v) for v in metrics)
+
+
+class IncrementalRanker:
+    """
+    flexibility_pred.rank_clients() kept up to date one client at a time.
+
+    LF, LVI and DLSS values are held in one sorted list per metric, so the
+    min/max used by the normalization are the list ends, and the
+    Flexibility_Index of every ranked client is held in a list sorted by
+    (-index, scno), so a rank (method="min", highest index first) is one
+    bisect. update() finds each changed client with an O(log n) search,
+    though the list insert/delete behind it shifts O(n) elements; all
+    indices are recomputed only when a min or max actually moves. It
+    returns only the rows whose metrics, index or rank differ from what was
+    last written. These costs hold within one process lifetime: a fresh
+    ranker from load_ranker() first reads and sorts the whole table.
+    """
+
+    def __init__(self):
+        self.raw = {}                # scno -> (LF, LVI, DLSS) as last given, possibly with None
+        self.metrics = {}            # scno -> (LF, LVI, DLSS) of clients in the population
+        self.values = ([], [], [])   # sorted LF, LVI, DLSS of those clients
+        self.index = {}              # scno -> Flexibility_Index of ranked clients
+        self.by_index = []           # sorted (-index, scno)
+        self.written = {}            # scno -> row tuple as last emitted / stored
+        self.dirty = set()
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Seed from stored (scno, lf, lvi, dlss, flexibility_index,
+        flexibility_rank) rows. Rows whose stored index or rank disagree
+        with the recomputed ones are emitted by the next update().
+        """
+        r = cls()
+        for scno, lf, lvi, dlss, idx, rank in rows:
+            r.written[scno] = (scno, lf, lvi, dlss, idx, rank)
+            r.raw[scno] = (lf, lvi, dlss)
+            if _usable((lf, lvi, dlss)):
+                r.metrics[scno] = (lf, lvi, dlss)
+                for values, v in zip(r.values, (lf, lvi, dlss)):
+                    values.append(v)
+        for values in r.values:
+            values.sort()
+        r._reindex_all()
+        r.dirty = {scno for scno in r.written if r._row(scno) != r.written[scno]}
+        return r
+
+    # ---------------- NORMALIZATION ---------------- #
+    def _bounds(self):
+        if not self.values[0]:
+            return None
+        return tuple((v[0], v[-1]) for v in self.values)
+
+    def _index_of(self, m, bounds):
+        """Mean of the three normalized metrics, or None where rank_clients drops the row."""
+        (lf_lo, lf_hi), (lvi_lo, lvi_hi), (dlss_lo, dlss_hi) = bounds
+        if lf_hi == lf_lo or lvi_hi == lvi_lo or dlss_hi == dlss_lo:
+            return None
+        lf, lvi, dlss = m
+        return ((1 - (lf - lf_lo) / (lf_hi - lf_lo))
+                + (lvi - lvi_lo) / (lvi_hi - lvi_lo)
+                + (1 - (dlss - dlss_lo) / (dlss_hi - dlss_lo))) / 3
+
+    def _reindex_all(self):
+        bounds = self._bounds()
+        self.index = {}
+        if bounds is not None:
+            for scno, m in self.metrics.items():
+                idx = self._index_of(m, bounds)
+                if idx is not None:
+                    self.index[scno] = idx
+        self.by_index = sorted((-idx, scno) for scno, idx in self.index.items())
+
+    def rank(self, scno):
+        """1 + number of clients with a higher index (pandas rank method="min")."""
+        idx = self.index.get(scno)
+        if idx is None:
+            return None
+        return bisect_left(self.by_index, (-idx,)) + 1
+
+    def _row(self, scno):
+        return (scno,) + self.raw[scno] + (self.index.get(scno), self.rank(scno))
+
+    def _at_or_below(self, hi, lo=-math.inf):
+        """scnos with lo <= index <= hi."""
+        a = bisect_left(self.by_index, (-hi,))
+        b = bisect_left(self.by_index, (math.nextafter(-lo, math.inf),)) if lo > -math.inf else len(self.by_index)
+        return [s for _, s in self.by_index[a:b]]
+
+    # ---------------- UPDATE ---------------- #
+    def update(self, changes):
+        """
+        Apply {scno: (LF, LVI, DLSS) or None} and return the changed
+        RANK_COLUMNS tuples. A client with a missing metric leaves the
+        population and is emitted with a NULL index and rank.
+        """
+        bounds_before = self._bounds()
+        touched = self.dirty | set(changes)
+        self.dirty = set()
+
+        moved = {}
+        for scno, m in changes.items():
+            m = (None, None, None) if m is None else tuple(None if v is None else float(v) for v in m)
+            self.raw[scno] = m
+            old = self.metrics.pop(scno, None)
+            if old is not None:
+                for values, v in zip(self.values, old):
+                    del values[bisect_left(values, v)]
+            if _usable(m):
+                self.metrics[scno] = m
+                for values, v in zip(self.values, m):
+                    insort(values, v)
+            moved[scno] = self.index.pop(scno, None)
+
+        bounds = self._bounds()
+        if bounds != bounds_before:
+            # A min or max moved, so every index changes
+            self._reindex_all()
+            touched.update(self.raw)
+        else:
+            for scno, old in moved.items():
+                if old is not None:
+                    del self.by_index[bisect_left(self.by_index, (-old, scno))]
+                new = self._index_of(self.metrics[scno], bounds) if scno in self.metrics else None
+                if new is not None:
+                    self.index[scno] = new
+                    insort(self.by_index, (-new, scno))
+                # Other clients' ranks move only if their index lies between old and new
+                if old is not None and new is not None:
+                    touched.update(self._at_or_below(max(old, new), min(old, new)))
+                elif old is not None or new is not None:
+                    touched.update(self._at_or_below(new if old is None else old))
+
+        changed = []
+        for scno in touched:
+            row = self._row(scno)
+            if self.written.get(scno) != row:
+                self.written[scno] = row
+                changed.append(row)
+        return changed
+
+
+def load_ranker(conn):
+    """
+    IncrementalRanker seeded from flexibility_metrics: one full read and an
+    O(n log n) sort of every client, paid once per run.
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(RANK_COLUMNS)} FROM flexibility_metrics;")
+    rows = cur.fetchall()
+    cur.close()
+    return IncrementalRanker.from_rows(rows)
+
+
+def stamp_calculated(conn, scnos):
+    """
+    Set calculated_at on every processed client's row, including the ones
+    update() did not emit because nothing moved, so the "already processed
+    today" checks and the served calculated_at see the run. The caller
+    commits, together with the changed rows.
+    """
+    cur = conn.cursor()
+    cur.execute("UPDATE flexibility_metrics SET calculated_at = NOW() WHERE scno = ANY(%s);", (list(scnos),))
+    cur.close()
@@ -0,0 +1,171 @@
+import hashlib
+import sqlite3
+import threading
+import zlib
+from datetime import date, timedelta
+
+# ---------------- CONFIG ---------------- #
+CACHE_PATH = "api_cache.sqlite3"   # raw API responses, replayable with python response_cache.py
+REFETCH_RECENT_DAYS = 3    # 404 / empty days this close to today are retried
+COMMIT_EVERY = 500         # manifest writes per SQLite commit
+
+FETCHED, STAGED, NOT_FOUND, EMPTY, FAILED = "fetched", "staged", "404", "empty", "failed"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blobs (
+        sha256 TEXT PRIMARY KEY,
+        body BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS manifest (
+        scno TEXT NOT NULL,
+        date TEXT NOT NULL,
+        status TEXT NOT NULL,
+        http_status INTEGER,
+        sha256 TEXT REFERENCES blobs (sha256),
+        attempts INTEGER NOT NULL DEFAULT 1,
+        updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+        PRIMARY KEY (scno, date)
+    );
+"""
+
+# ---------------- CACHE ---------------- #
+class ResponseCache:
+    """
+    Local content-addressed cache of raw consumption API responses.
+
+    Bodies are stored once per SHA-256 (zlib-compressed) in blobs; manifest
+    records the outcome of the latest attempt per (scno, date): staged (rows
+    received, not yet committed to consumption), fetched (rows committed),
+    404, empty (200 with no rows) or failed. Safe to share between threads.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL;")
+        self.db.execute("PRAGMA synchronous=NORMAL;")
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+
+    def put(self, scno, date_str, status, http_status=None, body=None):
+        """Record one attempt; body is the raw response bytes for staged/empty days."""
+        sha = None
+        with self.lock:
+            if body is not None:
+                sha = hashlib.sha256(body).hexdigest()
+                self.db.execute(
+                    "INSERT OR IGNORE INTO blobs (sha256, body) VALUES (?, ?);",
+                    (sha, zlib.compress(body)),
+                )
+            self.db.execute("""
+                INSERT INTO manifest (scno, date, status, http_status, sha256)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (scno, date) DO UPDATE
+                SET status = excluded.status,
+                    http_status = excluded.http_status,
+                    sha256 = COALESCE(excluded.sha256, manifest.sha256),
+                    attempts = manifest.attempts + 1,
+                    updated_at = datetime('now');
+            """, (scno, date_str, status, http_status, sha))
+            self.uncommitted += 1
+            if self.uncommitted >= COMMIT_EVERY:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def mark_fetched(self, keys):
+        """Promote staged (scno, date_str) days to fetched once their rows are committed."""
+        with self.lock:
+            self.db.executemany(
+                "UPDATE manifest SET status = ? WHERE scno = ? AND date = ? AND status = ?;",
+                [(FETCHED, scno, date_str, STAGED) for scno, date_str in keys],
+            )
+            self.uncommitted += len(keys)
+            if self.uncommitted >= COMMIT_EVERY:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def get(self, scno, date_str):
+        """Raw cached body bytes for (scno, date), or None."""
+        with self.lock:
+            row = self.db.execute("""
+                SELECT b.body FROM manifest m JOIN blobs b ON b.sha256 = m.sha256
+                WHERE m.scno = ? AND m.date = ?;
+            """, (scno, date_str)).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+    def statuses(self, scnos=None):
+        """{(scno, date_str): status} for all (or the given) scnos."""
+        with self.lock:
+            rows = self.db.execute("SELECT scno, date, status FROM manifest;").fetchall()
+        wanted = set(scnos) if scnos is not None else None
+        return {(s, d): st for s, d, st in rows if wanted is None or s in wanted}
+
+    def pending(self, jobs, today=None, refetch_fetched=False):
+        """
+        The (scno, date) jobs that still need the network: never tried,
+        failed or staged (received but never committed, e.g. the run
+        crashed), plus 404/empty days within REFETCH_RECENT_DAYS of today
+        (data can land late). With refetch_fetched, fetched days are kept
+        too: jobs planned from consumption coverage are days still missing
+        hours, which only a new request can fill.
+        """
+        recent = (today or date.today()) - timedelta(days=REFETCH_RECENT_DAYS)
+        known = self.statuses({scno for scno, _ in jobs})
+        out = []
+        for scno, day in jobs:
+            status = known.get((scno, day.strftime("%Y-%m-%d")))
+            if status is None or status in (FAILED, STAGED) or (refetch_fetched and status == FETCHED):
+                out.append((scno, day))
+            elif status in (NOT_FOUND, EMPTY) and day >= recent:
+                out.append((scno, day))
+        return out
+
+    def iter_fetched(self, scnos=None, start_date=None, end_date=None):
+        """Yield (scno, date_str, body bytes) for every cached fetched or staged day, in order."""
+        where, params = ["m.status IN (?, ?)"], [FETCHED, STAGED]
+        if scnos is not None:
+            scnos = list(scnos)
+            where.append(f"m.scno IN ({', '.join('?' * len(scnos))})")
+            params.extend(scnos)
+        if start_date is not None:
+            where.append("m.date >= ?")
+            params.append(start_date.strftime("%Y-%m-%d"))
+        if end_date is not None:
+            where.append("m.date <= ?")
+            params.append(end_date.strftime("%Y-%m-%d"))
+        with self.lock:
+            rows = self.db.execute(f"""
+                SELECT m.scno, m.date, b.body FROM manifest m
+                JOIN blobs b ON b.sha256 = m.sha256
+                WHERE {' AND '.join(where)}
+                ORDER BY m.scno, m.date;
+            """, params).fetchall()
+        for scno, date_str, body in rows:
+            yield scno, date_str, zlib.decompress(body)
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+# ---------------- REPLAY ---------------- #
+if __name__ == "__main__":
+    # Rebuild consumption (and consumption_daily) offline from the cache:
+    #   python response_cache.py [cache_path]
+    import sys
+    import psycopg2
+    from flexibility_pred import DB_CONFIG
+    from ingest import replay
+
+    cache = ResponseCache(sys.argv[1] if len(sys.argv) > 1 else CACHE_PATH)
+    conn = psycopg2.connect(**DB_CONFIG)
+    counts = replay(cache, conn)
+    print(f"✅ Replayed {sum(counts.values())} rows for {len(counts)} clients from {cache.path}.")
+    conn.close()
+    cache.close()
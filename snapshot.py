@@ -0,0 +1,121 @@
+import os
+from urllib.parse import quote
+import pandas as pd
+from db import CONSUMPTION_COLUMNS, empty_consumption, load_consumption
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:   # snapshots are optional; the DB path works without pyarrow
+    pa = None
+
+# ---------------- CONFIG ---------------- #
+SNAPSHOT_DIR = "consumption_snapshot"   # Parquet copy kept in step once exported
+EXPORT_CHUNK = 500        # clients per COPY during a full export
+
+if pa is not None:
+    FILE_SCHEMA = pa.schema([("date", pa.date32()), ("hour", pa.int8()), ("consumption", pa.float64())])
+    PARTITIONING = ds.partitioning(pa.schema([("month", pa.string()), ("scno", pa.string())]), flavor="hive")
+
+# ---------------- SNAPSHOT ---------------- #
+class ConsumptionSnapshot:
+    """
+    Parquet copy of consumption laid out as root/month=YYYY-MM/scno=<scno>/
+    part.parquet, one file per client-month. Kept in step with the DB by
+    upsert() from the ingest path, and read with partition pruning so
+    analytics runs do not touch Postgres.
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        if pa is None:
+            raise ImportError("pyarrow is required for consumption snapshots")
+        self.root = root
+
+    def _path(self, month, scno):
+        return os.path.join(self.root, f"month={month}", f"scno={quote(str(scno), safe='')}", "part.parquet")
+
+    def _write(self, month, scno, part):
+        path = self._path(month, scno)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.Table.from_pandas(part, schema=FILE_SCHEMA, preserve_index=False)
+        tmp = path + ".tmp"
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+
+    def _write_partitions(self, df, merge):
+        df = df.assign(date=pd.to_datetime(df["date"]).dt.date)
+        months = pd.to_datetime(df["date"]).dt.strftime("%Y-%m")
+        for (month, scno), part in df.groupby([months, df["scno"].astype(str)], sort=False):
+            part = part[["date", "hour", "consumption"]]
+            path = self._path(month, scno)
+            if merge and os.path.exists(path):
+                old = pq.read_table(path, columns=["date", "hour", "consumption"]).to_pandas()
+                part = pd.concat([old, part]).drop_duplicates(["date", "hour"], keep="last")
+            self._write(month, scno, part.sort_values(["date", "hour"]))
+
+    def upsert(self, rows):
+        """Merge (scno, date, hour, consumption) rows into their client-month files."""
+        if rows:
+            self._write_partitions(pd.DataFrame(rows, columns=CONSUMPTION_COLUMNS), merge=True)
+
+    def export(self, conn, scnos=None, chunk_size=EXPORT_CHUNK):
+        """Rewrite the snapshot for scnos (default: every client) from the DB."""
+        if scnos is None:
+            cur = conn.cursor()
+            cur.execute("SELECT scno FROM clients ORDER BY scno;")
+            scnos = [r[0] for r in cur.fetchall()]
+            cur.close()
+        scnos = list(scnos)
+        rows = 0
+        for i in range(0, len(scnos), chunk_size):
+            df = load_consumption(conn, scnos=scnos[i:i + chunk_size])
+            self._write_partitions(df, merge=False)
+            rows += len(df)
+        return rows
+
+    def read(self, scnos=None, start_date=None, end_date=None):
+        """
+        Same typed long frame as db.load_consumption(), read from Parquet.
+        Month and scno filters prune whole directories before any file is
+        opened.
+        """
+        if not os.path.isdir(self.root):
+            return empty_consumption()
+        dataset = ds.dataset(self.root, format="parquet", partitioning=PARTITIONING)
+        expr = None
+        if scnos is not None:
+            expr = ds.field("scno").isin([str(s) for s in scnos])
+        if start_date is not None:
+            cond = (ds.field("month") >= start_date.strftime("%Y-%m")) & (ds.field("date") >= pa.scalar(start_date, pa.date32()))
+            expr = cond if expr is None else expr & cond
+        if end_date is not None:
+            cond = (ds.field("month") <= end_date.strftime("%Y-%m")) & (ds.field("date") <= pa.scalar(end_date, pa.date32()))
+            expr = cond if expr is None else expr & cond
+
+        table = dataset.to_table(columns=CONSUMPTION_COLUMNS, filter=expr)
+        if table.num_rows == 0:
+            return empty_consumption()
+        df = table.to_pandas(date_as_object=False)
+        return df.astype({
+            "scno": "category", "date": "datetime64[ns]", "hour": "int8", "consumption": "float64",
+        })
+
+
+def open_snapshot(root=SNAPSHOT_DIR):
+    """The snapshot at root if it has been exported and pyarrow is available, else None."""
+    if pa is None or not os.path.isdir(root):
+        return None
+    return ConsumptionSnapshot(root)
+
+# ---------------- EXPORT ---------------- #
+if __name__ == "__main__":
+    # Full export from the DB: python snapshot.py [root]
+    import sys
+    import psycopg2
+    from flexibility_pred import DB_CONFIG
+
+    snap = ConsumptionSnapshot(sys.argv[1] if len(sys.argv) > 1 else SNAPSHOT_DIR)
+    conn = psycopg2.connect(**DB_CONFIG)
+    print(f"✅ Exported {snap.export(conn)} rows to {snap.root}.")
+    conn.close()
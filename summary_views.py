@@ -0,0 +1,177 @@
+import hashlib
+import pandas as pd
+from daily_store import ensure_daily_tables
+from flex_engine import PEAK_HOURS
+from telemetry import TELEMETRY
+
+# ---------------- CONFIG ---------------- #
+DAY_TYPES = ["all", "weekday", "weekend", "saturday", "sunday"]
+METRIC_COLUMNS = ["scno", "LF", "LVI", "DLSS", "Peak_Ratio", "n_days"]
+
+# Per (scno, day_type) summary over consumption_daily: the metrics of
+# flex_engine.flexibility_from_cube, the 24-hour typical profile, peak-hour
+# and total sums, and hourly count/sum/sum of squares.
+PROFILE_VIEW_SQL = """
+    CREATE MATERIALIZED VIEW client_profile_summary AS
+    WITH days AS (
+        SELECT d.scno, t.day_type, d.date, d.n_hours, d.day_sum, d.day_max, d.day_mean, d.day_sumsq, d.profile
+        FROM consumption_daily d
+        CROSS JOIN LATERAL (VALUES
+            ('all'),
+            (CASE WHEN EXTRACT(ISODOW FROM d.date) <= 5 THEN 'weekday' ELSE 'weekend' END),
+            (CASE EXTRACT(ISODOW FROM d.date) WHEN 6 THEN 'saturday' WHEN 7 THEN 'sunday' END)
+        ) AS t(day_type)
+        WHERE t.day_type IS NOT NULL
+    ),
+    stats AS (
+        SELECT scno, day_type,
+               COUNT(*) AS n_days,
+               AVG(day_mean / NULLIF(day_max, 0)) AS lf,
+               CASE WHEN AVG(day_sum) <> 0 THEN stddev_samp(day_sum) / AVG(day_sum) END AS lvi,
+               SUM(day_sum) AS total_sum,
+               SUM(n_hours) AS n_hours,
+               SUM(day_sumsq) AS hour_sumsq
+        FROM days
+        GROUP BY scno, day_type
+    ),
+    hours AS (
+        SELECT days.scno, days.day_type, days.date, h.hour::int - 1 AS hour, h.v
+        FROM days
+        CROSS JOIN LATERAL unnest(days.profile) WITH ORDINALITY AS h(v, hour)
+    ),
+    typical AS (
+        SELECT scno, day_type, hour, SUM(COALESCE(v, 0)) AS hour_sum, bool_or(v IS NOT NULL) AS seen
+        FROM hours
+        GROUP BY scno, day_type, hour
+    ),
+    day_corr AS (
+        SELECT hr.scno, hr.day_type, hr.date,
+               corr(COALESCE(hr.v, 0), t.hour_sum) AS c
+        FROM hours hr
+        JOIN typical t USING (scno, day_type, hour)
+        WHERE t.seen
+        GROUP BY hr.scno, hr.day_type, hr.date
+    ),
+    shape AS (
+        SELECT t.scno, t.day_type,
+               array_agg(t.hour_sum ORDER BY t.hour) AS hour_sums,
+               SUM(t.hour_sum) FILTER (WHERE t.hour = ANY(%(peak_hours)s)) AS peak_sum
+        FROM typical t
+        GROUP BY t.scno, t.day_type
+    ),
+    dlss AS (
+        SELECT scno, day_type, AVG(LEAST(1.0, GREATEST(-1.0, c))) FILTER (WHERE c IS NOT NULL) AS dlss
+        FROM day_corr
+        GROUP BY scno, day_type
+    )
+    SELECT s.scno, s.day_type, s.n_days, s.lf, s.lvi,
+           CASE WHEN s.n_days >= 2 THEN l.dlss END AS dlss,
+           CASE WHEN s.total_sum > 0 THEN COALESCE(p.peak_sum, 0) / s.total_sum ELSE 0 END AS peak_ratio,
+           (SELECT array_agg(x / s.n_days) FROM unnest(p.hour_sums) AS x) AS typical_profile,
+           COALESCE(p.peak_sum, 0) AS peak_sum, s.total_sum, s.n_hours, s.hour_sumsq
+    FROM stats s
+    JOIN shape p USING (scno, day_type)
+    LEFT JOIN dlss l USING (scno, day_type)
+    WITH DATA;
+
+    CREATE UNIQUE INDEX client_profile_summary_key ON client_profile_summary (scno, day_type);
+"""
+
+# Definition hash (PEAK_HOURS is baked in) and the newest consumption_daily
+# stamp each view was built from
+VIEW_STATE_DDL = """
+    CREATE TABLE IF NOT EXISTS summary_view_state (
+        name VARCHAR PRIMARY KEY,
+        definition VARCHAR,
+        source_updated_at TIMESTAMP
+    );
+"""
+
+# ---------------- VIEWS ---------------- #
+def ensure_summary_views(conn):
+    """
+    Create consumption_daily (if needed) and the client_profile_summary view.
+    The view is dropped and rebuilt when its rendered SQL no longer matches
+    the stored definition, e.g. after PEAK_HOURS changed. The unique
+    (scno, day_type) index is what allows concurrent refreshes;
+    consumption and consumption_daily are served by their (scno, date, ...)
+    primary keys.
+    """
+    ensure_daily_tables(conn)
+    cur = conn.cursor()
+    cur.execute(VIEW_STATE_DDL)
+    sql = cur.mogrify(PROFILE_VIEW_SQL, {"peak_hours": list(PEAK_HOURS)})
+    definition = hashlib.sha256(sql).hexdigest()
+    cur.execute("SELECT definition FROM summary_view_state WHERE name = 'client_profile_summary';")
+    row = cur.fetchone()
+    if row is None or row[0] != definition:
+        cur.execute("SELECT max(updated_at) FROM consumption_daily;")
+        source_updated_at = cur.fetchone()[0]
+        cur.execute("DROP MATERIALIZED VIEW IF EXISTS client_profile_summary;")
+        cur.execute(sql)
+        cur.execute("""
+            INSERT INTO summary_view_state (name, definition, source_updated_at)
+            VALUES ('client_profile_summary', %s, %s)
+            ON CONFLICT (name) DO UPDATE
+            SET definition = EXCLUDED.definition, source_updated_at = EXCLUDED.source_updated_at;
+        """, (definition, source_updated_at))
+    conn.commit()
+    cur.close()
+
+
+def refresh_summary_views(conn, concurrently=True, force=False):
+    """
+    Rebuild client_profile_summary from consumption_daily, unless no daily
+    summary was written since the view was last built (force refreshes
+    anyway). Concurrent refreshes leave the current contents readable until
+    the new ones are swapped in. Returns True when the view was refreshed.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT max(updated_at) FROM consumption_daily;")
+    source_updated_at = cur.fetchone()[0]
+    cur.execute("SELECT source_updated_at FROM summary_view_state WHERE name = 'client_profile_summary';")
+    row = cur.fetchone()
+    if not force and row is not None and (source_updated_at is None or
+                                          (row[0] is not None and source_updated_at <= row[0])):
+        conn.commit()
+        cur.close()
+        return False
+    with TELEMETRY.timer("db_query_seconds", op="refresh_summary_views"):
+        cur.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}client_profile_summary;")
+    cur.execute("UPDATE summary_view_state SET source_updated_at = %s WHERE name = 'client_profile_summary';",
+                (source_updated_at,))
+    conn.commit()
+    cur.close()
+    return True
+
+# ---------------- READ ---------------- #
+def load_daytype_metrics(conn, day_type, scnos=None):
+    """
+    LF, LVI, DLSS, Peak_Ratio and n_days per client for one day type, in the
+    shape calculate_flexibility_batch() returns (NaN where undefined).
+    """
+    if day_type not in DAY_TYPES:
+        raise ValueError(f"unknown day type: {day_type}")
+    cur = conn.cursor()
+    query = "SELECT scno, lf, lvi, dlss, peak_ratio, n_days FROM client_profile_summary WHERE day_type = %s"
+    params = [day_type]
+    if scnos is not None:
+        query += " AND scno = ANY(%s)"
+        params.append(list(scnos))
+    cur.execute(query + " ORDER BY scno;", params)
+    rows = cur.fetchall()
+    cur.close()
+    df = pd.DataFrame(rows, columns=METRIC_COLUMNS)
+    return df.astype({"LF": "float64", "LVI": "float64", "DLSS": "float64", "Peak_Ratio": "float64"})
+
+# ---------------- REFRESH ---------------- #
+if __name__ == "__main__":
+    # Create and refresh the summary views: python summary_views.py
+    import psycopg2
+    from flexibility_pred import DB_CONFIG
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    ensure_summary_views(conn)
+    refresh_summary_views(conn, force=True)
+    conn.close()
+    print("✅ Summary views refreshed.")
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+from flex_engine import CHUNK_CLIENTS, DAY_PARTITIONS, HOLIDAY, PEAK_HOURS, series_from_frame
+
+# ---------------- DEFINITIONS ---------------- #
+class Window:
+    """One time-of-use rule: hours of the day, on days of one day type, optionally in some months only."""
+
+    __slots__ = ("name", "hours", "day_type", "months")
+
+    def __init__(self, name, hours, day_type="all", months=None):
+        if day_type not in DAY_PARTITIONS and day_type != HOLIDAY:
+            raise ValueError(f"unknown day type: {day_type}")
+        self.name = name
+        self.hours = list(hours)
+        self.day_type = day_type
+        self.months = None if months is None else list(months)
+
+
+class Tariff:
+    """
+    Named time-of-use windows. Each (date, hour) belongs to the first window
+    whose rule matches it, otherwise to default. Holiday dates are matched
+    by HOLIDAY windows and otherwise treated as day of week holiday_as
+    (Mon=0, default Sunday). Several rules may share a window name, e.g. a
+    summer and a winter "peak".
+    """
+
+    def __init__(self, name, windows, default="off_peak", holidays=(), holiday_as=6):
+        self.name = name
+        self.windows = list(windows)
+        self.default = default
+        self.holidays = pd.to_datetime(list(holidays)).values.astype("datetime64[D]")
+        self.holiday_as = holiday_as
+        self.window_names = list(dict.fromkeys([w.name for w in self.windows] + [default]))
+
+    def assign(self, dates):
+        """int8 [n_dates, 24] index into window_names for every (date, hour)."""
+        dates = pd.DatetimeIndex(pd.to_datetime(dates))
+        holiday = np.isin(dates.values.astype("datetime64[D]"), self.holidays)
+        dow = np.where(holiday, self.holiday_as, dates.dayofweek)
+        month = dates.month.to_numpy()
+
+        codes = np.full((len(dates), 24), self.window_names.index(self.default), dtype=np.int8)
+        taken = np.zeros((len(dates), 24), dtype=bool)
+        for w in self.windows:
+            if w.day_type == HOLIDAY:
+                days = holiday.copy()
+            else:
+                days = np.isin(dow, list(DAY_PARTITIONS[w.day_type]))
+            if w.months is not None:
+                days &= np.isin(month, w.months)
+            hours = np.zeros(24, dtype=bool)
+            hours[w.hours] = True
+            cells = days[:, None] & hours[None, :] & ~taken
+            codes[cells] = self.window_names.index(w.name)
+            taken |= cells
+        return codes
+
+    def masks(self, dates):
+        """bool [n_windows, n_dates, 24], one exclusive hour x day mask per window."""
+        codes = self.assign(dates)
+        return codes[None, :, :] == np.arange(len(self.window_names))[:, None, None]
+
+# ---------------- CONFIG ---------------- #
+TARIFFS = [
+    # What Peak_Ratio measures today
+    Tariff("current", [Window("peak", PEAK_HOURS)]),
+    # Seasonal three-band weekday design; weekends and holidays off-peak
+    Tariff("tou_3band", [
+        Window("peak", range(12, 16), "weekday", months=(4, 5, 6)),
+        Window("peak", range(18, 22), "weekday"),
+        Window("shoulder", range(7, 18), "weekday"),
+    ]),
+]
+
+TARIFF_DDL = """
+    CREATE TABLE IF NOT EXISTS tariff_ratios (
+        scno VARCHAR,
+        tariff VARCHAR,
+        tou_window VARCHAR,
+        usage DOUBLE PRECISION,
+        ratio DOUBLE PRECISION,
+        calculated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (scno, tariff, tou_window)
+    );
+"""
+
+# ---------------- EVALUATE ---------------- #
+def compile_tariffs(tariffs, dates):
+    """
+    (labels, matrix): every tariff's window masks over dates stacked into one
+    float64 [n_dates * 24, total windows] matrix, with (tariff, window)
+    labels for its columns.
+    """
+    labels, masks = [], []
+    for t in tariffs:
+        m = t.masks(dates)
+        labels.extend((t.name, w) for w in t.window_names)
+        masks.append(m.reshape(len(m), -1))
+    return labels, np.concatenate(masks).T.astype(np.float64)
+
+
+def tariff_ratios(df, tariffs=TARIFFS, chunk_size=CHUNK_CLIENTS):
+    """
+    Usage and share of usage per time-of-use window of every tariff, for all
+    clients of a long (scno, date, hour, consumption) frame or a
+    {scno: HourlySeries} mapping. The masks are compiled once over the
+    fleet's dates; each chunk of clients is then one [clients, days * 24]
+    matrix product. Returns a long frame of scno, tariff, tou_window, usage,
+    ratio (0 for clients without usage, as Peak_Ratio).
+    """
+    columns = ["scno", "tariff", "tou_window", "usage", "ratio"]
+    series = df if isinstance(df, dict) else series_from_frame(df)
+    items = [(scno, s) for scno, s in series.items() if s.n_days]
+    if not items:
+        return pd.DataFrame(columns=columns)
+
+    dates = np.unique(np.concatenate([s.dates for _, s in items]))
+    labels, matrix = compile_tariffs(tariffs, dates)
+    tariff_names = [t for t, _ in labels]
+    window_names = [w for _, w in labels]
+
+    parts = []
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i + chunk_size]
+        cube = np.zeros((len(chunk), len(dates), 24))
+        for c, (_, s) in enumerate(chunk):
+            cube[c, np.searchsorted(dates, s.dates)] = s.values
+        x = cube.reshape(len(chunk), -1)
+        usage = x @ matrix                                   # [clients, windows]
+        total = x.sum(axis=1)[:, None]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = np.where(total > 0, usage / total, 0.0)
+        parts.append(pd.DataFrame({
+            "scno": np.repeat([scno for scno, _ in chunk], len(labels)),
+            "tariff": np.tile(tariff_names, len(chunk)),
+            "tou_window": np.tile(window_names, len(chunk)),
+            "usage": usage.ravel(),
+            "ratio": ratio.ravel(),
+        }))
+    return pd.concat(parts, ignore_index=True)
+
+
+def create_tariff_table(conn):
+    cur = conn.cursor()
+    cur.execute(TARIFF_DDL)
+    conn.commit()
+    cur.close()
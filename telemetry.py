@@ -0,0 +1,142 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ---------------- CONFIG ---------------- #
+PREFIX = "flex_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SLOWEST_CLIENTS = 20      # per-client timings listed in the JSON report
+
+# ---------------- REGISTRY ---------------- #
+class Telemetry:
+    """
+    Thread-safe in-process counters, latency histograms, stage wall times
+    and per-client timings for one run. Recording is a dict update under a
+    lock, so it is cheap enough for the per-request and per-batch paths.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+            self.clients = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        i = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += seconds
+            h[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the block's wall time into histogram name."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    @contextmanager
+    def stage(self, name):
+        """Add the block's wall time to stage name."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def client(self, scno, seconds):
+        """Per-client wall time: kept individually and folded into client_seconds."""
+        with self.lock:
+            self.clients[scno] = self.clients.get(scno, 0.0) + seconds
+        self.observe("client_seconds", seconds)
+
+    # ---------------- EXPORT ---------------- #
+    def to_json(self):
+        with self.lock:
+            slowest = sorted(self.clients.items(), key=lambda kv: kv[1], reverse=True)[:SLOWEST_CLIENTS]
+            return {
+                "started_at": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "wall_seconds": round(time.time() - self.started, 3),
+                "stages": {k: round(v, 6) for k, v in self.stages.items()},
+                "counters": [
+                    {"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {
+                        "name": n, "labels": dict(l), "count": h[2], "sum": round(h[1], 6),
+                        "mean": round(h[1] / h[2], 6) if h[2] else None,
+                        "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], h[0])),
+                    }
+                    for (n, l), h in sorted(self.histograms.items())
+                ],
+                "clients": {"count": len(self.clients), "slowest": [{"scno": s, "seconds": round(t, 6)} for s, t in slowest]},
+            }
+
+    def to_prometheus(self):
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} counter")
+                    typed.add(name)
+                lines.append(f"{PREFIX}{name}{fmt(labels)} {value}")
+
+            for (name, labels), (counts, total, n) in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, c in zip(list(LATENCY_BUCKETS) + ["+Inf"], counts):
+                    cumulative += c
+                    lines.append(f"{PREFIX}{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{fmt(labels)} {total}")
+                lines.append(f"{PREFIX}{name}_count{fmt(labels)} {n}")
+
+            if self.stages:
+                lines.append(f"# TYPE {PREFIX}stage_seconds gauge")
+                for name, secs in self.stages.items():
+                    lines.append(f'{PREFIX}stage_seconds{{stage="{name}"}} {secs}')
+            lines.append(f"# TYPE {PREFIX}run_seconds gauge")
+            lines.append(f"{PREFIX}run_seconds {time.time() - self.started}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        """Prometheus text for *.prom, JSON otherwise."""
+        with open(path, "w") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), f, indent=2)
+        return path
+
+
+TELEMETRY = Telemetry()
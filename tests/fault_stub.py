@@ -0,0 +1,76 @@
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from aiohttp import web
+
+
+class FaultStub:
+    """
+    Local aiohttp server for exercising ApiClient. Each request takes the
+    next scripted fault: ("status", code, headers), ("timeout", seconds)
+    (sleep before answering) or ("ok", body); once the script is used up
+    it answers 200 with a day of hourly entries. Request times and the
+    highest number of concurrent requests are recorded.
+    """
+
+    def __init__(self, script=(), body=None):
+        self.script = list(script)
+        self.body = body if body is not None else json.dumps(
+            [{"hour": f"{h:02d}:00", "consumption": h * 1.5} for h in range(24)]
+        ).encode()
+        self.hits = []
+        self.paths = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request):
+        self.hits.append(time.monotonic())
+        self.paths.append(request.path_qs)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            fault = self.script.pop(0) if self.script else ("ok", self.body)
+            if fault[0] == "status":
+                return web.Response(status=fault[1], headers=fault[2] if len(fault) > 2 else None)
+            if fault[0] == "timeout":
+                await asyncio.sleep(fault[1])
+                return web.Response(body=self.body)
+            return web.Response(body=fault[1])
+        finally:
+            self.in_flight -= 1
+
+    def url(self, path="/day?scno={}&date={}"):
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+@contextmanager
+def serving(stub):
+    """Run stub on its own event loop thread, for code that starts its own loop (iter_rows, ingest)."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="fault-stub", daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(stub.__aenter__(), loop).result()
+    try:
+        yield stub
+    finally:
+        asyncio.run_coroutine_threadsafe(stub.__aexit__(None, None, None), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
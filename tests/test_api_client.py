@@ -0,0 +1,129 @@
+import asyncio
+import random
+import time
+import pytest
+import api_client
+from api_client import AdaptiveConcurrency, ApiClient, ApiError, TokenBucket, open_client
+from fault_stub import FaultStub
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _get(stub, timeout=5, **kwargs):
+    async with open_client(4, timeout=timeout, **kwargs) as client:
+        return client, await client.get(stub.url("/day"))
+
+
+def test_retries_then_gives_up():
+    async def main():
+        async with FaultStub([("status", 503)] * 10) as stub:
+            with pytest.raises(ApiError):
+                await _get(stub, retries=3, backoff_base=0.001)
+            return len(stub.hits)
+    assert run(main()) == 4
+
+
+def test_recovers_after_5xx():
+    async def main():
+        async with FaultStub([("status", 500), ("status", 502)]) as stub:
+            _, (status, body) = await _get(stub, retries=3, backoff_base=0.001)
+            return status, len(stub.hits)
+    assert run(main()) == (200, 3)
+
+
+def test_404_is_not_retried():
+    async def main():
+        async with FaultStub([("status", 404)]) as stub:
+            _, (status, _) = await _get(stub, retries=3, backoff_base=0.001)
+            return status, len(stub.hits)
+    assert run(main()) == (404, 1)
+
+
+def test_retry_after_is_honoured():
+    async def main():
+        async with FaultStub([("status", 429, {"Retry-After": "0.3"})]) as stub:
+            _, (status, _) = await _get(stub, retries=2, backoff_base=0.001)
+            return status, stub.hits[1] - stub.hits[0]
+    status, gap = run(main())
+    assert status == 200
+    assert gap >= 0.3
+
+
+def test_timeout_is_retried():
+    async def main():
+        async with FaultStub([("timeout", 1.0)]) as stub:
+            _, (status, _) = await _get(stub, timeout=0.2, retries=2, backoff_base=0.001)
+            return status, len(stub.hits)
+    assert run(main()) == (200, 2)
+
+
+def test_backoff_is_capped_full_jitter():
+    client = ApiClient(None, 4, backoff_base=0.5, backoff_cap=3.0)
+    random.seed(0)
+    for attempt in range(8):
+        waits = [client.backoff(attempt) for _ in range(200)]
+        assert all(0 <= w <= min(3.0, 0.5 * 2 ** attempt) for w in waits)
+    assert client.backoff(0, retry_after="2") == 2.0
+    assert client.backoff(0, retry_after="120") == 3.0
+    assert client.backoff(0, retry_after="Wed, 21 Oct 2015 07:28:00 GMT") <= 0.5
+
+
+def test_rate_cap():
+    async def main():
+        bucket = TokenBucket(rate=20, burst=1)
+        t0 = time.monotonic()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.monotonic() - t0
+    assert run(main()) >= 0.45
+
+
+def test_rate_cap_through_client():
+    async def main():
+        async with FaultStub() as stub:
+            async with open_client(8, rate=20, burst=1) as client:
+                await asyncio.gather(*(client.get(stub.url("/day")) for _ in range(11)))
+            return stub.hits[-1] - stub.hits[0]
+    assert run(main()) >= 0.45
+
+
+def test_window_halves_once_per_cooldown():
+    window = AdaptiveConcurrency(32, min_limit=2)
+    window.limit = 32.0
+    window.on_throttle()
+    assert window.limit == 16
+    window.on_throttle()                 # same burst of failures
+    assert window.limit == 16
+    window.last_cut -= api_client.CUT_COOLDOWN
+    window.on_throttle()
+    assert window.limit == 8
+    for _ in range(10):
+        window.last_cut -= api_client.CUT_COOLDOWN
+        window.on_throttle()
+    assert window.limit == 2
+
+
+def test_window_shrinks_on_throttling_responses(monkeypatch):
+    monkeypatch.setattr(api_client, "CUT_COOLDOWN", 0.0)
+    async def main():
+        async with FaultStub([("status", 503)] * 3) as stub:
+            async with open_client(32, retries=3, backoff_base=0.001) as client:
+                client.window.limit = 32.0
+                status, _ = await client.get(stub.url("/day"))
+                return status, client.window.limit
+    status, limit = run(main())
+    assert status == 200
+    assert 4 <= limit < 5   # halved three times, then one additive step
+
+
+def test_window_bounds_in_flight():
+    async def main():
+        async with FaultStub([("timeout", 0.05)] * 40) as stub:
+            async with open_client(6, rate=1000, burst=1000) as client:
+                client.window.limit = 3.0
+                client.window.on_success = lambda latency: None   # hold the window still
+                await asyncio.gather(*(client.get(stub.url("/day")) for _ in range(30)))
+            return stub.max_in_flight
+    assert run(main()) <= 3
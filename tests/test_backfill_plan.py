@@ -0,0 +1,95 @@
+import asyncio
+import json
+from datetime import date, timedelta
+import backfill_plan
+import ingest
+from backfill_plan import FULL_DAY, Coverage, settled
+from fault_stub import FaultStub
+from response_cache import ResponseCache
+
+DAY = date(2024, 1, 2)
+
+
+def partial_day_coverage():
+    """A two-day window where A has both days, the second with hours 0-11 only."""
+    cov = Coverage(["A"], date(2024, 1, 1), DAY)
+    cov.bits[0, 0] = FULL_DAY
+    cov.bits[0, 1] = (1 << 12) - 1
+    return cov
+
+
+def cached_as_fetched(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    cache.put("A", DAY.strftime("%Y-%m-%d"), "staged", 200, b'[{"hour": "00:00", "consumption": 1}]')
+    cache.mark_fetched([("A", DAY.strftime("%Y-%m-%d"))])
+    return cache
+
+
+def test_partial_day_is_planned():
+    cov = partial_day_coverage()
+    assert cov.gaps(partial=True) == [("A", DAY)]
+    assert cov.gaps(partial=False) == []
+    assert cov.summary() == (1, 1, 0)
+
+
+def test_partial_day_with_cache_entry_is_refetched(tmp_path):
+    cache = cached_as_fetched(tmp_path)
+    jobs = partial_day_coverage().gaps()
+    assert cache.pending(jobs) == []
+    assert cache.pending(jobs, refetch_fetched=True) == jobs
+
+    async def main():
+        got = []
+        async with FaultStub() as stub:
+            await ingest.fetch_jobs(jobs, got.extend, api=stub.url(), max_concurrency=2, cache=cache,
+                                    refetch_fetched=True)
+            return got, len(stub.hits)
+    rows, hits = asyncio.run(main())
+    assert hits == 1
+    assert sorted(r[2] for r in rows) == list(range(24))
+    # awaiting the writer's commit again
+    assert cache.statuses() == {("A", "2024-01-02"): "staged"}
+    cache.close()
+
+
+def test_backfill_bypasses_fetched_filter(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_ingest(jobs, conn, **kwargs):
+        calls.append((jobs, kwargs))
+        return {"A": 24}
+    monkeypatch.setattr(backfill_plan, "ingest", fake_ingest)
+
+    cache = cached_as_fetched(tmp_path)
+    jobs = partial_day_coverage().gaps()
+    assert backfill_plan.backfill(jobs, None, cache=cache) == {"A": 24}
+    (planned, kwargs), = calls
+    assert planned == jobs
+    assert kwargs["refetch_fetched"] is True
+    assert kwargs["cache"] is cache
+    cache.close()
+
+
+def cached_body(tmp_path, hours):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    body = json.dumps([{"hour": f"{h:02d}:00", "consumption": 1} for h in hours]).encode()
+    cache.put("A", DAY.strftime("%Y-%m-%d"), "staged", 200, body)
+    cache.mark_fetched([("A", DAY.strftime("%Y-%m-%d"))])
+    return cache
+
+
+def test_partial_day_the_api_served_partial_is_settled(tmp_path):
+    cache = cached_body(tmp_path, range(12))
+    cov = partial_day_coverage()
+    jobs = cov.gaps()
+    assert settled(cov, jobs, cache, today=DAY + timedelta(days=30)) == {("A", DAY)}
+    # late hours can still land on recent days
+    assert settled(cov, jobs, cache, today=DAY + timedelta(days=1)) == set()
+    cache.close()
+
+
+def test_partial_day_missing_cached_hours_is_not_settled(tmp_path):
+    cache = cached_body(tmp_path, range(24))
+    cov = partial_day_coverage()
+    assert settled(cov, cov.gaps(), cache, today=DAY + timedelta(days=30)) == set()
+    cache.close()
@@ -0,0 +1,22 @@
+import pandas as pd
+from db import frame_rows, merge_frames
+
+
+def test_merge_frames_over_keys_clears_missing_clients():
+    weekday = pd.DataFrame({"scno": ["A"], "lf_weekday": [0.5], "flexibility_rank_weekday": pd.array([1], dtype="Int64")})
+    weekend = pd.DataFrame({"scno": ["A"], "lf_weekend": [0.4]})
+    # B fell out of both rankings but was loaded: it must still be written, as NULLs
+    merged = merge_frames([weekday, weekend], keys={"A", "B"})
+    columns = list(merged.columns)
+    assert columns == ["scno", "lf_weekday", "flexibility_rank_weekday", "lf_weekend"]
+    rows = dict((r[0], r[1:]) for r in frame_rows(merged, columns))
+    assert rows["A"] == (0.5, 1, 0.4)
+    assert rows["B"] == (None, None, None)
+
+
+def test_merge_frames_keeps_columns_of_empty_frames_with_keys():
+    empty = pd.DataFrame(columns=["scno", "dlss_sunday"])
+    saturday = pd.DataFrame({"scno": ["A"], "dlss_saturday": [0.9]})
+    merged = merge_frames([saturday, empty], keys=["A"])
+    assert list(merged.columns) == ["scno", "dlss_saturday", "dlss_sunday"]
+    assert frame_rows(merged, list(merged.columns)) == [("A", 0.9, None)]
@@ -0,0 +1,235 @@
+import warnings
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from categories import categorize_client
+from flex_engine import (
+    DAY_PARTITIONS, HOLIDAY, RollingFlex, calculate_daytype_batch, calculate_flexibility_batch, fold_many,
+    series_from_frame,
+)
+
+
+def _frame():
+    rows = [("A", "2024-01-01", h, float(h)) for h in range(24)]
+    rows += [("A", "2024-01-02", h, np.nan if h < 12 else 2.0) for h in range(24)]
+    return pd.DataFrame(rows, columns=["scno", "date", "hour", "consumption"])
+
+
+def test_present_values_leave_out_nan_hours():
+    s = series_from_frame(_frame())["A"]
+    assert s.mask.sum() == 48
+    values = s.present_values()
+    assert len(values) == 36
+    assert values.sum() == sum(range(24)) + 12 * 2.0
+
+
+def test_series_without_nan_has_no_missing_mask():
+    df = _frame().fillna(1.0)
+    assert series_from_frame(df)["A"].missing is None
+
+
+@pytest.mark.parametrize("select, days", [
+    (lambda s: s.weekdays(), range(5)),
+    (lambda s: s.weekend(), (5, 6)),
+    (lambda s: s.days_of_week(2, 2), (2,)),
+    (lambda s: s.days_of_week(1, 3), (1, 2, 3)),
+    (lambda s: s.weekdays().days_of_week(4, 4), (4,)),
+])
+def test_day_of_week_slices_are_views_of_the_right_days(select, days):
+    start = pd.Timestamp("2024-01-01")
+    rows = [("A", start + pd.Timedelta(days=d), h, np.nan if (d, h) == (3, 5) else float(d * 24 + h))
+            for d in range(17) if d != 9 for h in range(24)]
+    s = series_from_frame(pd.DataFrame(rows, columns=["scno", "date", "hour", "consumption"]))["A"]
+    view = select(s)
+
+    dates = [d.astype(object) for d in view.dates]
+    expected = sorted({r[1].date() for r in rows if r[1].weekday() in days})
+    assert sorted(dates) == expected
+    for day, values in zip(dates, view.values):
+        d = (day - start.date()).days
+        assert values[6] == d * 24 + 6
+    for name in ("offsets", "values", "mask", "missing"):
+        assert np.shares_memory(getattr(view, name), getattr(s, name)), name
+
+def test_categorize_series_matches_frame():
+    df = _frame()
+    from_series = categorize_client("A", "a", series_from_frame(df)["A"])
+    from_frame = categorize_client("A", "a", df)
+    assert np.isclose(from_series["avg_consumption"], from_frame["avg_consumption"])
+    assert np.isclose(from_series["variability"], from_frame["variability"])
+
+
+# ---------------- BASELINE PARITY ---------------- #
+def baseline_calculate_flexibility(df):
+    """flexibility_pred.calculate_flexibility() as it was before the batch engine, verbatim."""
+    if df.empty:
+        return None
+    df["consumption"] = pd.to_numeric(df["consumption"], errors="coerce").fillna(0.0)
+
+    # Load Factor (LF)
+    daily_profiles = df.groupby(["date", "hour"])["consumption"].sum().reset_index()
+    lf_list = [
+        g["consumption"].mean() / g["consumption"].max()
+        for _, g in daily_profiles.groupby("date") if g["consumption"].max() != 0
+    ]
+    LF = float(np.mean(lf_list)) if lf_list else None
+
+    # Load Variability Index (LVI)
+    daily_totals = df.groupby("date")["consumption"].sum()
+    LVI = float(daily_totals.std() / daily_totals.mean()) if len(daily_totals) > 1 and daily_totals.mean() != 0 else None
+
+    # Daily Load Shape Stability (DLSS)
+    pivot = daily_profiles.pivot(index="hour", columns="date", values="consumption").fillna(0)
+    DLSS = None
+    if pivot.shape[1] >= 2:
+        typical_day = pivot.mean(axis=1)
+        correlations = [
+            np.corrcoef(pivot[c], typical_day)[0, 1]
+            for c in pivot.columns if not np.isnan(np.corrcoef(pivot[c], typical_day)[0, 1])
+        ]
+        DLSS = float(np.mean(correlations)) if correlations else None
+
+    return LF, LVI, DLSS
+
+
+def edge_case_frame(seed=0, n_clients=12):
+    """
+    Clients with missing hours, gap days, all-zero and constant days and NaN
+    consumption, plus single-day, all-zero and single-hour clients.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01")
+    rows = []
+    for c in range(n_clients):
+        scno = f"C{c:02d}"
+        days = sorted(rng.choice(40, size=rng.integers(2, 30), replace=False))   # gap days
+        for d in days:
+            date = start + pd.Timedelta(days=int(d))
+            kind = rng.random()
+            hours = range(24) if rng.random() < 0.6 else sorted(rng.choice(24, size=rng.integers(1, 24), replace=False))
+            for h in hours:
+                if kind < 0.1:
+                    v = 0.0                                   # all-zero day
+                elif kind < 0.2:
+                    v = 3.5                                   # constant day
+                else:
+                    v = float(rng.gamma(2.0, 1.5))
+                    if rng.random() < 0.05:
+                        v = np.nan
+                rows.append((scno, date, h, v))
+    rows += [("SINGLE", start, h, float(h + 1)) for h in range(24)]
+    rows += [("ZERO", start + pd.Timedelta(days=d), h, 0.0) for d in range(3) for h in range(24)]
+    rows += [("ONEHOUR", start + pd.Timedelta(days=d), 7, float(d + 1)) for d in range(5)]
+    return pd.DataFrame(rows, columns=["scno", "date", "hour", "consumption"])
+
+
+def assert_matches_baseline(df, batch, rtol=1e-12):
+    """Each batch metric equals the baseline's within rtol; NaN exactly where it returns None."""
+    got = batch.set_index("scno")
+    for scno, g in df.groupby("scno"):
+        expected = baseline_calculate_flexibility(g[["date", "hour", "consumption"]].copy())
+        row = got.loc[scno]
+        for name, want in zip(("LF", "LVI", "DLSS"), expected):
+            if want is None:
+                assert np.isnan(row[name]), (scno, name)
+            else:
+                assert np.isclose(row[name], want, rtol=rtol, atol=1e-12), (scno, name, row[name], want)
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_batch_matches_baseline(processes):
+    df = edge_case_frame()
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        batch = calculate_flexibility_batch(df, chunk_size=4, processes=processes)
+        assert sorted(batch["scno"]) == sorted(df["scno"].unique())
+        assert_matches_baseline(df, batch)
+
+
+# ---------------- RUNNING STATE ---------------- #
+FOLD_TOL = 1e-12   # running sums vs the batch cube; differences seen are ~1e-14
+
+
+def daily_profiles(df):
+    """{scno: (dates, [n_days, 24] profiles)} as consumption_daily stores them: NaN rows count 0, absent hours NaN."""
+    g = df.assign(consumption=df["consumption"].fillna(0.0)).groupby(["scno", "date", "hour"])["consumption"].sum()
+    wide = g.unstack("hour").reindex(columns=range(24))
+    return {
+        scno: ([d.date() for d in part.index.get_level_values("date")], part.to_numpy())
+        for scno, part in wide.groupby(level="scno")
+    }
+
+
+def assert_metrics_close(got, row, tol):
+    """(LF, LVI, DLSS, peak_ratio) with None against a batch row with NaN."""
+    for name, v in zip(("LF", "LVI", "DLSS", "Peak_Ratio"), got):
+        if np.isnan(row[name]):
+            assert v is None, (row["scno"], name, v)
+        else:
+            assert v is not None and abs(v - row[name]) <= tol, (row["scno"], name, v, row[name])
+
+
+@pytest.mark.parametrize("step", [1, 4, 1000])
+def test_fold_matches_batch(step):
+    df = edge_case_frame(seed=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        batch = calculate_flexibility_batch(df).set_index("scno", drop=False)
+    states = {}
+    for scno, (dates, profiles) in daily_profiles(df).items():
+        for i in range(0, len(dates), step):
+            folded, rebuild = fold_many([(scno, states.get(scno), dates[i:i + step], profiles[i:i + step])])
+            if rebuild:
+                # a new hour appeared: refold from the first day, as update_states() does
+                folded, rebuild = fold_many([(scno, None, dates[:i + step], profiles[:i + step])])
+            assert not rebuild
+            states.update(folded)
+        assert states[scno].through_date == max(dates)
+    for scno, st in states.items():
+        assert_metrics_close(st.metrics(), batch.loc[scno], FOLD_TOL)
+
+
+# ---------------- ROLLING WINDOWS ---------------- #
+ROLLING_TOL = 1e-10   # add/evict sums drift with subtraction; differences seen are ~1e-14
+
+
+def test_rolling_windows_match_batch_over_each_window():
+    df = edge_case_frame(seed=2, n_clients=6)
+    windows = (3, 7, 15)
+    profiles = daily_profiles(df)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for scno, (dates, days) in profiles.items():
+            roll = RollingFlex(windows)
+            part = df[df["scno"] == scno]
+            for day, profile in zip(dates, days):
+                roll.push(day, profile)
+                for w in windows:
+                    lo = pd.Timestamp(day - timedelta(days=w))
+                    in_window = part[(part["date"] > lo) & (part["date"] <= pd.Timestamp(day))]
+                    row = calculate_flexibility_batch(in_window).iloc[0]
+                    assert_metrics_close(roll.metrics(w), row, ROLLING_TOL)
+            # advance past the last day: the shorter windows empty out
+            roll.advance(dates[-1] + timedelta(days=windows[0]))
+            assert roll.metrics(windows[0]) is None
+
+
+# ---------------- DAY TYPES ---------------- #
+FLOAT32_TOL = 1e-6   # HourlySeries stores float32; differences seen are ~2e-8
+
+
+def test_daytype_series_match_batch_per_day_type():
+    df = edge_case_frame(seed=3)
+    holidays = [pd.Timestamp("2024-01-05"), pd.Timestamp("2024-01-20")]
+    dow = df["date"].dt.dayofweek
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        out = calculate_daytype_batch(series_from_frame(df), holidays=holidays, chunk_size=5, processes=2)
+        for label, frame in out.items():
+            days = df["date"].isin(holidays) if label == HOLIDAY else dow.isin(list(DAY_PARTITIONS[label]))
+            expected = calculate_flexibility_batch(df[days]).set_index("scno", drop=False)
+            assert sorted(frame["scno"]) == sorted(expected.index), label
+            for row in frame.itertuples(index=False):
+                got = tuple(None if np.isnan(v) else v for v in (row.LF, row.LVI, row.DLSS, row.Peak_Ratio))
+                assert_metrics_close(got, expected.loc[row.scno], FLOAT32_TOL)
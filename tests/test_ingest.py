@@ -0,0 +1,168 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import date
+import pytest
+import ingest
+from fault_stub import FaultStub, serving
+from ingest import coalesce_jobs, iter_rows, parse_daily, parse_day
+from response_cache import ResponseCache
+
+
+def test_parse_day_formats():
+    hours, values, bad = parse_day([
+        {"hour": "01:00", "consumption": 2},
+        {"hour": "2:30", "consumption": "1.5"},
+        {"hour": 3, "consumption": 0.25},
+        {"hour": "04:00:00", "consumption": 1},
+    ])
+    assert hours.tolist() == [1, 2, 3, 4]
+    assert values.tolist() == [2.0, 1.5, 0.25, 1.0]
+    assert bad == 0
+
+
+def test_parse_day_counts_malformed_entries():
+    hours, values, bad = parse_day([
+        {"hour": "01:00", "consumption": 2},
+        {"hour": "bad", "consumption": 1},
+        {"hour": "25:00", "consumption": 1},
+        {"hour": True, "consumption": 1},
+        {"hour": "05:00", "consumption": None},
+        {"hour": "06:00", "consumption": "n/a"},
+        {"consumption": 1},
+        "not an entry",
+    ])
+    assert hours.tolist() == [1]
+    assert values.tolist() == [2.0]
+    assert bad == 7
+
+
+def test_parse_day_rejects_nested_consumption():
+    assert parse_daily("A", "2024-01-01", [{"hour": "01:00", "consumption": [2]}]) == []
+    hours, values, bad = parse_day([
+        {"hour": "01:00", "consumption": [2]},
+        {"hour": "02:00", "consumption": [3]},
+        {"hour": "03:00", "consumption": 4},
+    ])
+    assert hours.tolist() == [3]
+    assert values.tolist() == [4.0]
+    assert bad == 2
+
+
+# ---------------- STREAMING ---------------- #
+DAY = date(2024, 1, 2)
+
+
+def _fetch_threads():
+    return [t for t in threading.enumerate() if t.name == "ingest-fetch"]
+
+
+def test_iter_rows_is_bounded_and_stops_when_closed_early():
+    # one day per client, so every work unit is a single request
+    jobs = [(f"S{i:03d}", DAY) for i in range(200)]
+    with serving(FaultStub()) as stub:
+        rows = iter_rows(jobs, api=stub.url(), max_concurrency=2, queue_size=1)
+        first = next(rows)
+        assert len(first) == 24
+        time.sleep(0.3)
+        # one unit consumed, one queued, one blocked in each worker
+        assert len(stub.hits) <= 4
+        rows.close()
+        assert _fetch_threads() == []
+        hits = len(stub.hits)
+        time.sleep(0.1)
+        assert len(stub.hits) == hits < len(jobs)
+
+
+class _Conn:
+    def __init__(self):
+        self.commits = self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+def test_writer_error_leaves_uncommitted_days_staged(tmp_path, monkeypatch):
+    written = []
+
+    def upsert_rows(conn, table, columns, rows, **kwargs):
+        if len(written) == 2:
+            raise RuntimeError("COPY failed")
+        written.append({r[0] for r in rows})
+    monkeypatch.setattr(ingest, "upsert_rows", upsert_rows)
+    monkeypatch.setattr(ingest, "refresh_daily", lambda cur, keys: None)
+
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    conn = _Conn()
+    jobs = [(f"S{i}", DAY) for i in range(6)]
+    with serving(FaultStub()) as stub:
+        with pytest.raises(RuntimeError):
+            # one day per batch: two batches commit, the third fails
+            ingest.ingest(jobs, conn, api=stub.url(), max_concurrency=1, batch_size=24, cache=cache)
+    assert _fetch_threads() == []
+    assert conn.commits == 2 and conn.rollbacks == 1
+
+    committed = set().union(*written)
+    statuses = cache.statuses()
+    assert {s for (s, _), st in statuses.items() if st == "fetched"} == committed
+    assert all(st == "staged" for (s, _), st in statuses.items() if s not in committed)
+    assert len(statuses) > len(committed)
+    # the next run asks for every day that was not committed
+    assert sorted(cache.pending(jobs)) == sorted(j for j in jobs if j[0] not in committed)
+    cache.close()
+
+
+# ---------------- RANGE FETCH ---------------- #
+def test_coalesce_jobs_splits_runs():
+    d = lambda n: date(2024, 1, n)
+    jobs = [("B", d(1)), ("A", d(3)), ("A", d(1)), ("A", d(2)), ("A", d(2)),   # duplicate
+            ("A", d(5)),                                                       # gap
+            ("B", d(2))] + [("C", d(n)) for n in range(1, 8)]
+    assert coalesce_jobs(jobs, max_days=3) == [
+        ("A", d(1), d(3)), ("A", d(5), d(5)),
+        ("B", d(1), d(2)),                          # runs never cross clients
+        ("C", d(1), d(3)), ("C", d(4), d(6)), ("C", d(7), d(7)),
+    ]
+    assert coalesce_jobs([("C", d(n)) for n in range(1, 8)]) == [("C", d(1), d(7))]
+    assert coalesce_jobs([]) == []
+
+
+def test_range_body_is_split_into_per_day_cache_entries(tmp_path):
+    # 2024-01-02 has no entries in the body, so it is recorded empty
+    entries = [{"date": f"2024-01-0{n}T00:00:00", "hour": f"{h:02d}:00", "consumption": n + h / 100}
+               for n in (1, 3) for h in range(24)]
+    entries.append({"date": "2024-01-03", "hour": "bad", "consumption": 1})
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    jobs = [("A", date(2024, 1, n)) for n in (1, 2, 3)] + [("A", date(2024, 1, 9))]
+
+    async def main():
+        got = []
+        async with FaultStub(body=json.dumps(entries).encode()) as stub:
+            await ingest.fetch_jobs(jobs, got.extend, api=stub.url(), cache=cache,
+                                    range_api=stub.url("/range?scno={}&from={}&to={}"), max_days=31)
+            return got, stub.paths
+    rows, paths = asyncio.run(main())
+
+    assert sorted(paths) == ["/range?scno=A&from=2024-01-01&to=2024-01-03",
+                             "/range?scno=A&from=2024-01-09&to=2024-01-09"]
+    assert sorted((r[1], r[2]) for r in rows) == [(f"2024-01-0{n}", h) for n in (1, 3) for h in range(24)]
+    assert cache.statuses() == {
+        ("A", "2024-01-01"): "staged", ("A", "2024-01-02"): "empty",
+        ("A", "2024-01-03"): "staged", ("A", "2024-01-09"): "empty",
+    }
+    # each day's cached body holds that day's entries only, as a per-day fetch would
+    day3 = json.loads(cache.get("A", "2024-01-03"))
+    assert len(day3) == 25 and {e["date"][:10] for e in day3} == {"2024-01-03"}
+    assert parse_daily("A", "2024-01-03", day3) == [r for r in rows if r[1] == "2024-01-03"]
+    assert json.loads(cache.get("A", "2024-01-02")) == []
+    cache.close()
@@ -0,0 +1,59 @@
+import math
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from flexibility_pred import rank_clients
+from ranking import IncrementalRanker
+
+
+def _expected(raw):
+    """{scno: (index, rank)} from rank_clients over the whole population."""
+    df = pd.DataFrame(
+        [(scno,) + tuple(np.nan if v is None else v for v in m) for scno, m in raw.items()],
+        columns=["scno", "LF", "LVI", "DLSS"],
+    )
+    ranked = rank_clients(df)
+    return {r.scno: (r.Flexibility_Index, r.Flexibility_Rank) for r in ranked.itertuples()}
+
+
+def _metric(rng):
+    # few distinct values, so ties and moving min/max are common
+    if rng.random() < 0.1:
+        return None
+    return tuple(None if rng.random() < 0.05 else rng.randint(0, 8) / 8 for _ in range(3))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_ranker_matches_rank_clients(seed):
+    rng = random.Random(seed)
+    scnos = [f"S{i}" for i in range(rng.randint(1, 30))]
+    raw = {scno: _metric(rng) for scno in scnos}
+    stored = {}
+
+    ranker = IncrementalRanker()
+    for steps in range(40):
+        changes = raw if steps == 0 else {s: _metric(rng) for s in rng.sample(scnos, rng.randint(1, 4))}
+        raw.update(changes)
+        for row in ranker.update(changes):
+            stored[row[0]] = row
+
+        expected = _expected({s: (None, None, None) if m is None else m for s, m in raw.items()})
+        for scno in scnos:
+            _, _, _, _, idx, rank = stored[scno]
+            if scno in expected:
+                assert idx == pytest.approx(expected[scno][0])
+                assert rank == expected[scno][1]
+            else:
+                assert idx is None and rank is None
+
+
+def test_from_rows_emits_only_stale_rows():
+    rows = [("A", 0.2, 0.1, 0.5, None, None), ("B", 0.8, 0.4, 0.9, None, None)]
+    ranker = IncrementalRanker.from_rows(rows)
+    first = {r[0]: r for r in ranker.update({})}
+    assert first["A"][5] == 1 and first["B"][5] == 2
+    assert math.isclose(first["A"][4], 2 / 3)
+
+    reloaded = IncrementalRanker.from_rows(list(first.values()))
+    assert reloaded.update({}) == []
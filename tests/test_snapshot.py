@@ -0,0 +1,69 @@
+import csv
+from datetime import date
+import pandas as pd
+import pytest
+from db import load_consumption
+
+pytest.importorskip("pyarrow")
+from snapshot import ConsumptionSnapshot
+
+
+class CopyConn:
+    """Stands in for a psycopg2 connection: load_consumption's COPY returns rows for the requested scnos."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return self
+
+    def mogrify(self, query, params):
+        self.scnos = params[0] if params else None
+        return query.encode()
+
+    def copy_expert(self, sql, buf):
+        writer = csv.writer(buf)
+        for row in self.rows:
+            if self.scnos is None or row[0] in self.scnos:
+                writer.writerow(row)
+
+    def close(self):
+        pass
+
+
+def _rows():
+    rows = []
+    for scno in ("A", "B/1"):   # "/" must survive the partition path
+        for day in pd.date_range("2024-03-30", "2024-04-02"):
+            rows += [(scno, day.strftime("%Y-%m-%d"), h, float(h) + (scno == "A")) for h in range(0, 24, 6)]
+    return rows
+
+
+def _expected(rows, scnos, start, end):
+    kept = [r for r in rows if r[0] in scnos and start.isoformat() <= r[1] <= end.isoformat()]
+    df = load_consumption(CopyConn(sorted(kept)))
+    return df.sort_values(["scno", "date", "hour"]).reset_index(drop=True)
+
+
+def test_export_upsert_read_round_trip(tmp_path):
+    rows = _rows()
+    snap = ConsumptionSnapshot(str(tmp_path / "snap"))
+    assert snap.export(CopyConn(rows), scnos=["A", "B/1"]) == len(rows)
+
+    # Overwrite two hours and add new ones in the same client-month
+    batch = [("A", "2024-04-01", 0, 100.0), ("A", "2024-04-01", 6, 106.0),
+             ("A", "2024-04-02", 1, 1.5), ("A", "2024-04-02", 23, 23.5)]
+    snap.upsert(batch)
+    final = {r[:3]: r for r in rows}
+    final.update({r[:3]: r for r in batch})
+    final = list(final.values())
+
+    # scno and month pruning: only A's April directory matches
+    got = snap.read(["A"], date(2024, 4, 1), date(2024, 4, 30))
+    got = got.sort_values(["scno", "date", "hour"]).reset_index(drop=True)
+    want = _expected(final, {"A"}, date(2024, 4, 1), date(2024, 4, 30))
+    pd.testing.assert_frame_equal(got, want)
+    assert got.loc[(got["date"] == "2024-04-01") & (got["hour"] == 6), "consumption"].item() == 106.0
+
+    everything = snap.read().sort_values(["scno", "date", "hour"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(everything, _expected(final, {"A", "B/1"}, date(2024, 3, 1), date(2024, 4, 30)))
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from flex_engine import HOLIDAY, PEAK_HOURS, calculate_flexibility_batch
+from tariff import TARIFFS, Tariff, Window, tariff_ratios
+
+
+def _frame():
+    """Three clients over ten days, with a missing hour, a NaN and an all-zero client."""
+    rng = np.random.default_rng(0)
+    rows = []
+    for scno in ("A", "B"):
+        for d in pd.date_range("2024-03-28", periods=10):
+            rows += [(scno, d, h, float(rng.gamma(2.0, 1.5))) for h in range(24) if (scno, h) != ("B", 3)]
+    rows[5] = rows[5][:3] + (np.nan,)
+    rows += [("Z", pd.Timestamp("2024-03-28"), h, 0.0) for h in range(24)]
+    return pd.DataFrame(rows, columns=["scno", "date", "hour", "consumption"])
+
+
+def test_current_tariff_peak_ratio_matches_flex_engine():
+    df = _frame()
+    ratios = tariff_ratios(df, TARIFFS)
+    peak = ratios[(ratios["tariff"] == "current") & (ratios["tou_window"] == "peak")].set_index("scno")["ratio"]
+    expected = calculate_flexibility_batch(df).set_index("scno")["Peak_Ratio"]
+    assert sorted(peak.index) == sorted(expected.index)
+    # the series behind tariff_ratios are float32
+    assert np.allclose(peak[expected.index], expected, rtol=1e-6, atol=1e-9)
+    assert peak["Z"] == 0.0
+    # every client's windows of one tariff add up to all of its usage
+    current = ratios[(ratios["tariff"] == "current") & (ratios["scno"] != "Z")]
+    assert np.allclose(current.groupby("scno")["ratio"].sum(), 1.0)
+
+
+def test_masks_month_limited_window():
+    tariff = Tariff("t", [Window("peak", range(12, 16), "weekday", months=(4,)), Window("peak", range(18, 22))])
+    dates = pd.to_datetime(["2024-03-29", "2024-04-01", "2024-04-06"])   # Fri March, Mon April, Sat April
+    peak, off = tariff.masks(dates)
+    assert tariff.window_names == ["peak", "off_peak"]
+    assert not peak[0, 12:16].any()          # weekday, but outside the months
+    assert peak[1, 12:16].all()              # weekday in April
+    assert not peak[2, 12:16].any()          # April, but weekend
+    assert peak[:, 18:22].all()
+    assert (peak ^ off).all()                # windows are exclusive and cover every hour
+
+
+def test_masks_holiday_window():
+    holiday = pd.Timestamp("2024-04-03")   # a Wednesday
+    tariff = Tariff("t", [Window("holiday", range(24), HOLIDAY), Window("peak", PEAK_HOURS, "weekday")],
+                    holidays=[holiday])
+    masks = tariff.masks(pd.to_datetime(["2024-04-02", holiday]))
+    hol, peak, off = (masks[tariff.window_names.index(n)] for n in ("holiday", "peak", "off_peak"))
+    assert hol[1].all() and not peak[1].any()
+    assert not hol[0].any() and peak[0, PEAK_HOURS].all()
+    assert off[0].sum() == 24 - len(PEAK_HOURS)
+
+
+@pytest.mark.parametrize("holiday_as, peak_on_holiday", [(6, False), (0, True)])
+def test_masks_holiday_treated_as_day_of_week(holiday_as, peak_on_holiday):
+    holiday = pd.Timestamp("2024-04-03")   # a Wednesday; without a HOLIDAY window it counts as holiday_as
+    tariff = Tariff("t", [Window("peak", PEAK_HOURS, "weekday")], holidays=[holiday], holiday_as=holiday_as)
+    peak, _ = tariff.masks(pd.to_datetime([holiday, "2024-04-04"]))
+    assert peak[0, PEAK_HOURS].all() == peak_on_holiday
+    assert peak[0].any() == peak_on_holiday
+    assert peak[1, PEAK_HOURS].all()
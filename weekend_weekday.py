@@ -1,9 +1,12 @@
-import pandas as pd
 import numpy as np
 from datetime import datetime
 import psycopg2
 from psycopg2.extras import execute_values
 import warnings
+from db import merge_frames, upsert_rows, frame_rows
+from summary_views import ensure_summary_views, refresh_summary_views, load_daytype_metrics
+from rank_index import notify_rank_change
+from telemetry import TELEMETRY
 warnings.filterwarnings("ignore")
 
 # ---------------- CONFIG ---------------- #
@@ -16,51 +19,12 @@ DB_CONFIG = {
 }
 
 IGNORE_SCNOS = {"ELR1115", "ELR1158"}
-
-# Define peak hours (6–10 AM and 6–10 PM)
-PEAK_HOURS = list(range(6, 10)) + list(range(18, 22))
+REPORT_PATH = "weekend_weekday_run.json"   # run telemetry; use a .prom name for Prometheus text
 
 # ---------------- DB CONNECT ---------------- #
 def get_conn():
     return psycopg2.connect(**DB_CONFIG)
 
-# ---------------- CALCULATE FLEXIBILITY ---------------- #
-def calculate_flexibility(df):
-    if df.empty:
-        return None
-
-    df["consumption"] = pd.to_numeric(df["consumption"], errors="coerce").fillna(0.0)
-
-    # Load Factor (LF)
-    daily_profiles = df.groupby(["date", "hour"])["consumption"].sum().reset_index()
-    lf_list = [
-        g["consumption"].mean() / g["consumption"].max()
-        for _, g in daily_profiles.groupby("date") if g["consumption"].max() != 0
-    ]
-    LF = float(np.mean(lf_list)) if lf_list else None
-
-    # Load Variability Index (LVI)
-    daily_totals = df.groupby("date")["consumption"].sum()
-    LVI = float(daily_totals.std() / daily_totals.mean()) if len(daily_totals) > 1 and daily_totals.mean() != 0 else None
-
-    # Daily Load Shape Stability (DLSS)
-    pivot = daily_profiles.pivot(index="hour", columns="date", values="consumption").fillna(0)
-    DLSS = None
-    if pivot.shape[1] >= 2:
-        typical_day = pivot.mean(axis=1)
-        correlations = [
-            np.corrcoef(pivot[c], typical_day)[0, 1]
-            for c in pivot.columns if not np.isnan(np.corrcoef(pivot[c], typical_day)[0, 1])
-        ]
-        DLSS = float(np.mean(correlations)) if correlations else None
-
-    # Peak-hour usage ratio
-    peak_usage = df[df["hour"].isin(PEAK_HOURS)]["consumption"].sum()
-    total_usage = df["consumption"].sum()
-    peak_ratio = peak_usage / total_usage if total_usage > 0 else 0
-
-    return LF, LVI, DLSS, peak_ratio
-
 # ---------------- RANK CLIENTS ---------------- #
 def rank_clients(df, period_label):
     if df.empty:
@@ -95,89 +59,49 @@ def main():
     clients = [(r[0], r[1]) for r in cur.fetchall() if r[0] not in IGNORE_SCNOS]
     print(f"\n🚀 Found {len(clients)} clients to process (ignored: {', '.join(IGNORE_SCNOS)}).\n")
 
-    weekday_results, weekend_results = [], []
-
+    # --- Weekday / weekend metrics computed in Postgres by the summary view --- #
+    with TELEMETRY.stage("summary_views"):
+        ensure_summary_views(conn)
+        refresh_summary_views(conn)
+    scnos = [scno for scno, _ in clients]
+    names = dict(clients)
+    with TELEMETRY.stage("load"):
+        weekday_results = load_daytype_metrics(conn, "weekday", scnos)
+        weekend_results = load_daytype_metrics(conn, "weekend", scnos)
+    loaded = set(weekday_results["scno"]) | set(weekend_results["scno"])
     for scno, name in clients:
-        df = pd.read_sql("SELECT date, hour, consumption FROM consumption WHERE scno=%s;", conn, params=(scno,))
-        if df.empty:
+        if scno not in loaded:
             print(f"⚠️ No data for {name} ({scno}), skipping.")
-            continue
-
-        df["date"] = pd.to_datetime(df["date"])
-        df["day_type"] = df["date"].dt.dayofweek.apply(lambda x: "Weekend" if x >= 5 else "Weekday")
-
-        df_weekday = df[df["day_type"] == "Weekday"]
-        df_weekend = df[df["day_type"] == "Weekend"]
-
-        weekday_flex = calculate_flexibility(df_weekday)
-        weekend_flex = calculate_flexibility(df_weekend)
-
-        if weekday_flex:
-            lf, lvi, dlss, peak_ratio = weekday_flex
-            weekday_results.append({
-                "scno": scno, "name": name, "LF": lf, "LVI": lvi,
-                "DLSS": dlss, "Peak_Ratio": peak_ratio
-            })
 
-        if weekend_flex:
-            lf, lvi, dlss, peak_ratio = weekend_flex
-            weekend_results.append({
-                "scno": scno, "name": name, "LF": lf, "LVI": lvi,
-                "DLSS": dlss, "Peak_Ratio": peak_ratio
-            })
+    weekday_results["name"] = weekday_results["scno"].map(names)
+    weekend_results["name"] = weekend_results["scno"].map(names)
 
-    ranked_weekday = rank_clients(pd.DataFrame(weekday_results), "Weekday")
-    ranked_weekend = rank_clients(pd.DataFrame(weekend_results), "Weekend")
+    with TELEMETRY.stage("rank"):
+        ranked_weekday = rank_clients(weekday_results, "Weekday")
+        ranked_weekend = rank_clients(weekend_results, "Weekend")
 
     print("\n🏆 Weekday and Weekend Rankings calculated with off-peak adjustment.\n")
 
-    # --- Store results --- #
-    for _, row in ranked_weekday.iterrows():
-        cur.execute("""
-            INSERT INTO flexibility_metrics (
-                scno, lf_weekday, lvi_weekday, dlss_weekday,
-                peak_ratio_weekday, reason_weekday,
-                flexibility_rank_weekday, calculated_at
-            )
-            VALUES (%s,%s,%s,%s,%s,%s,%s,NOW())
-            ON CONFLICT (scno) DO UPDATE
-            SET lf_weekday=EXCLUDED.lf_weekday,
-                lvi_weekday=EXCLUDED.lvi_weekday,
-                dlss_weekday=EXCLUDED.dlss_weekday,
-                peak_ratio_weekday=EXCLUDED.peak_ratio_weekday,
-                reason_weekday=EXCLUDED.reason_weekday,
-                flexibility_rank_weekday=EXCLUDED.flexibility_rank_weekday,
-                calculated_at=NOW();
-        """, (
-            row["scno"], row["LF"], row["LVI"], row["DLSS"],
-            row["Peak_Ratio"], row["Flexibility_Reason"], row["Flexibility_Rank"]
-        ))
-
-    for _, row in ranked_weekend.iterrows():
-        cur.execute("""
-            INSERT INTO flexibility_metrics (
-                scno, lf_weekend, lvi_weekend, dlss_weekend,
-                peak_ratio_weekend, reason_weekend,
-                flexibility_rank_weekend, calculated_at
-            )
-            VALUES (%s,%s,%s,%s,%s,%s,%s,NOW())
-            ON CONFLICT (scno) DO UPDATE
-            SET lf_weekend=EXCLUDED.lf_weekend,
-                lvi_weekend=EXCLUDED.lvi_weekend,
-                dlss_weekend=EXCLUDED.dlss_weekend,
-                peak_ratio_weekend=EXCLUDED.peak_ratio_weekend,
-                reason_weekend=EXCLUDED.reason_weekend,
-                flexibility_rank_weekend=EXCLUDED.flexibility_rank_weekend,
-                calculated_at=NOW();
-        """, (
-            row["scno"], row["LF"], row["LVI"], row["DLSS"],
-            row["Peak_Ratio"], row["Flexibility_Reason"], row["Flexibility_Rank"]
-        ))
-
-    conn.commit()
+    # --- Store weekday and weekend columns in one upsert --- #
+    metrics = ["LF", "LVI", "DLSS", "Peak_Ratio", "Flexibility_Reason", "Flexibility_Rank"]
+    columns = ["lf", "lvi", "dlss", "peak_ratio", "reason", "flexibility_rank"]
+    period_frames = []
+    for ranked, suffix in ((ranked_weekday, "weekday"), (ranked_weekend, "weekend")):
+        part = ranked.reindex(columns=["scno"] + metrics)
+        part["Flexibility_Rank"] = part["Flexibility_Rank"].astype("Int64")
+        part.columns = ["scno"] + [f"{c}_{suffix}" for c in columns]
+        period_frames.append(part)
+    # Every loaded client gets every column, so one that dropped out of a ranking is cleared
+    merged = merge_frames(period_frames, keys=loaded)
+    out_columns = list(merged.columns)
+    with TELEMETRY.stage("write"):
+        upsert_rows(conn, "flexibility_metrics", out_columns, frame_rows(merged, out_columns), update=out_columns[1:])
+        conn.commit()
+        notify_rank_change(conn)
     cur.close()
     conn.close()
     print("\n✅ Rankings stored successfully, including off-peak reason!")
+    print(f"📈 Run report written to {TELEMETRY.write_report(REPORT_PATH)}")
 
 if __name__ == "__main__":
     main()